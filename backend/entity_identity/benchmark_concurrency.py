@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/29
+# @File  : benchmark_concurrency.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 启动一个本地的模拟大模型服务(固定延迟返回JSON)，测试/api/entity_indentify在llm模式下的并发吞吐
+# 同时对比同步LLMClient在事件循环中调用时的吞吐
+# python benchmark_concurrency.py --requests 50 --latency 0.5
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import threading
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+
+def create_mock_llm_app(latency):
+    mock_app = FastAPI()
+
+    @mock_app.post("/v1/chat/completions")
+    async def chat_completions(body: dict):
+        await asyncio.sleep(latency)
+        content = json.dumps({"疾病": ["糖尿病"], "药品": ["盐酸二甲双胍片"]}, ensure_ascii=False)
+        return {
+            "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    return mock_app
+
+
+def start_mock_llm(port, latency):
+    server = uvicorn.Server(uvicorn.Config(create_mock_llm_app(latency), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run_requests(app, num_requests, match_db=True):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://entity", timeout=600) as client:
+        async def one(i):
+            # 每个请求内容不同，不命中缓存
+            data = {"match_db": match_db, "content": f"第{i}个回答: 糖尿病患者常用盐酸二甲双胍片。"}
+            response = await client.post("/api/entity_indentify", json=data)
+            return response.json()["msg"] == "success"
+
+        start_time = time.time()
+        results = await asyncio.gather(*[one(i) for i in range(num_requests)])
+        return time.time() - start_time, sum(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="entity_indentify并发吞吐测试")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟大模型每次调用的延迟秒数")
+    parser.add_argument("--port", type=int, default=18765)
+    args = parser.parse_args()
+
+    start_mock_llm(args.port, args.latency)
+    os.environ["ENTITY_EXTRACT_MODE"] = "llm"
+    os.environ["DEEPSEEK_BASEURL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["DEEPSEEK_API_KEY"] = "mock"
+    os.environ["DEEPSEEK_MODEL"] = "mock"
+    import entity_main
+
+    cost, success = asyncio.run(run_requests(entity_main.app, args.requests))
+    print(f"异步客户端: {args.requests} 个请求, 成功 {success}, 耗时 {cost:.2f}s, {args.requests / cost:.1f} req/s")
+
+    # 对比: 同步客户端在事件循环中调用，请求只能一个一个处理
+    async def sync_compute(content, match_db):
+        return entity_main.entity_instance.extract_and_query_disease(content, match_db)
+
+    entity_main.entity_instance.aextract_and_query_disease = sync_compute
+    entity_main.result_cache._data.clear()
+    num_sync = max(1, min(args.requests, 10))
+    cost, success = asyncio.run(run_requests(entity_main.app, num_sync))
+    print(f"同步客户端: {num_sync} 个请求, 成功 {success}, 耗时 {cost:.2f}s, {num_sync / cost:.1f} req/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/29
+# @File  : benchmark_matcher.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 词典匹配每kB文本的耗时，和大模型抽取每次调用的耗时对比
+# python benchmark_matcher.py --names 200000
+# python benchmark_matcher.py --llm  # 同时测试大模型抽取，需要配置DEEPSEEK_API_KEY
+
+import os
+import time
+import json
+import random
+import argparse
+from entity_matcher import EntityMatcher
+
+CHARS = "的一是不了在人有我他这个们中来上大为和国地到以说时要就出会可也你对生能而子那得于着下自之年过发后作里用道行所然家种事成方多经么去法学如都同现没动面起看定天分还进好小部其些主样理心她本前开但因只从想实意"
+
+
+def build_table_data(cache_file, num_names, seed=42):
+    """
+    cache.json中的真实疾病和药品，加上随机生成的药品名，模拟药品库的规模
+    """
+    with open(cache_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    table_data = {
+        "disease": {row["disease_name"]: row for row in data["disease"]},
+        "drugs_info": {row["med_name"]: row for row in data["drugs_info"]},
+    }
+    rng = random.Random(seed)
+    suffixes = ["片", "胶囊", "注射液", "颗粒", "缓释片", "口服液"]
+    while len(table_data["drugs_info"]) < num_names:
+        name = "".join(rng.choice(CHARS) for _ in range(rng.randint(2, 5))) + rng.choice(suffixes)
+        table_data["drugs_info"][name] = {"med_name": name}
+    return table_data
+
+
+def build_text(table_data, length, seed=42):
+    rng = random.Random(seed)
+    names = list(table_data["disease"]) + list(table_data["drugs_info"])[:20]
+    parts = []
+    while sum(len(one) for one in parts) < length:
+        parts.append("".join(rng.choice(CHARS) for _ in range(rng.randint(10, 40))))
+        parts.append(rng.choice(names))
+    return "，".join(parts)[:length]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="词典匹配和大模型抽取的耗时对比")
+    parser.add_argument("--cache_file", default="cache.json")
+    parser.add_argument("--names", type=int, default=200000, help="词典中的名称数量")
+    parser.add_argument("--chars", type=int, default=2000, help="每段文本的字数")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--llm", action="store_true", help="测试大模型抽取")
+    parser.add_argument("--llm_rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    table_data = build_table_data(args.cache_file, args.names)
+    start_time = time.time()
+    matcher = EntityMatcher(table_data)
+    print(f"构建自动机: {len(table_data['disease']) + len(table_data['drugs_info'])} 个名称, 耗时 {time.time() - start_time:.2f}s")
+
+    text = build_text(table_data, args.chars)
+    text_kb = len(text.encode("utf-8")) / 1024
+    result = matcher.match(text)
+    start_time = time.time()
+    for _ in range(args.rounds):
+        matcher.match(text)
+    cost = (time.time() - start_time) / args.rounds
+    print(f"词典匹配: 文本 {text_kb:.1f}kB, 每次 {cost * 1000:.2f}ms, {cost * 1e6 / text_kb:.0f}µs/kB, "
+          f"疾病 {len(result['疾病'])} 个, 药品 {len(result['药品'])} 个")
+
+    if args.llm:
+        os.environ["ENTITY_EXTRACT_MODE"] = "llm"
+        from entity_main import EntityInterface
+        entity = EntityInterface()
+        entity.extract_mode = "llm"
+        start_time = time.time()
+        for _ in range(args.llm_rounds):
+            entity.extract_entities_from_text(text)
+        cost = (time.time() - start_time) / args.llm_rounds
+        print(f"大模型抽取: 每次 {cost:.2f}s, {cost * 1e6 / text_kb:.0f}µs/kB")
+
+
+if __name__ == '__main__':
+    main()
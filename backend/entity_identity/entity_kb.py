@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/30
+# @File  : entity_kb.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 疾病库和药品库的本地SQLite存储，只读打开并使用mmap，多个worker共用操作系统的页缓存；
+# 启动时只读取名称和别名，完整的行(overview、component等长字段)只在匹配到时查询
+# python entity_kb.py --cache_file cache.json --db entity_kb.sqlite3
+import os
+import json
+import zlib
+import fcntl
+import sqlite3
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# 每个表的名称字段
+TABLE_NAME_FIELDS = {
+    "disease": "disease_name",
+    "drugs_info": "med_name",
+}
+# mmap的大小，超过文件大小时整个文件都通过mmap读取
+ENTITY_KB_MMAP_SIZE = int(os.getenv("ENTITY_KB_MMAP_SIZE", 1 << 30))
+
+
+def split_aliases(row):
+    aliases = row.get("alias") or []
+    if isinstance(aliases, str):
+        aliases = aliases.replace("，", ",").split(",")
+    return [alias.strip() for alias in aliases if alias and alias.strip()]
+
+
+def build_entity_kb(data, db_path):
+    """
+    把{表名: [行]}写入SQLite，先写临时文件再替换，正在读取的worker不受影响
+    Args:
+        data: {"disease": [行], "drugs_info": [行]}，和cache.json的格式相同
+        db_path: SQLite文件路径
+    Returns:
+        dict: 每个表写入的行数
+    """
+    # 每次生成使用不同的临时文件，多个worker同时生成时不会写同一个文件
+    fd, temp_path = tempfile.mkstemp(prefix=f"{os.path.basename(db_path)}.", suffix=".tmp",
+                                     dir=os.path.dirname(os.path.abspath(db_path)))
+    os.close(fd)
+    conn = sqlite3.connect(temp_path)
+    counts = {}
+    try:
+        # data是zlib压缩后的json，overview和component这类长字段压缩后占用小很多
+        conn.execute("CREATE TABLE entity (table_name TEXT NOT NULL, name TEXT NOT NULL, data BLOB NOT NULL)")
+        conn.execute("CREATE TABLE keyword (keyword TEXT NOT NULL, table_name TEXT NOT NULL, name TEXT NOT NULL)")
+        for table_name, rows in data.items():
+            if table_name not in TABLE_NAME_FIELDS:
+                raise Exception(f"不支持的表名: {table_name},请设置缓存的表名称")
+            name_field = TABLE_NAME_FIELDS[table_name]
+            entities, keywords = {}, []
+            for row in rows:
+                row = {key: value for key, value in row.items() if key != "match_word"}
+                name = row[name_field]
+                # 同名的行保留最后一个，和之前按名称构建字典的行为一致
+                entities[name] = (table_name, name, zlib.compress(json.dumps(row, ensure_ascii=False).encode("utf-8")))
+                keywords.append((name, table_name, name))
+                keywords.extend((alias, table_name, name) for alias in split_aliases(row))
+            conn.executemany("INSERT INTO entity VALUES (?, ?, ?)", entities.values())
+            conn.executemany("INSERT INTO keyword VALUES (?, ?, ?)", keywords)
+            counts[table_name] = len(rows)
+        # 全部写入后再建索引，比逐行维护索引快
+        conn.execute("CREATE UNIQUE INDEX entity_name ON entity (table_name, name)")
+        conn.commit()
+        conn.execute("VACUUM")
+    except BaseException:
+        conn.close()
+        os.remove(temp_path)
+        raise
+    conn.close()
+    os.replace(temp_path, db_path)
+    return counts
+
+
+@contextmanager
+def build_lock(db_path):
+    """
+    多个worker之间的文件锁，检查SQLite是否过期和重新生成都在锁内进行，只有一个worker生成
+    """
+    with open(f"{db_path}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class EntityKB(object):
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path: build_entity_kb生成的SQLite文件
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _conn(self):
+        # sqlite连接不能跨线程使用，每个线程一个只读连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={ENTITY_KB_MMAP_SIZE}")
+            self._local.conn = conn
+        return conn
+
+    def keywords(self):
+        """
+        Returns:
+            list[(关键词, 表名, 数据库中的名称)]
+        """
+        return self._conn().execute("SELECT keyword, table_name, name FROM keyword").fetchall()
+
+    def has(self, table_name, name):
+        row = self._conn().execute("SELECT 1 FROM entity WHERE table_name = ? AND name = ?", (table_name, name)).fetchone()
+        return row is not None
+
+    def get_many(self, table_name, names):
+        """
+        按名称查询完整的行，每次返回新的字典
+        Returns:
+            dict: {名称: 行}，不存在的名称不返回
+        """
+        names = list(dict.fromkeys(names))
+        if not names:
+            return {}
+        placeholders = ",".join("?" * len(names))
+        rows = self._conn().execute(
+            f"SELECT name, data FROM entity WHERE table_name = ? AND name IN ({placeholders})", [table_name] + names
+        ).fetchall()
+        return {name: json.loads(zlib.decompress(data)) for name, data in rows}
+
+    def count(self, table_name):
+        return self._conn().execute("SELECT COUNT(*) FROM entity WHERE table_name = ?", (table_name,)).fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把cache.json转换成实体识别使用的SQLite")
+    parser.add_argument("--cache_file", default="cache.json")
+    parser.add_argument("--db", default="entity_kb.sqlite3")
+    args = parser.parse_args()
+    with open(args.cache_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    counts = build_entity_kb(data, args.db)
+    print(f"转换完成: {counts}, 文件大小: {os.path.getsize(args.db) / 1024 / 1024:.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -21,11 +21,26 @@ from fastapi import FastAPI,Request
 from fastapi.middleware.cors import CORSMiddleware
 import random
 from pydantic import BaseModel
-from model_config import LLMType, LLMClient
+from model_config import LLMType, LLMClient, AsyncLLMClient
+from entity_matcher import EntityMatcher
+from entity_kb import EntityKB, build_entity_kb, build_lock
+from result_cache import ResultCache, content_key
 import uvicorn
 
 app = FastAPI()
 
+# dict: 只用词典匹配; dict+llm: 词典匹配后用大模型消歧; llm: 大模型抽取后再和词典比对
+ENTITY_EXTRACT_MODE = os.getenv("ENTITY_EXTRACT_MODE", "dict")
+# 别名文件，格式: {"disease": {别名: 疾病名}, "drugs_info": {别名: 药品名}}
+ENTITY_ALIAS_FILE = os.getenv("ENTITY_ALIAS_FILE", "")
+# 疾病库和药品库的本地SQLite，不存在或比cache.json旧时从cache.json生成
+ENTITY_KB_PATH = os.getenv("ENTITY_KB_PATH", "entity_kb.sqlite3")
+# 构建好的Aho-Corasick自动机，词典没有变化时多个worker直接加载，不用各自构建
+ENTITY_AUTOMATON_PATH = os.getenv("ENTITY_AUTOMATON_PATH", f"{ENTITY_KB_PATH}.automaton")
+# 识别结果缓存的数量上限和过期秒数
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", 10000))
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", 3600))
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -56,33 +71,78 @@ class EntityInterface():
 以下是输入文本：
 {content}
 """
-        self.model_client = LLMClient(llm_type=LLMType.DEEPSEEK)
-        data = self.cache_database()
-        self.table_data = self.table_data_convert(data)
-
-    def table_data_convert(self, data):
-        """
-        self.table_data 转换成数据库格式
-        """
-        table_data = {}
-        for table_name, tb_data in data.items():
-            one_table_name_data = {}
-            for one_data in tb_data:
-                if table_name == "disease":
-                    one_table_name_data[one_data["disease_name"]] = one_data
-                elif table_name == "drugs_info":
-                    one_table_name_data[one_data["med_name"]] = one_data
-                else:
-                    raise Exception(f"不支持的表名: {table_name},请设置缓存的表名称")
-            table_data[table_name] = one_table_name_data
-        return table_data
+        self.disambiguate_prompt = """
+你是一个医学信息抽取助手，下面的候选词是通过词典在文本中匹配到的疾病和药品，请判断每个候选词在文本中是否确实表示该疾病或药品，去掉误匹配的词。
+候选词：
+{candidates}
+请返回以下JSON格式，只能包含候选词中的词：
+```json
+{{
+  "疾病": [疾病1, 疾病2, ...],
+  "药品": [药品1, 药品2, ...]
+}}
+```
+只返回提取结果，不要解释。
+以下是输入文本：
+{content}
+"""
+        self.extract_mode = ENTITY_EXTRACT_MODE
+        # 只有需要大模型时才初始化，词典模式下不需要配置模型的key
+        self._model_client = None
+        self._async_model_client = None
+        # 只读取名称和别名构建自动机，完整的行在匹配到之后再从SQLite查询
+        self.kb = EntityKB(self.cache_database())
+        keywords = self.kb.keywords() + self.load_aliases()
+        with build_lock(ENTITY_AUTOMATON_PATH):
+            self.matcher = EntityMatcher.from_keywords(keywords, cache_path=ENTITY_AUTOMATON_PATH)
+
+    @property
+    def model_client(self):
+        if self._model_client is None:
+            self._model_client = LLMClient(llm_type=LLMType.DEEPSEEK)
+        return self._model_client
+
+    @property
+    def async_model_client(self):
+        # 在事件循环中第一次使用时创建，连接池绑定到服务的事件循环
+        if self._async_model_client is None:
+            self._async_model_client = AsyncLLMClient(llm_type=LLMType.DEEPSEEK)
+        return self._async_model_client
+
+    def load_aliases(self):
+        """
+        读取别名文件，没有配置时返回空
+        Returns:
+            list[(别名, 表名, 数据库中的名称)]，只保留数据库中存在的名称
+        """
+        if not ENTITY_ALIAS_FILE:
+            return []
+        with open(ENTITY_ALIAS_FILE, "r", encoding="utf-8") as f:
+            aliases = json.load(f)
+        return [(alias, table_name, name) for table_name, table_aliases in aliases.items()
+                for alias, name in table_aliases.items() if self.kb.has(table_name, name)]
+
     def cache_database(self):
+        """
+        多个worker同时启动时，检查和生成都在文件锁内，只有一个worker生成，其它worker等待后直接使用生成好的文件
+        Returns:
+            str: SQLite文件路径
+        """
+        with build_lock(ENTITY_KB_PATH):
+            return self._cache_database()
+
+    def _cache_database(self):
         """
         因为数据查询太慢了，我最好把数据缓存下来放到本地
         如果不存在缓存文件，那么获取并缓存，如果存在，那么直接使用
-        disease和drugs_info
+        disease和drugs_info，缓存转换成SQLite后，多个worker只读共用
+        Returns:
+            str: SQLite文件路径
         """
         cache_file = "cache.json"
+        if os.path.exists(ENTITY_KB_PATH) and (not os.path.exists(cache_file) or os.path.getmtime(ENTITY_KB_PATH) >= os.path.getmtime(cache_file)):
+            print("实体库SQLite已存在，直接使用。")
+            return ENTITY_KB_PATH
         table_fields = {
             "disease": ["id", "disease_name","overview"],
             "drugs_info": ["id","drug_id","med_name","component"]
@@ -103,14 +163,41 @@ class EntityInterface():
             print("缓存文件已存在，直接使用本地数据。")
             with open(cache_file, "r", encoding="utf-8") as f:
                 data = json.load(f)
-        return data
+        counts = build_entity_kb(data, ENTITY_KB_PATH)
+        print(f"实体库SQLite生成完毕: {counts}")
+        return ENTITY_KB_PATH
 
     def extract_entities_from_text(self, content):
         """
-        识别药品和疾病
+        识别药品和疾病，根据extract_mode选择词典匹配或大模型
         content： 文本内容
         """
-        prompt = self.prompt.format(content=content.strip())
+        if self.extract_mode == "llm":
+            return self.llm_extract_entities(self.prompt.format(content=content.strip()))
+        json_answer = self.matcher.match(content)
+        if self.extract_mode == "dict+llm" and (json_answer["疾病"] or json_answer["药品"]):
+            return self.disambiguate_entities(content, json_answer)
+        return True, json_answer
+
+    def disambiguate_entities(self, content, candidates):
+        """
+        用大模型去掉词典误匹配的候选词，大模型出错时保留全部候选词
+        Args:
+            content: 文本内容
+            candidates: 词典匹配的结果 {"疾病": [], "药品": []}
+        """
+        prompt = self.disambiguate_prompt.format(candidates=json.dumps(candidates, ensure_ascii=False), content=content.strip())
+        status, json_answer = self.llm_extract_entities(prompt)
+        if not status:
+            logging.warning("大模型消歧失败，使用词典匹配的全部结果")
+            return True, candidates
+        return True, {key: [name for name in candidates[key] if name in json_answer[key]] for key in candidates}
+
+    def llm_extract_entities(self, prompt):
+        """
+        调用大模型识别药品和疾病，输出不符合格式时带上错误信息重试
+        prompt： 完整的提示词
+        """
         max_retries = 5
         retries = 0
         all_errors = []
@@ -122,18 +209,7 @@ class EntityInterface():
                 if error_messages and retries % 2 == 1:  # 奇数次的时候，加上错误日志
                     prompt = f"{prompt} \n{error_messages}"
                 _, final_output = self.model_client.run_inference(prompt=prompt)
-                if final_output.startswith("```json"):
-                    final_output = final_output[8:-3]
-                try:
-                    json.loads(final_output)
-                except Exception as e:
-                    raise Exception(f"输出的格式不是JSON格式,报错: {e}, 模型输出结果是: {final_output}")
-                json_answer = json.loads(final_output)
-                assert "疾病" in json_answer, "注意，请必须在结果中包含 疾病 字段"
-                assert "药品" in json_answer, "注意，请必须在结果中包含 药品 字段"
-                # 检查疾病和药品是否是list 格式
-                assert isinstance(json_answer["疾病"], list), "注意，请必须在结果中包含 疾病 字段，并且是list 格式"
-                assert isinstance(json_answer["药品"], list), "注意，请必须在结果中包含 药品 字段，并且是list 格式"
+                json_answer = self.parse_llm_output(final_output)
                 # 跳出循环
                 break
             except Exception as e:
@@ -144,6 +220,72 @@ class EntityInterface():
                 status = False
         return status, json_answer
 
+    def parse_llm_output(self, final_output):
+        """
+        解析并检查大模型输出的JSON，不符合格式时抛出异常，异常信息会作为重试时的错误提示
+        """
+        if final_output.startswith("```json"):
+            final_output = final_output[8:-3]
+        try:
+            json_answer = json.loads(final_output)
+        except Exception as e:
+            raise Exception(f"输出的格式不是JSON格式,报错: {e}, 模型输出结果是: {final_output}")
+        assert "疾病" in json_answer, "注意，请必须在结果中包含 疾病 字段"
+        assert "药品" in json_answer, "注意，请必须在结果中包含 药品 字段"
+        # 检查疾病和药品是否是list 格式
+        assert isinstance(json_answer["疾病"], list), "注意，请必须在结果中包含 疾病 字段，并且是list 格式"
+        assert isinstance(json_answer["药品"], list), "注意，请必须在结果中包含 药品 字段，并且是list 格式"
+        return json_answer
+
+    async def allm_extract_entities(self, prompt):
+        """
+        llm_extract_entities的异步版本，等待模型时不阻塞事件循环
+        prompt： 完整的提示词
+        """
+        max_retries = 5
+        retries = 0
+        error_messages = ""
+        status = True
+        json_answer = {"疾病": [], "药品": []}
+        while retries < max_retries:
+            try:
+                if error_messages and retries % 2 == 1:  # 奇数次的时候，加上错误日志
+                    prompt = f"{prompt} \n{error_messages}"
+                _, final_output = await self.async_model_client.run_inference(prompt=prompt)
+                json_answer = self.parse_llm_output(final_output)
+                break
+            except Exception as e:
+                retries += 1
+                logging.error(f"识别药品和疾病出错，错误信息是: {e}，进行第{retries}次重试")
+                error_messages = f"Your last response was incorrect because {e}"
+                status = False
+        return status, json_answer
+
+    async def aextract_entities_from_text(self, content):
+        """
+        extract_entities_from_text的异步版本，词典匹配直接在事件循环中完成
+        """
+        if self.extract_mode == "llm":
+            return await self.allm_extract_entities(self.prompt.format(content=content.strip()))
+        json_answer = self.matcher.match(content)
+        if self.extract_mode == "dict+llm" and (json_answer["疾病"] or json_answer["药品"]):
+            prompt = self.disambiguate_prompt.format(candidates=json.dumps(json_answer, ensure_ascii=False), content=content.strip())
+            status, llm_answer = await self.allm_extract_entities(prompt)
+            if not status:
+                logging.warning("大模型消歧失败，使用词典匹配的全部结果")
+                return True, json_answer
+            return True, {key: [name for name in json_answer[key] if name in llm_answer[key]] for key in json_answer}
+        return True, json_answer
+
+    async def aextract_and_query_disease(self, content, match_db=False):
+        """
+        extract_and_query_disease的异步版本
+        """
+        status, json_answer = await self.aextract_entities_from_text(content)
+        if match_db:
+            return self.query_disease_and_drugs(json_answer["疾病"], json_answer["药品"])
+        return status, json_answer
+
     def query_disease_and_drugs(self, disease_names:list[str], drug_names:list[str]) -> dict:
         """
         根据疾病名称和药品名称查询数据库，精确查询，查询结构返回给前端
@@ -155,12 +297,16 @@ class EntityInterface():
             "diseases": [],
             "drugs": []
         }
+        disease_names = [name.strip() for name in disease_names or []]
+        drug_names = [name.strip() for name in drug_names or []]
+        # 每个表一次查询，返回的是新的字典，设置match_word不会影响其它请求
+        disease_data = self.kb.get_many("disease", disease_names)
+        drug_data = self.kb.get_many("drugs_info", drug_names)
 
         # 查询疾病库
         if disease_names:
             for one_disease in disease_names:
-                one_disease = one_disease.strip()
-                one_disease_info = self.table_data["disease"].get(one_disease, {})
+                one_disease_info = disease_data.get(one_disease, {})
                 if one_disease_info:
                     # 匹配的疾病名称
                     one_disease_info["match_word"] = one_disease
@@ -170,8 +316,7 @@ class EntityInterface():
         # 查询药品库
         if drug_names:
             for one_drug in drug_names:
-                one_drug = one_drug.strip()
-                one_drug_info = self.table_data["drugs_info"].get(one_drug, {})
+                one_drug_info = drug_data.get(one_drug, {})
                 if one_drug_info:
                     # 匹配的药品名称
                     one_drug_info["match_word"] = one_drug
@@ -216,17 +361,32 @@ async def match_drug_disease_api(drug_disease_query: DrugDiseaseQuery):
 async def entity_indentify_api(query_data: EntityQuery):
     # 返回准备好的数据
     logging.info(f"entity_indentify 接受到请求参数是: {query_data}")
-    status, data = entity_instance.extract_and_query_disease(content=query_data.content, match_db=query_data.match_db)
+    key = content_key(query_data.content, query_data.match_db, entity_instance.extract_mode)
+
+    async def compute():
+        # 异步调用模型，不阻塞事件循环，相同内容的并发请求可以合并
+        return await entity_instance.aextract_and_query_disease(query_data.content, query_data.match_db)
+
+    status, data = await result_cache.get_or_compute(key, compute)
     if not status:
         result = {"code": 4001, "msg": f"发生错误: {data}", "data": {}}
     else:
         result = {"code": 0, "msg": "success", "data": data}
     return result
+@app.get("/api/entity_keywords")
+async def entity_keywords_api():
+    # 词典中的所有关键词[(关键词, 表名, 数据库中的名称)]，mq_backend用它在流式回答中增量识别实体
+    return {"code": 0, "msg": "success", "data": {"keywords": entity_instance.matcher.keywords}}
+@app.get("/api/entity_cache_stats")
+async def entity_cache_stats_api():
+    # 识别结果缓存的命中、未命中、合并的请求数
+    return {"code": 0, "msg": "success", "data": result_cache.stats()}
 @app.api_route("/ping", methods=["GET", "POST"])
 async def root(request: Request):
     return "Pong"
 
 entity_instance = EntityInterface()
+result_cache = ResultCache(max_size=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL)
 
 if __name__ == '__main__':
     uvicorn.run(app, host='0.0.0.0', port=6200)
\ No newline at end of file
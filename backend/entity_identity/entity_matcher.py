@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/29
+# @File  : entity_matcher.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 用疾病名、药品名和别名构建Aho-Corasick自动机，一次线性扫描找出文本中出现的所有词典实体
+import os
+import pickle
+import hashlib
+import tempfile
+import collections
+from array import array
+from bisect import bisect_left
+
+
+def is_word_char(char):
+    """英文字母、数字算作单词字符，英文药名需要在单词边界上才算匹配"""
+    return char.isascii() and char.isalnum()
+
+
+class AhoCorasick(object):
+    def __init__(self, ignore_case=True):
+        """
+        构建期间用每个节点一个字典的trie，build之后转换成扁平数组并释放字典，
+        几十万个关键词的自动机只占几个连续的数组，可以pickle保存后由多个worker直接加载
+        Args:
+            ignore_case: 英文不区分大小写
+        """
+        self.ignore_case = ignore_case
+        # 构建期间的trie: 每个节点的子节点字典，以及以节点结尾的最长关键词 {节点: (关键词长度, 值)}
+        self._trie = [{}]
+        self._trie_output = {}
+        # 根节点的子节点最多，保留一个字典，其它节点i的子节点是_child_chars/_child_nodes中
+        # [_child_start[i], _child_start[i+1])这一段，按字符编码排序，用二分查找
+        self._root = {}
+        self._child_start = array("i", [0, 0])
+        self._child_chars = array("i")
+        self._child_nodes = array("i")
+        self._fail = array("i", [0])
+        # 失败链上最近的有输出的节点，扫描时不用沿失败链逐个查找
+        self._dict_suffix = array("i", [0])
+        # 以节点结尾的最长关键词的长度(0表示没有)和值在_values中的下标
+        self._output_len = array("i", [0])
+        self._output_value = array("i", [0])
+        self._values = []
+        self._built = False
+        self.size = 0
+        # 最长关键词的长度，流式扫描时需要保留这么长的未确定文本
+        self.max_len = 0
+
+    def _normalize(self, text):
+        if not self.ignore_case:
+            return text
+        lowered = text.lower()
+        # 个别unicode字符lower之后长度会变，位置对不上时使用原文
+        return lowered if len(lowered) == len(text) else text
+
+    def add(self, keyword, value):
+        """
+        添加关键词，重复添加时保留第一个，build之后不能再添加
+        Args:
+            keyword: 关键词
+            value: 匹配到时返回的值
+        """
+        if self._trie is None:
+            raise RuntimeError("自动机已经转换成扁平数组，不能再添加关键词，请重新构建")
+        keyword = self._normalize(keyword.strip())
+        if not keyword:
+            return
+        node = 0
+        for char in keyword:
+            next_node = self._trie[node].get(char)
+            if next_node is None:
+                next_node = len(self._trie)
+                self._trie[node][char] = next_node
+                self._trie.append({})
+            node = next_node
+        if node not in self._trie_output:
+            self._trie_output[node] = (len(keyword), value)
+            self.size += 1
+            self.max_len = max(self.max_len, len(keyword))
+        self._built = False
+
+    def build(self):
+        """广度优先计算失败指针，然后把trie转换成扁平数组"""
+        if self._trie is None:
+            return
+        trie, trie_output = self._trie, self._trie_output
+        num_nodes = len(trie)
+        fail = array("i", bytes(4 * num_nodes))
+        dict_suffix = array("i", bytes(4 * num_nodes))
+        queue = collections.deque(trie[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in trie[node].items():
+                state = fail[node]
+                while state and char not in trie[state]:
+                    state = fail[state]
+                state = trie[state].get(char, 0)
+                fail[next_node] = state
+                dict_suffix[next_node] = state if state in trie_output else dict_suffix[state]
+                queue.append(next_node)
+        child_start = array("i", [0, 0])
+        child_chars, child_nodes = array("i"), array("i")
+        for node in range(1, num_nodes):
+            for char in sorted(trie[node], key=ord):
+                child_chars.append(ord(char))
+                child_nodes.append(trie[node][char])
+            child_start.append(len(child_chars))
+        output_len = array("i", bytes(4 * num_nodes))
+        output_value = array("i", bytes(4 * num_nodes))
+        values, value_index = [], {}
+        for node, (length, value) in trie_output.items():
+            if value not in value_index:
+                value_index[value] = len(values)
+                values.append(value)
+            output_len[node] = length
+            output_value[node] = value_index[value]
+        self._root = dict(trie[0])
+        self._child_start, self._child_chars, self._child_nodes = child_start, child_chars, child_nodes
+        self._fail, self._dict_suffix = fail, dict_suffix
+        self._output_len, self._output_value, self._values = output_len, output_value, values
+        self._trie, self._trie_output = None, None
+        self._built = True
+
+    def iter_matches(self, text):
+        """
+        扫描文本，返回所有匹配(可能重叠)
+        Yields:
+            (start, end, value)
+        """
+        if not self._built:
+            self.build()
+        root, child_start, child_chars, child_nodes = self._root, self._child_start, self._child_chars, self._child_nodes
+        fail, dict_suffix = self._fail, self._dict_suffix
+        output_len, output_value, values = self._output_len, self._output_value, self._values
+        normalized = self._normalize(text)
+        node = 0
+        for end, char in enumerate(normalized, 1):
+            code = ord(char)
+            while node:
+                lo, hi = child_start[node], child_start[node + 1]
+                if hi - lo == 1:
+                    # 大部分节点只有一个子节点，不需要二分查找
+                    if child_chars[lo] == code:
+                        node = child_nodes[lo]
+                        break
+                elif lo < hi:
+                    index = bisect_left(child_chars, code, lo, hi)
+                    if index < hi and child_chars[index] == code:
+                        node = child_nodes[index]
+                        break
+                node = fail[node]
+            else:
+                node = root.get(char, 0)
+            hit = node if output_len[node] else dict_suffix[node]
+            while hit:
+                yield end - output_len[hit], end, values[output_value[hit]]
+                hit = dict_suffix[hit]
+
+    def save(self, path, fingerprint=None):
+        """
+        把构建好的自动机pickle到文件，先写临时文件再替换，正在读取的worker不受影响
+        Args:
+            fingerprint: 关键词的指纹，load时用来判断文件是否过期
+        """
+        if not self._built:
+            self.build()
+        fd, temp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp",
+                                         dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((fingerprint, self), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def load(path, fingerprint=None):
+        """
+        读取save保存的自动机，文件不存在或指纹不一致时返回None
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            saved_fingerprint, automaton = pickle.load(f)
+        if saved_fingerprint != fingerprint:
+            return None
+        return automaton
+
+    def find(self, text, min_start=0):
+        """
+        最左最长、互不重叠的匹配，例如同时有"二甲双胍"和"盐酸二甲双胍片"时只返回后者；
+        以英文字母或数字开头结尾的关键词必须在单词边界上
+        Args:
+            min_start: 只返回从这个位置之后开始的匹配，之前的文本只用于判断单词边界
+        Returns:
+            list[(start, end, value)]
+        """
+        candidates = []
+        for start, end, value in self.iter_matches(text):
+            if start < min_start:
+                continue
+            if is_word_char(text[start]) and start > 0 and is_word_char(text[start - 1]):
+                continue
+            if is_word_char(text[end - 1]) and end < len(text) and is_word_char(text[end]):
+                continue
+            candidates.append((start, end, value))
+        candidates.sort(key=lambda one: (one[0], -(one[1] - one[0])))
+        matches = []
+        last_end = min_start
+        for start, end, value in candidates:
+            if start >= last_end:
+                matches.append((start, end, value))
+                last_end = end
+        return matches
+
+
+class EntityMatcher(object):
+    def __init__(self, table_data, aliases=None):
+        """
+        Args:
+            table_data: {"disease": {疾病名: 行}, "drugs_info": {药品名: 行}}
+            aliases: {"disease": {别名: 疾病名}, "drugs_info": {别名: 药品名}}，行中的alias字段(列表或逗号分隔)也会作为别名
+        """
+        # 所有关键词: [(关键词, 表名, 数据库中的名称)]，其它服务可以用它构建相同的自动机
+        self.keywords = []
+        for table_name, rows in table_data.items():
+            for name, row in rows.items():
+                self.keywords.append((name, table_name, name))
+                row_aliases = row.get("alias") or []
+                if isinstance(row_aliases, str):
+                    row_aliases = row_aliases.replace("，", ",").split(",")
+                for alias in row_aliases:
+                    self.keywords.append((alias, table_name, name))
+        for table_name, table_aliases in (aliases or {}).items():
+            for alias, name in table_aliases.items():
+                if name in table_data.get(table_name, {}):
+                    self.keywords.append((alias, table_name, name))
+        self.automaton = self.build_automaton(self.keywords)
+
+    @staticmethod
+    def build_automaton(keywords):
+        automaton = AhoCorasick()
+        for keyword, table_name, name in keywords:
+            automaton.add(keyword, (table_name, name))
+        automaton.build()
+        return automaton
+
+    @staticmethod
+    def keywords_fingerprint(keywords):
+        md5 = hashlib.md5()
+        for one in keywords:
+            md5.update("\t".join(one).encode("utf-8"))
+            md5.update(b"\n")
+        return md5.hexdigest()
+
+    @classmethod
+    def from_keywords(cls, keywords, cache_path=None):
+        """
+        用keywords构建，不需要完整的数据库行
+        Args:
+            keywords: [(关键词, 表名, 数据库中的名称)]
+            cache_path: 自动机的缓存文件，关键词没有变化时直接加载，否则重新构建并保存，多个worker只需要构建一次
+        """
+        matcher = cls.__new__(cls)
+        matcher.keywords = [tuple(one) for one in keywords]
+        automaton = None
+        if cache_path:
+            fingerprint = cls.keywords_fingerprint(matcher.keywords)
+            try:
+                automaton = AhoCorasick.load(cache_path, fingerprint)
+            except Exception as e:
+                print(f"[警告] 读取自动机缓存{cache_path}失败，重新构建: {e}")
+        if automaton is None:
+            automaton = cls.build_automaton(matcher.keywords)
+            if cache_path:
+                automaton.save(cache_path, fingerprint)
+        matcher.automaton = automaton
+        return matcher
+
+    def scanner(self):
+        """
+        流式扫描器，逐段输入正在生成的文本
+        """
+        return StreamingEntityScanner(self.automaton)
+
+    def match(self, content):
+        """
+        找出文本中出现的疾病和药品，按第一次出现的顺序去重
+        Returns:
+            dict: {"疾病": [疾病名], "药品": [药品名]}，名称是数据库中的名称，别名会转换成数据库中的名称
+        """
+        result = {"疾病": [], "药品": []}
+        seen = set()
+        for _, _, (table_name, name) in self.automaton.find(content):
+            if (table_name, name) in seen:
+                continue
+            seen.add((table_name, name))
+            result["疾病" if table_name == "disease" else "药品"].append(name)
+        return result
+
+    def match_spans(self, content):
+        """
+        Returns:
+            list[dict]: 每个匹配在原文中的位置、原文中的词、类型和数据库中的名称
+        """
+        return [{"start": start, "end": end, "word": content[start:end], "table": table_name, "name": name}
+                for start, end, (table_name, name) in self.automaton.find(content)]
+
+
+class StreamingEntityScanner(object):
+    def __init__(self, automaton):
+        """
+        逐段扫描流式生成的文本，跨段的实体也能匹配到，结果和对完整文本调用find相同。
+        开始位置距离末尾不到最长关键词长度的匹配，可能还会被后面的文本延长，等后续文本到达后再确定
+        Args:
+            automaton: 构建好的AhoCorasick
+        """
+        self.automaton = automaton
+        # 还没有确定的文本，第一个字符只用于判断单词边界
+        self.buffer = ""
+        # buffer[0]在完整文本中的位置
+        self.offset = 0
+        # 完整文本中，下一个匹配最早可以开始的位置
+        self.next_start = 0
+        self.seen = set()
+
+    def feed(self, text, final=False):
+        """
+        Args:
+            text: 新生成的一段文本
+            final: 文本已经结束，确定剩余的全部匹配
+        Returns:
+            dict: 新出现的实体 {"疾病": [], "药品": []}，同一个实体只返回一次
+        """
+        self.buffer += text
+        result = {"疾病": [], "药品": []}
+        limit = len(self.buffer) if final else len(self.buffer) - self.automaton.max_len
+        if limit <= self.next_start - self.offset:
+            return result
+        for start, end, (table_name, name) in self.automaton.find(self.buffer, min_start=self.next_start - self.offset):
+            if start >= limit:
+                break
+            self.next_start = self.offset + end
+            if (table_name, name) in self.seen:
+                continue
+            self.seen.add((table_name, name))
+            result["疾病" if table_name == "disease" else "药品"].append(name)
+        self.next_start = max(self.next_start, self.offset + limit)
+        keep = max(limit - 1, 0)
+        self.buffer = self.buffer[keep:]
+        self.offset += keep
+        return result
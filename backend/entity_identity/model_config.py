@@ -6,17 +6,26 @@
 # @Contact : github: johnson7788
 # @Desc  :
 import os
+import asyncio
 import logging
+import weakref
+import httpx
 from enum import Enum
 from typing import Optional, Union
 from openai import OpenAI as OpenAIClient
 import google.generativeai as genai  #google-generativeai
 from openai import AzureOpenAI
+from openai import AsyncOpenAI, AsyncAzureOpenAI
 from dotenv import load_dotenv
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# 异步客户端: 同时进行的模型调用数、连接池大小、每次调用的超时秒数
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 64))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+
 class LLMType(Enum):
     # 模型类型
     GLM = "glm"
@@ -62,7 +71,7 @@ class LLMClient:
         elif self.llm_type == LLMType.DEEPSEEK:
             self.model = os.environ["DEEPSEEK_MODEL"]
             api_key = os.environ["DEEPSEEK_API_KEY"]
-            self.client = OpenAIClient(api_key=api_key,base_url="https://api.deepseek.com")
+            self.client = OpenAIClient(api_key=api_key,base_url=os.getenv("DEEPSEEK_BASEURL", "https://api.deepseek.com"))
         else:
             raise NotImplementedError("暂不支持的模型类型")
 
@@ -121,6 +130,96 @@ class LLMClient:
             return False, f"模型调用失败: {str(e)}"
 
 
+class AsyncLLMClient:
+    # 同一个事件循环中的客户端共用连接池，AsyncClient绑定创建它的事件循环，循环被回收后对应的连接池也一起释放
+    _http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+    def __init__(
+            self,
+            llm_type: Union[LLMType, str],
+            max_concurrency: int = LLM_MAX_CONCURRENCY,
+            timeout: float = LLM_TIMEOUT,
+    ):
+        """
+        OpenAI兼容接口的异步客户端，不阻塞事件循环
+        :param llm_type: 模型类型，支持GLM/OPENAI/AZURE/DEEPSEEK
+        :param max_concurrency: 同时进行的模型调用数，超过时排队
+        :param timeout: 每次调用的超时秒数
+        """
+        self.llm_type = LLMType(llm_type) if isinstance(llm_type, str) else llm_type
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        http_client = self.get_http_client()
+        if self.llm_type == LLMType.GLM:
+            self.model = os.environ["GLM_MODEL"]
+            self.client = AsyncOpenAI(api_key=os.environ["GLM_KEY"], base_url=os.environ["GLM_BASEURL"], http_client=http_client)
+        elif self.llm_type == LLMType.OPENAI:
+            self.model = os.environ["OPENAI_MODEL"]
+            self.client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], base_url=os.environ["OPENAI_BASEURL"], http_client=http_client)
+        elif self.llm_type == LLMType.AZURE or self.llm_type == LLMType.AZURE4:
+            self.model = os.environ["AZURE_OPENAI_API_DEPLOYMENT"]
+            self.client = AsyncAzureOpenAI(
+                api_key=os.environ["AZURE_OPENAI_API_KEY"],
+                api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+                azure_endpoint=os.environ["AZURE_OPENAI_API_ENDPOINT"],
+                azure_deployment=os.environ["AZURE_OPENAI_API_DEPLOYMENT"],
+                http_client=http_client,
+            )
+        elif self.llm_type == LLMType.DEEPSEEK:
+            self.model = os.environ["DEEPSEEK_MODEL"]
+            self.client = AsyncOpenAI(api_key=os.environ["DEEPSEEK_API_KEY"], base_url=os.getenv("DEEPSEEK_BASEURL", "https://api.deepseek.com"), http_client=http_client)
+        else:
+            raise NotImplementedError(f"异步客户端暂不支持的模型类型, {self.llm_type}")
+
+    @classmethod
+    def get_http_client(cls):
+        """
+        每个事件循环一个httpx连接池，keep-alive复用连接，不在事件循环中创建时返回不共用的连接池
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        http_client = cls._http_clients.get(loop) if loop is not None else None
+        if http_client is None or http_client.is_closed:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=10),
+            )
+            if loop is not None:
+                cls._http_clients[loop] = http_client
+        return http_client
+
+    async def run_inference(self, prompt: str=None, messages:list=None, timeout: float=None, **generate_args) -> str:
+        """
+        统一执行方法，和LLMClient.run_inference的返回相同
+        :param prompt: 输入提示词， prompt和messages应该二选一
+        :param messages: 消息
+        :param timeout: 本次调用的超时秒数，默认使用初始化时的timeout
+        :param generate_args: 生成参数（temperature等）
+        :return: (是否成功, 模型生成的文本或错误信息)
+        """
+        try:
+            assert prompt or messages, "prompt和messages应该二选一"
+            if prompt:
+                messages = [{"role": "user", "content": prompt}]
+            logging.info(f"使用接口async run_inference: {messages}")
+            async with self.semaphore:
+                response = await asyncio.wait_for(
+                    self.client.chat.completions.create(messages=messages, model=self.model, **generate_args),
+                    timeout=timeout or self.timeout,
+                )
+            output = response.choices[0].message.content
+            logging.info(f"async run_inference的输出是: {output}")
+            return True, output.strip()
+        except asyncio.TimeoutError:
+            logging.error(f"async run_inference,模型调用超时: {timeout or self.timeout}秒")
+            return False, f"模型调用超时: {timeout or self.timeout}秒"
+        except Exception as e:
+            logging.error(f"async run_inference,模型调用失败: {str(e)}")
+            return False, f"模型调用失败: {str(e)}"
+
+
 if __name__ == '__main__':
     messages = [{'role': 'user', 'content':'你好'}]
     ds_client = LLMClient(llm_type=LLMType.DEEPSEEK)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/29
+# @File  : result_cache.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 实体识别结果的缓存，按内容hash缓存，有过期时间和数量上限，相同内容的并发请求只识别一次
+import re
+import time
+import asyncio
+import hashlib
+import collections
+
+
+def content_key(content, *args):
+    """
+    内容去掉首尾空白并合并连续空白后计算md5，只有空白不同的回答使用同一个缓存
+    Args:
+        content: 文本
+        args: 其它影响结果的参数，例如是否匹配数据库
+    """
+    normalized = re.sub(r"\s+", " ", content.strip())
+    raw = "\x00".join([normalized] + [str(one) for one in args])
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, max_size=10000, ttl=3600):
+        """
+        Args:
+            max_size: 最多缓存的结果数，超过时淘汰最久没有使用的
+            ttl: 过期秒数，0表示不过期
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        # 正在识别的请求，相同key的请求等待同一个结果
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expire_at, value = item
+        if self.ttl and expire_at < time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._data[key] = (time.time() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    async def get_or_compute(self, key, compute):
+        """
+        先查缓存，没有命中时执行compute，同一个key同时只执行一次
+        Args:
+            key: 缓存key
+            compute: 无参数的协程函数，返回(status, data)，status为False时不缓存
+        Returns:
+            (status, data)
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # compute在单独的task中执行，某个请求被取消时不会影响等待同一个结果的其它请求
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        value = task.result()
+        if value[0]:
+            self.set(key, value)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "hit_rate": round(self.hits / total, 4) if total else 0,
+        }
@@ -71,6 +71,18 @@ class EntityIdentifyTestCase(unittest.TestCase):
         msg = res.get("msg")
         assert msg == "success", f"接口返回的msg不是成功，请检查"
         print(f"花费时间: {time.time() - start_time}秒")
+    def test_entity_cache_stats(self):
+        """测试相同内容第二次识别命中缓存"""
+        url = f"http://{self.host}:{self.port}/api/entity_indentify"
+        stats_url = f"http://{self.host}:{self.port}/api/entity_cache_stats"
+        data = {"match_db": True, "content": f"糖尿病患者常用盐酸二甲双胍片。{time.time()}"}
+        requests.post(url, json=data)
+        hits = requests.get(stats_url).json()["data"]["hits"]
+        r = requests.post(url, json=data)
+        assert r.json().get("msg") == "success", f"接口返回的msg不是成功，请检查"
+        stats = requests.get(stats_url).json()["data"]
+        print(json.dumps(stats, indent=4, ensure_ascii=False))
+        assert stats["hits"] == hits + 1, f"相同内容没有命中缓存，请检查"
 
 if __name__ == '__main__':
     ##确保Flask server已经启动
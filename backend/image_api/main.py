@@ -14,6 +14,7 @@ from urllib.parse import urlparse
 from image_utils import cache_decorator
 from read_image import recognize_image_scene
 from read_all_files import read_file_content
+from tika_client import get_tika_pool
 
 # 加载环境变量
 dotenv.load_dotenv()
@@ -44,6 +45,12 @@ if not ALI_API_KEY:
     raise ValueError("请在 .env 文件中设置 ALI_API_KEY")
 
 
+@app.on_event("startup")
+def startup_event():
+    """启动时拉起tika服务池并完成健康检查"""
+    get_tika_pool()
+
+
 # --- Pydantic 模型定义 ---
 class ImageRequest(BaseModel):
     image_url: str = Field(..., description="要识别的图片的公开URL", example="https://www.qcdy.com/uploads/allimg/150414/2-1504A1140.jpg")
@@ -1,6 +1,6 @@
 import os
 import time
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import json
 from collections.abc import AsyncIterable
 from typing import Any, Literal,Dict
@@ -16,6 +16,9 @@ from custom_state import CustomState
 import dotenv
 dotenv.load_dotenv()
 
+# 最多记录多少个 context_id 的 search_dbs 版本号，超过后淘汰最久没有对话的
+SEARCH_DBS_VERSIONS_MAX = int(os.getenv("SEARCH_DBS_VERSIONS_MAX", 10000))
+
 #记忆是必须的
 memory = MemorySaver()
 
@@ -58,6 +61,37 @@ def load_mcp_servers(config_path: str) -> Dict[str, Any]:
     return servers
 
 
+class SearchDBsEncoder:
+    """
+    search_dbs 的增量编码，只在 search_dbs 变化时把新增的条目放到 metadata 中，不再每个 token 都带上全部检索结果
+    search_dbs 在 CustomState 中用 operator.add 合并，只会追加，所以按已经发送的条数就能判断新增的部分；
+    每次 stream 都从 0 开始，调用方收到的第一份增量包含之前轮次的全部检索结果；
+    最终结果的 metadata 另外带着完整的 search_dbs，调用方发现增量不连续时丢弃增量，用它恢复
+    metadata 的格式:
+        有变化: {"search_dbs_version": 版本号, "search_dbs_offset": 新增部分的起始位置, "search_dbs_delta": [新增的条目]}
+        没变化: {"search_dbs_version": 版本号}
+    """
+
+    def __init__(self, version: int = 0):
+        # 同一个 context 的版本号只增不减，调用方根据版本号忽略重复的增量
+        self.version = version
+        self.sent = 0
+
+    def encode(self, search_dbs) -> dict:
+        search_dbs = search_dbs or []
+        if len(search_dbs) == self.sent:
+            return {"search_dbs_version": self.version}
+        # 条数变少说明不是追加(例如状态被重置)，从头发送
+        offset = self.sent if len(search_dbs) > self.sent else 0
+        self.version += 1
+        self.sent = len(search_dbs)
+        return {
+            "search_dbs_version": self.version,
+            "search_dbs_offset": offset,
+            "search_dbs_delta": search_dbs[offset:],
+        }
+
+
 class KnowledgeAgent:
     """知识库问答 Agent"""
     SUPPORTED_CONTENT_TYPES = ['text', 'text/plain']
@@ -83,7 +117,7 @@ class KnowledgeAgent:
 你是一位擅长应对复杂问题的医学助手，具备高级推理能力和信息检索能力。你的任务是理解并拆解用户的问题，积极调用搜索工具获取足够高质量的信息，再进行全面、准确、可信的回答。
     请严格遵循以下规则：
     1. 深度理解问题：理解用户提出的问题核心，可在必要时进行分解、重构或澄清，确保回答覆盖全部用户关心的点；
-    2. 充分使用多个搜索工具{tool_names}，你可以多轮搜索，直到获取充分、权威且相关的信息，避免仅基于初步结果回答；
+    2. 充分使用多个搜索工具{tool_names}，你可以多轮搜索，直到获取充分、权威且相关的信息，避免仅基于初步结果回答；search_personal_db的参数是关键词列表keywords，同一轮需要查询的多个关键词放在一次调用中，如["乳腺癌", "他莫昔芬"]；
     3. 高质量整合：结合搜索内容，使用你自己的语言输出结构清晰、信息全面、有逻辑支撑的答案，不要只复述资料，而应体现归纳、比较和推理能力；
     4. 坦诚应对不确定性：如果在检索中找不到明确答案，应如实说明，并基于现有信息提出合理推测、分析路径或建议；
     5. 标注引用来源：在使用搜索工具后，需要在涉及引用信息的句末，使用Markdown脚注格式标注出处，如：“该方法已被某个研究验证[^02-772-2]。”
@@ -92,6 +126,8 @@ class KnowledgeAgent:
     8. 不要在回答结束时列出所有参考的引用来源。
         """
         self.graphes = {} # 等异步初始化完才赋值
+        # 每个 context_id 的 search_dbs 版本号，按最近对话的顺序，最多 SEARCH_DBS_VERSIONS_MAX 个
+        self.search_dbs_versions = OrderedDict()
 
     async def create_graph(self, tool_names=[], mcp_urls=[]):
         """
@@ -126,6 +162,12 @@ class KnowledgeAgent:
         )
         print(f"初始化graph： {graph}")
         return graph
+    def save_search_dbs_version(self, context_id, version):
+        self.search_dbs_versions[context_id] = version
+        self.search_dbs_versions.move_to_end(context_id)
+        while len(self.search_dbs_versions) > SEARCH_DBS_VERSIONS_MAX:
+            self.search_dbs_versions.popitem(last=False)
+
     async def stream(self, query, history, context_id, tools=[], user_id="") -> AsyncIterable[dict[str, Any]]:
         """
         调用langgraph 处理用户的请求，并流式的返回
@@ -153,6 +195,7 @@ class KnowledgeAgent:
         config = {'configurable': {'thread_id': context_id}}
         tool_chunks = []
         metadata = {}
+        search_dbs_encoder = SearchDBsEncoder(self.search_dbs_versions.get(context_id, 0))
         print(f"graph_instance： {graph_instance}")
         async for token, response_metadata in graph_instance.astream(inputs, config, stream_mode='messages'):
             content = token.content or ""
@@ -160,10 +203,11 @@ class KnowledgeAgent:
             print(f"Agent输出的message信息: {content}")
             current_state = graph_instance.get_state(config)
             search_dbs = current_state.values.get("search_dbs")
-            # 作为metadata发送给前端
-            metadata = {"search_dbs": search_dbs}
-            print(f"search_dbs: {search_dbs}")
-            print(f"current_state.metadata: {current_state.metadata}")
+            # 作为metadata发送给前端，只有search_dbs变化时才带上新增的部分
+            metadata = search_dbs_encoder.encode(search_dbs)
+            self.save_search_dbs_version(context_id, search_dbs_encoder.version)
+            if "search_dbs_delta" in metadata:
+                print(f"search_dbs更新到版本{metadata['search_dbs_version']}，新增{len(metadata['search_dbs_delta'])}条，共{len(search_dbs)}条")
             tool_call_chunks = token.additional_kwargs.get("tool_calls", [])
             # 收集工具调用分片
             if tool_call_chunks:
@@ -230,7 +274,8 @@ class KnowledgeAgent:
                 # 获取工具调用前的状态信息
                 current_state = graph_instance.get_state(config)
                 search_dbs = current_state.values.get("search_dbs")
-                metadata = {"search_dbs": search_dbs}
+                metadata = search_dbs_encoder.encode(search_dbs)
+                self.save_search_dbs_version(context_id, search_dbs_encoder.version)
 
                 yield {
                     'is_task_complete': False,
@@ -248,6 +293,8 @@ class KnowledgeAgent:
     def get_agent_response(self, token, config, metadata, graph_instance):
         # 自己组装的metadata信息，用于返回给前端
         current_state = graph_instance.get_state(config)
+        # 最终结果带上完整的search_dbs，调用方丢失增量时可以恢复
+        metadata = {**metadata, "search_dbs": current_state.values.get("search_dbs") or []}
         print(f"最后一轮次Agent输出 token: {token}")
         finish_reason = token.response_metadata["finish_reason"]
         if finish_reason == 'stop':
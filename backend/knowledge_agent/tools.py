@@ -114,15 +114,17 @@ def search_guideline_db(keyword: str, tool_call_id: Annotated[str, InjectedToolC
     })
 
 @tool
-def search_personal_db(keyword: str, tool_call_id: Annotated[str, InjectedToolCallId], state: Annotated[dict, InjectedState]) -> Command:
+def search_personal_db(keywords: list[str], tool_call_id: Annotated[str, InjectedToolCallId], state: Annotated[dict, InjectedState]) -> Command:
     """
-    搜索个人知识库中关键疾病等相关内容
+    搜索个人知识库中关键疾病等相关内容，需要搜索多个关键词时一次全部传入
     Args:
-        keyword (str): 搜索查询关键词
+        keywords (list[str]): 搜索查询关键词列表, eg: ["乳腺癌", "他莫昔芬"]
     Returns:
         list: 返回相关知识
     """
-    print(f"触发了调用search_personal_db: {keyword}")
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    print(f"触发了调用search_personal_db: {keywords}")
     user_id = state.get("user_id", "")
     if not user_id:
         return Command(update={
@@ -130,7 +132,7 @@ def search_personal_db(keyword: str, tool_call_id: Annotated[str, InjectedToolCa
                 ToolMessage(content="未找到对应的个人知识库，没有检索到有用结果", tool_call_id=tool_call_id)
             ]
         })
-    search_status, search_data = personal_db_search_api(user_id=user_id, query=keyword)
+    search_status, search_data = personal_db_batch_search_api(user_id=user_id, queries=keywords)
     if not search_status:
         return Command(update={
             "messages": [
@@ -139,12 +141,9 @@ def search_personal_db(keyword: str, tool_call_id: Annotated[str, InjectedToolCa
         })
     documents = search_data["documents"]
     metadatas = search_data["metadatas"]
+    query_hits = search_data["query_hits"]
     data = []
-    if isinstance(documents[0], list):
-        documents = documents[0]
-    if isinstance(metadatas[0], list):
-        metadatas = metadatas[0]
-    for document, meta in zip(documents, metadatas):
+    for document, meta, hits in zip(documents, metadatas, query_hits):
         if not document:
             # 跳过空数据
             continue
@@ -152,6 +151,8 @@ def search_personal_db(keyword: str, tool_call_id: Annotated[str, InjectedToolCa
         id = meta["file_id"]
         url = meta.get("url", "https://bing.com/#/")
         plain_content = document
+        # 用第一个命中这条结果的关键词定位句子
+        keyword = keywords[hits[0]] if hits else keywords[0]
         fuzzy_res = fuzzy_search(keyword, plain_content, idprefix="06", db_id=id)
         data.append({
             "title": pdf_name.title(),
@@ -176,38 +177,32 @@ def search_personal_db(keyword: str, tool_call_id: Annotated[str, InjectedToolCa
         ]
     })
 
-def personal_db_search_api(user_id: int, query: str, topk=3):
+def personal_db_batch_search_api(user_id: int, queries: list[str], topk=3):
     """
-    搜索知识库
+    多个关键词一次搜索知识库，结果已经跨关键词去重
     """
     PERSONENAL_DB = os.environ.get('PERSONENAL_DB', '')
     assert PERSONENAL_DB, "PERSONENAL_DB is not set"
-    url = f"{PERSONENAL_DB}/search"
-    # 正确的请求数据格式
+    url = f"{PERSONENAL_DB}/search/batch"
     data = {
         "userId": user_id,
-        "query": query,
-        "keyword": "",  # 关键词匹配，是否需要强制包含一些关键词
-        "topk": topk
+        "queries": queries,
+        "keyword": "",
+        "topk": topk,
+        "mode": "hybrid",
+        "rerank": True,
+        "rerank_candidates": 50,
     }
     headers = {'content-type': 'application/json'}
     try:
-        # 发送POST请求
         response = httpx.post(url, json=data, headers=headers, timeout=20.0, trust_env=False)
-
-        # 检查HTTP状态码
         response.raise_for_status()
-        assert response.status_code == 200, f"{PERSONENAL_DB}搜索个人知识库报错"
-
-        # 解析返回的JSON数据
         result = response.json()
-        documents = result.get("documents", [])
-        metadatas = result.get("metadatas", [])
-        data = {"documents": documents, "metadatas": metadatas}
+        data = {"documents": result.get("documents", []), "metadatas": result.get("metadatas", []), "query_hits": result.get("query_hits", [])}
         print("Response status:", response.status_code)
         print("Response body:", result)
         return True, data
 
     except Exception as e:
-        print(f"{PERSONENAL_DB}搜索个人知识库报错: {e}")
-        return False, f"{PERSONENAL_DB}搜索个人知识库报错: {str(e)}"
\ No newline at end of file
+        print(f"{PERSONENAL_DB}批量搜索个人知识库报错: {e}")
+        return False, f"{PERSONENAL_DB}批量搜索个人知识库报错: {str(e)}"
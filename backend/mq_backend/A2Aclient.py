@@ -16,6 +16,50 @@ PUBLIC_AGENT_CARD_PATH = '/.well-known/agent.json'
 EXTENDED_AGENT_CARD_PATH = '/agent/authenticatedExtendedCard'
 
 
+class SearchDBsState:
+    """
+    根据Agent发送的增量metadata还原完整的search_dbs，格式见knowledge_agent的SearchDBsEncoder：
+    {"search_dbs_version": 版本号, "search_dbs_offset": 新增部分的起始位置, "search_dbs_delta": [新增的条目]}
+    增量不连续时丢弃，等最终结果中完整的search_dbs(或者从0开始的增量)恢复
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.search_dbs: list[dict] = []
+        # 丢失过增量，当前的search_dbs不完整
+        self.stale = False
+
+    def apply(self, metadata: dict | None) -> bool:
+        """应用一条消息的metadata，search_dbs有变化时返回True"""
+        if not metadata:
+            return False
+        if "search_dbs" in metadata:
+            # 兼容没有增量编码的Agent，每条消息都带着全部的search_dbs
+            search_dbs = metadata["search_dbs"] or []
+            changed = search_dbs != self.search_dbs
+            self.search_dbs = list(search_dbs)
+            self.version = max(self.version, metadata.get("search_dbs_version", 0))
+            self.stale = False
+            return changed
+        version = metadata.get("search_dbs_version", 0)
+        if "search_dbs_delta" not in metadata or version <= self.version:
+            # 没有变化，或者是已经应用过的增量（例如最后的artifact重复了最后一次增量）
+            return False
+        offset = metadata.get("search_dbs_offset", 0)
+        if offset > len(self.search_dbs):
+            logging.getLogger(__name__).warning(f"search_dbs的增量不连续，本地{len(self.search_dbs)}条，增量从{offset}开始，等待完整的search_dbs")
+            self.stale = True
+            return False
+        self.search_dbs = self.search_dbs[:offset] + list(metadata["search_dbs_delta"])
+        self.version = version
+        if offset == 0:
+            self.stale = False
+        return True
+
+    def to_metadata(self) -> dict:
+        return {"search_dbs": list(self.search_dbs), "search_dbs_version": self.version}
+
+
 class A2AClientWrapper:
     def __init__(self, session_id: str, agent_url: str):
         self.session_id = session_id
@@ -98,6 +142,8 @@ class A2AClientWrapper:
             finish_tool_call = False
             # 是否发送过了metata信息给前端
             send_metadata_finsihed = False
+            # Agent只在search_dbs变化时发送增量，这里还原出完整的search_dbs
+            search_dbs_state = SearchDBsState()
             async for chunk in stream_response:
                 self.logger.info(f"输出的chunk内容: {chunk}")
                 chunk_data = chunk.model_dump(mode='json', exclude_none=True)
@@ -121,6 +167,7 @@ class A2AClientWrapper:
 
                     # 尝试提取内容
                     message = chunk_status.get("message", {})
+                    search_dbs_state.apply(message.get("metadata"))
                     parts = message.get("parts", [])
                     if parts:
                         for part in parts:
@@ -135,9 +182,9 @@ class A2AClientWrapper:
                                     finish_tool_call = True
                                     yield {"type": "tool_result", "data": part_data}
                             elif part_kind == "text":
-                                if finish_tool_call and not send_metadata_finsihed:
-                                    metadata = message["metadata"]
-                                    yield {"type": "metadata", "data": metadata}
+                                # search_dbs不完整时先不发送，等最终结果中完整的search_dbs
+                                if finish_tool_call and not send_metadata_finsihed and not search_dbs_state.stale:
+                                    yield {"type": "metadata", "data": search_dbs_state.to_metadata()}
                                     send_metadata_finsihed = True
                                 yield {"type": "text", "text": part["text"]}
                             else:
@@ -145,6 +192,9 @@ class A2AClientWrapper:
                                 raise ValueError(f"未知的status-update类型: {part_kind}")
                 elif result.get("kind") == "artifact-update":
                     artifact = result.get("artifact", {})
+                    if search_dbs_state.apply(artifact.get("metadata")) and finish_tool_call and not send_metadata_finsihed:
+                        yield {"type": "metadata", "data": search_dbs_state.to_metadata()}
+                        send_metadata_finsihed = True
                     parts = artifact.get("parts", [])
                     if parts:
                         for part in parts:
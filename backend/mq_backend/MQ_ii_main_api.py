@@ -8,6 +8,7 @@ import requests
 import time
 import json
 import asyncio
+import threading
 import traceback
 import aiohttp
 import dotenv
@@ -16,6 +17,7 @@ from datetime import datetime
 from mq_handler import start_consumer, MQHandler
 from A2Aclient import A2AClientWrapper
 from Parse_QA import QAParser
+from entity_matcher import EntityMatcher
 dotenv.load_dotenv()
 
 IMAGE_API = os.environ.get('IMAGE_API')
@@ -36,6 +38,56 @@ QUEUE_NAME_ANSWER = os.environ["QUEUE_NAME_ANSWER"]
 QUEUE_NAME_QUESTION = os.environ["QUEUE_NAME_QUESTION"]
 AGENT_URL = os.environ["AGENT_URL"]
 ENTITY_URL = os.environ["ENTITY_URL"]
+# 是否在回答生成过程中增量识别实体，关闭时在回答结束后整体识别
+ENTITY_STREAMING = os.environ.get("ENTITY_STREAMING", "true").lower() == "true"
+# 从实体识别服务拉取的词典在后台多久刷新一次(秒)
+ENTITY_KEYWORDS_REFRESH = float(os.environ.get("ENTITY_KEYWORDS_REFRESH", 3600))
+
+_entity_matcher = None
+_entity_matcher_lock = threading.Lock()
+
+def refresh_entity_matcher():
+    """
+    从实体识别服务拉取词典，构建本地的Aho-Corasick自动机，构建完成后替换旧的，构建期间请求继续使用旧的
+    Returns:
+        bool: 是否刷新成功
+    """
+    global _entity_matcher
+    with _entity_matcher_lock:
+        try:
+            r = requests.get(f"{ENTITY_URL}/api/entity_keywords", timeout=30)
+            assert r.status_code == 200, f"返回的status code不是200，请检查"
+            keywords = r.json()["data"]["keywords"]
+            matcher = EntityMatcher.from_keywords(keywords)
+        except Exception as e:
+            print(f"[警告] 拉取实体词典失败，{'继续使用旧的词典' if _entity_matcher is not None else '使用回答结束后整体识别'}: {e}")
+            return False
+        _entity_matcher = matcher
+        print(f"实体词典加载完成，关键词数: {len(keywords)}")
+        return True
+
+def start_entity_matcher_refresh(interval=ENTITY_KEYWORDS_REFRESH):
+    """
+    启动时构建一次实体词典，之后在后台线程中定时刷新
+    """
+    refresh_entity_matcher()
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            refresh_entity_matcher()
+
+    thread = threading.Thread(target=loop, name="entity_matcher_refresh", daemon=True)
+    thread.start()
+    return thread
+
+def get_entity_matcher():
+    """
+    当前的实体词典，不会发起网络请求
+    Returns:
+        EntityMatcher，还没有加载成功时返回None
+    """
+    return _entity_matcher
 
 def entity_indentify_extract_match_db(content):
     """entity_indentify_extract识别接口
@@ -111,6 +163,17 @@ async def entity_indentify_extract_match_db_async(content):
             print(f"花费时间: {time.time() - start_time}秒")
             return res
 
+async def match_drug_disease_async(disease_names, drug_names):
+    """根据疾病和药品名称查询数据库信息，返回格式和entity_indentify_extract_match_db的data相同"""
+    url = f"{ENTITY_URL}/api/match_drug_disease"
+    data = {"disease_names": disease_names, "drug_names": drug_names}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=data) as resp:
+            assert resp.status == 200, f"返回的status code不是200，请检查"
+            res = await resp.json()
+            assert res.get("msg") == "success", f"接口返回的msg不是成功，请检查"
+            return res
+
 def call_tool_mapper(one_chunk_data):
     """
     工具调用时，改成前端需要的数据格式
@@ -253,18 +316,56 @@ def handle_gpt_stream_response(session_id, user_id, function_id, stream_response
         send_error_message(stream_response)
         mq_handler.close_connection()
         return
+    def send_entities_message(entities_data):
+        diseases = entities_data.get("diseases")
+        drugs = entities_data.get("drugs")
+        # 如果没有疾病和药品，则不进行返回
+        if not diseases and not drugs:
+            return
+        entities_message = {
+            "sessionId": session_id,
+            "userId": user_id,
+            "functionId": function_id,
+            "message": json.dumps(entities_data, ensure_ascii=False),
+            "reasoningMessage": "",
+            "type": 7,
+        }
+        mq_handler.send_message(entities_message)
+        print(f"[Info] 发送实体识别数据(type 7)：{entities_message}")
+
+    async def send_new_entities(new_entities):
+        """查询新出现的实体并发送，查询失败不影响回答"""
+        if not new_entities["疾病"] and not new_entities["药品"]:
+            return
+        try:
+            entities = await match_drug_disease_async(new_entities["疾病"], new_entities["药品"])
+            send_entities_message(entities["data"])
+        except Exception as entity_error:
+            print("[错误] 增量实体识别失败：", entity_error)
+
     async def consume():
+        entity_tasks = []
         try:
             # 记录所有停止的tools
             running_tools = []  # 正在检索的工具，也只发送给前端一次
             stopped_tools = []
             reponse_content = ""
+            # 回答生成过程中逐段扫描实体，跨chunk的实体也能识别，新实体出现时立即发送type 7
+            entity_scanner = None
+            if ENTITY_URL and ENTITY_STREAMING:
+                entity_matcher = get_entity_matcher()
+                if entity_matcher is not None:
+                    entity_scanner = entity_matcher.scanner()
             async for chunk in stream_response:
                 print(f"chunk: {chunk}")
                 try:
                     data_type = chunk.get("type")
                     if data_type == "final":
                         print(f"data_type是final，开始最终的stop返回")
+                        # 实体消息在stop之前发送
+                        if entity_tasks:
+                            await asyncio.gather(*entity_tasks, return_exceptions=True)
+                            entity_tasks = []
                         answer_queue_message = {
                             "sessionId": session_id,
                             "userId": user_id,
@@ -292,6 +393,10 @@ def handle_gpt_stream_response(session_id, user_id, function_id, stream_response
                             "type": 4,
                         }
                         reponse_content += chunk.get("text", "")
+                        if entity_scanner is not None:
+                            new_entities = entity_scanner.feed(chunk.get("text", ""))
+                            if new_entities["疾病"] or new_entities["药品"]:
+                                entity_tasks.append(asyncio.create_task(send_new_entities(new_entities)))
                     elif data_type == "metadata":
                         metadata = chunk.get("data", {})
                         metadata_to_front = metadata_tool_mapper(metadata)
@@ -355,26 +460,15 @@ def handle_gpt_stream_response(session_id, user_id, function_id, stream_response
                         print(f"[Info] 收到artifact数据，如果我们设置的Stream，那么这条数据需要忽略：{chunk}")
                         #识别实体,artifact_content应该是空的，使用收集的reponse_content进行实体识别
                         artifact_content = chunk["text"]
-                        if ENTITY_URL:
+                        if entity_scanner is not None:
+                            # 回答已经结束，确定末尾剩余的实体
+                            new_entities = entity_scanner.feed("", final=True)
+                            entity_tasks.append(asyncio.create_task(send_new_entities(new_entities)))
+                        elif ENTITY_URL:
                             # entities = entity_indentify_extract_match_db(reponse_content)
                             loop = asyncio.get_running_loop()
                             entities = await loop.run_in_executor(None, entity_indentify_extract_match_db,reponse_content)
-                            entities_data = entities["data"]
-                            diseases = entities_data.get("diseases")
-                            drugs = entities_data.get("drugs")
-                            # 如果没有疾病和药品，则不进行返回
-                            if not diseases and not drugs:
-                                continue
-                            entities_message = {
-                                "sessionId": session_id,
-                                "userId": user_id,
-                                "functionId": function_id,
-                                "message": json.dumps(entities_data, ensure_ascii=False),
-                                "reasoningMessage": "",
-                                "type": 7,
-                            }
-                            mq_handler.send_message(entities_message)
-                            print(f"[Info] 发送实体识别数据(type 7)：{entities_message}")
+                            send_entities_message(entities["data"])
                         continue
                     else:
                         print(f"[警告] 未知的chunk类型：{data_type}，已跳过")
@@ -392,6 +486,9 @@ def handle_gpt_stream_response(session_id, user_id, function_id, stream_response
             traceback.print_exc()
             send_error_message(f"处理流出错：{stream_error}")
         finally:
+            # 等待还在查询的实体发送完再关闭连接
+            if entity_tasks:
+                await asyncio.gather(*entity_tasks, return_exceptions=True)
             mq_handler.close_connection()
 
     asyncio.run(consume())
@@ -446,5 +543,7 @@ def callback(ch, method, properties, body):
 
 
 if __name__ == '__main__':
+    if ENTITY_URL and ENTITY_STREAMING:
+        start_entity_matcher_refresh()
     print("开始监听RabbitMQ队列...")
     start_consumer(callback, auto_ack=False)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/22
+# @File  : benchmark_hybrid.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 在合成的医学语料上对比dense和hybrid(BM25+向量RRF)检索的召回率和延迟
+# python benchmark_hybrid.py --chunks 20000 --queries 200
+# python benchmark_hybrid.py --real  使用阿里云的embedding模型
+
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import numpy as np
+from embedding_utils import ChromaDB, EmbeddingModel
+
+DISEASES = ["2型糖尿病", "高血压", "冠心病", "慢性肾病", "类风湿关节炎", "帕金森病", "系统性红斑狼疮", "慢性阻塞性肺病"]
+TEMPLATES = [
+    "{disease}患者使用{drug}（编码{code}）后需要定期监测肝肾功能。",
+    "临床研究显示{drug}对{disease}的疗效优于安慰剂，编码{code}。",
+    "{code}号药物{drug}在{disease}的二线治疗中被推荐。",
+    "对于{disease}，{drug}的常见不良反应包括头痛和恶心，参见{code}。",
+]
+QUERY_TEMPLATES = ["{drug}的不良反应", "{code}适用于哪些患者", "{drug} {disease}"]
+
+
+class HashEmbedder(object):
+    """
+    离线的字符n-gram哈希embedding，只用于基准测试，不需要调用embedding接口
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n in (1, 2):
+            for i in range(len(text) - n + 1):
+                digest = hashlib.md5(text[i:i + n].encode()).digest()
+                vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def do_embedding(self, texts):
+        return {"data": [{"embedding": self.embed(text)} for text in texts]}
+
+
+def make_drug(rng, i):
+    syllables = "阿奈普洛沙坦格列美替尼拉唑莫西卡比索他汀"
+    name = "".join(rng.choice(syllables) for _ in range(rng.randint(3, 4)))
+    return f"{name}{i}", f"{rng.choice('ABCDEHJLMN')}{rng.randint(10, 99)}{rng.choice('ABCDEFG')}{rng.randint(1, 99):02d}"
+
+
+def build_corpus(num_chunks, num_drugs, seed=42):
+    rng = random.Random(seed)
+    drugs = [make_drug(rng, i) for i in range(num_drugs)]
+    chunks, labels = [], []
+    for i in range(num_chunks):
+        drug, code = drugs[i % num_drugs]
+        disease = rng.choice(DISEASES)
+        chunks.append(rng.choice(TEMPLATES).format(disease=disease, drug=drug, code=code))
+        labels.append((drug, code, disease))
+    return chunks, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="dense和hybrid检索的召回率和延迟对比")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--drugs", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topk", type=int, default=5)
+    parser.add_argument("--real", action="store_true", help="使用阿里云embedding模型")
+    args = parser.parse_args()
+
+    chunks, labels = build_corpus(args.chunks, args.drugs)
+    embedder = EmbeddingModel() if args.real else HashEmbedder()
+    chroma = ChromaDB(embedder, db_dir=tempfile.mkdtemp(prefix="bench_chroma_"))
+    collection = "user_bench"
+    start_time = time.time()
+    batch_size = 1000
+    for i in range(0, len(chunks), batch_size):
+        chroma.insert_files_vectors([{
+            "file_name": f"file_{i // batch_size}.txt", "user_id": "bench", "file_id": i // batch_size,
+            "file_type": "txt", "url": "", "folder_id": 0, "documents": chunks[i:i + batch_size],
+        }])
+    print(f"写入 {len(chunks)} 个chunk耗时 {time.time() - start_time:.1f}s")
+
+    rng = random.Random(7)
+    queries = []
+    for _ in range(args.queries):
+        drug, code, disease = labels[rng.randrange(len(labels))]
+        query = rng.choice(QUERY_TEMPLATES).format(drug=drug, code=code, disease=disease)
+        relevant = sum(1 for label in labels if label[0] == drug)
+        queries.append((query, drug, relevant))
+
+    for mode in ["dense", "hybrid"]:
+        latencies, recalls = [], []
+        for query, drug, relevant in queries:
+            start_time = time.time()
+            result = chroma.query2collection(collection, [query], topk=args.topk, mode=mode)
+            latencies.append(time.time() - start_time)
+            hits = sum(1 for document in result["documents"][0] if drug in document)
+            recalls.append(hits / min(relevant, args.topk))
+        latencies = np.array(latencies) * 1000
+        print(f"{mode:<7} recall@{args.topk}: {np.mean(recalls):.3f}  "
+              f"p50: {np.percentile(latencies, 50):.1f}ms  p99: {np.percentile(latencies, 99):.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
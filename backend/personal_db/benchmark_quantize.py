@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/27
+# @File  : benchmark_quantize.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 不同索引维度、是否int8重新打分时的内存占用和召回率
+# 合成向量的方差随维度递减，模拟text-embedding-v4这类前缀维度可用的向量
+# python benchmark_quantize.py --vectors 20000 --dims 1024 512 256 128
+
+import time
+import argparse
+import tempfile
+import numpy as np
+from embedding_utils import ChromaDB
+
+
+class LookupEmbedder(object):
+    """
+    查询文本是"q{下标}"，直接返回预先生成的查询向量
+    """
+
+    def __init__(self, queries):
+        self.queries = queries
+
+    def do_embedding(self, texts):
+        return {"data": [{"embedding": self.queries[int(text[1:])].tolist()} for text in texts]}
+
+
+def make_vectors(num, dim, num_clusters=200, seed=42):
+    rng = np.random.default_rng(seed)
+    scale = 1.0 / np.sqrt(np.arange(1, dim + 1))
+    centers = rng.normal(size=(num_clusters, dim)) * scale
+    vectors = centers[rng.integers(0, num_clusters, num)] + rng.normal(size=(num, dim)) * scale * 0.5
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def human_size(num):
+    return f"{num / 1024 / 1024:.1f}MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="降维和int8量化的内存和召回率")
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=1024, help="完整向量维度")
+    parser.add_argument("--dims", type=int, nargs="+", default=[1024, 512, 256, 128], help="索引维度")
+    parser.add_argument("--topk", type=int, default=10)
+    args = parser.parse_args()
+
+    data = make_vectors(args.vectors + args.queries, args.dim)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+    # 完整维度float精确检索的结果作为标准答案
+    truth = np.argsort(-queries @ vectors.T, axis=1)[:, :args.topk]
+    ids = [str(i) for i in range(args.vectors)]
+    documents = [f"doc {i}" for i in ids]
+    metadatas = [{"file_id": i // 100} for i in range(args.vectors)]
+    embedder = LookupEmbedder(queries)
+
+    for index_dimensions in args.dims:
+        for rescore in ["none", "int8"]:
+            if index_dimensions == args.dim and rescore == "int8":
+                continue
+            chroma = ChromaDB(embedder, db_dir=tempfile.mkdtemp(prefix="bench_chroma_"), index_dimensions=index_dimensions, rescore=rescore)
+            col = chroma.client.get_or_create_collection("user_bench", metadata={"hnsw:space": "cosine"})
+            for start in range(0, args.vectors, 1000):
+                end = start + 1000
+                chroma._write_vectors(col, "user_bench", ids[start:end], vectors[start:end].tolist(), documents[start:end], metadatas[start:end])
+            latencies, recalls = [], []
+            for i in range(args.queries):
+                start_time = time.time()
+                result = chroma.query2collection("user_bench", [f"q{i}"], topk=args.topk)
+                latencies.append(time.time() - start_time)
+                recalls.append(len({int(one) for one in result["ids"][0]} & set(truth[i].tolist())) / args.topk)
+            stats = chroma.collection_stats()[0]
+            print(f"index_dim={index_dimensions:<5d} rescore={rescore:<5s} recall@{args.topk}: {np.mean(recalls):.3f}  "
+                  f"p50: {np.percentile(latencies, 50) * 1000:.1f}ms  索引内存(估算): {human_size(stats['index_memory_bytes'])}  "
+                  f"索引磁盘: {human_size(stats['index_disk_bytes'])}  int8: {human_size(stats['int8_bytes'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/25
+# @File  : benchmark_rerank.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 重排序候选数N分别为10、50、100时的延迟和召回率，语料和benchmark_hybrid.py相同
+# python benchmark_rerank.py --chunks 20000 --queries 200 --mode hybrid
+# RERANKER=cross-encoder python benchmark_rerank.py  使用cross-encoder
+
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+from embedding_utils import ChromaDB, EmbeddingModel
+from benchmark_hybrid import HashEmbedder, build_corpus, QUERY_TEMPLATES
+
+
+def evaluate(chroma, collection, queries, topk, mode, rerank, rerank_candidates):
+    latencies, recalls = [], []
+    for query, drug, relevant in queries:
+        start_time = time.time()
+        result = chroma.query2collection(collection, [query], topk=topk, mode=mode, rerank=rerank,
+                                         rerank_candidates=rerank_candidates)
+        latencies.append(time.time() - start_time)
+        hits = sum(1 for document in result["documents"][0] if drug in document)
+        recalls.append(hits / min(relevant, topk))
+    latencies = np.array(latencies) * 1000
+    return np.mean(recalls), np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重排序的延迟和质量对比")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--drugs", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topk", type=int, default=3)
+    parser.add_argument("--mode", default="dense", choices=["dense", "hybrid"])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--real", action="store_true", help="使用阿里云embedding模型")
+    args = parser.parse_args()
+
+    chunks, labels = build_corpus(args.chunks, args.drugs)
+    embedder = EmbeddingModel() if args.real else HashEmbedder()
+    chroma = ChromaDB(embedder, db_dir=tempfile.mkdtemp(prefix="bench_chroma_"))
+    collection = "user_bench"
+    batch_size = 1000
+    for i in range(0, len(chunks), batch_size):
+        chroma.insert_files_vectors([{
+            "file_name": f"file_{i // batch_size}.txt", "user_id": "bench", "file_id": i // batch_size,
+            "file_type": "txt", "url": "", "folder_id": 0, "documents": chunks[i:i + batch_size],
+        }])
+
+    rng = random.Random(7)
+    queries = []
+    for _ in range(args.queries):
+        drug, code, disease = labels[rng.randrange(len(labels))]
+        query = rng.choice(QUERY_TEMPLATES).format(drug=drug, code=code, disease=disease)
+        queries.append((query, drug, sum(1 for label in labels if label[0] == drug)))
+
+    recall, p50, p99 = evaluate(chroma, collection, queries, args.topk, args.mode, False, 0)
+    print(f"不重排序        recall@{args.topk}: {recall:.3f}  p50: {p50:.1f}ms  p99: {p99:.1f}ms")
+    for n in args.candidates:
+        # 第一轮冷缓存，第二轮所有(query, chunk)都命中缓存
+        for label in ["冷缓存", "热缓存"]:
+            recall, p50, p99 = evaluate(chroma, collection, queries, args.topk, args.mode, True, n)
+            print(f"N={n:<4d}{label}  recall@{args.topk}: {recall:.3f}  p50: {p50:.1f}ms  p99: {p99:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/20
+# @File  : benchmark_tika.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : Tika服务池的吞吐测试，统计docx/pdf/xlsx混合文件每分钟能解析多少个
+# python benchmark_tika.py --dir ./test_files --workers 1 4 8 --servers 2
+
+import os
+import time
+import argparse
+import collections
+from tika_client import TikaPool
+
+EXTENSIONS = (".docx", ".pdf", ".xlsx")
+
+
+def collect_files(directory, repeat=1):
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(EXTENSIONS):
+                files.append(os.path.join(root, name))
+    files.sort()
+    return files * repeat
+
+
+def run_benchmark(files, workers, server_num, server_urls=None, timeout=120):
+    pool = TikaPool(server_urls=server_urls, server_num=server_num, workers=workers, file_timeout=timeout).start()
+    try:
+        # 预热，JVM第一次解析各类型文件会加载解析器
+        pool.extract_many(files[:len(EXTENSIONS)])
+        start_time = time.time()
+        results = pool.extract_many(files)
+        cost = time.time() - start_time
+    finally:
+        pool.close()
+    failed = collections.Counter(os.path.splitext(path)[1].lower() for path, _, error in results if error)
+    return cost, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tika服务池吞吐测试")
+    parser.add_argument("--dir", required=True, help="测试文件目录，包含docx/pdf/xlsx")
+    parser.add_argument("--repeat", type=int, default=1, help="文件重复次数，用于放大样本")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="并行解析线程数")
+    parser.add_argument("--servers", type=int, default=1, help="本地启动的tika-server数量")
+    parser.add_argument("--urls", default="", help="外部tika服务地址，逗号分隔")
+    parser.add_argument("--timeout", type=float, default=120, help="单个文件超时时间")
+    args = parser.parse_args()
+
+    files = collect_files(args.dir, args.repeat)
+    assert files, f"目录中没有docx/pdf/xlsx文件: {args.dir}"
+    counter = collections.Counter(os.path.splitext(path)[1].lower() for path in files)
+    print(f"测试文件数: {len(files)}, 类型分布: {dict(counter)}")
+    server_urls = [url.strip() for url in args.urls.split(",") if url.strip()]
+    for workers in args.workers:
+        cost, failed = run_benchmark(files, workers, args.servers, server_urls, args.timeout)
+        print(f"workers={workers:<3d} servers={len(server_urls) or args.servers:<2d} 耗时: {cost:.2f}s, "
+              f"files/min: {len(files) / cost * 60:.1f}, 失败: {dict(failed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/22
+# @File  : bm25_index.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 每个用户一个的BM25倒排索引，基于sqlite fts5，和chroma的插入删除保持同步，用于混合检索
+
+import re
+import os
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 中文按单字+相邻二字切分，英文和数字按整词切分，药品名和编码(如 ACEI、E11.9)都能精确命中
+CJK_RE = re.compile(r"[一-鿿]+")
+TOKEN_RE = re.compile(r"[一-鿿]+|[a-z0-9]+(?:\.[a-z0-9]+)*")
+
+
+def tokenize(text, for_query=False):
+    """
+    对中英文混合文本进行切词
+    Args:
+        text: str
+        for_query: 查询时长度大于1的中文片段只用二字，单字会命中大部分文档，拖慢检索
+    Returns:
+        list[str]
+    """
+    text = (text or "").lower()
+    tokens = []
+    for match in TOKEN_RE.finditer(text):
+        piece = match.group()
+        if CJK_RE.fullmatch(piece):
+            if not for_query or len(piece) == 1:
+                tokens.extend(piece)
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        else:
+            tokens.append(piece)
+            # 带点的编码同时索引各段，E11.9 也能被 E11 检索到
+            if "." in piece:
+                tokens.extend(piece.split("."))
+    return tokens
+
+
+def fts_text(tokens):
+    # fts5的unicode61分词器会按标点切分，把.替换成_并把_设为tokenchars，保证编码作为一个整体token
+    return " ".join(token.replace(".", "_") for token in tokens)
+
+
+class BM25Index(object):
+    def __init__(self, db_path="cache/chromadb_bm25.sqlite3"):
+        """
+        Args:
+            db_path: sqlite文件路径，每个collection对应两张表: 文本的fts5表和chunk_id、file_id的映射表
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _tables(collection):
+        name = re.sub(r"[^0-9A-Za-z_]", "_", str(collection))
+        return f"fts_{name}", f"chunks_{name}"
+
+    def _ensure(self, collection):
+        fts_table, chunk_table = self._tables(collection)
+        conn = self._conn()
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {chunk_table} (rowid INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE, file_id TEXT)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{chunk_table}_file ON {chunk_table}(file_id)")
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(tokens, tokenize=\"unicode61 tokenchars '_'\")")
+        return fts_table, chunk_table
+
+    def _exists(self, collection):
+        _, chunk_table = self._tables(collection)
+        row = self._conn().execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (chunk_table,)).fetchone()
+        return row is not None
+
+    def _delete_rowids(self, conn, fts_table, chunk_table, rowids):
+        for i in range(0, len(rowids), 500):
+            batch = rowids[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM {fts_table} WHERE rowid IN ({marks})", batch)
+            conn.execute(f"DELETE FROM {chunk_table} WHERE rowid IN ({marks})", batch)
+
+    def upsert(self, collection, ids, documents, file_ids):
+        """
+        插入或替换chunk
+        Args:
+            collection: collection名称
+            ids: list[str], chunk_id，和chroma中的ID一致
+            documents: list[str]
+            file_ids: list, 每个chunk对应的文件ID
+        """
+        if not ids:
+            return
+        fts_table, chunk_table = self._ensure(collection)
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            self._delete_ids(conn, fts_table, chunk_table, ids)
+            for chunk_id, document, file_id in zip(ids, documents, file_ids):
+                cursor = conn.execute(f"INSERT INTO {chunk_table}(chunk_id, file_id) VALUES (?, ?)", (chunk_id, str(file_id)))
+                conn.execute(f"INSERT INTO {fts_table}(rowid, tokens) VALUES (?, ?)", (cursor.lastrowid, fts_text(tokenize(document))))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _delete_ids(self, conn, fts_table, chunk_table, ids):
+        rowids = []
+        for i in range(0, len(ids), 500):
+            batch = list(ids[i:i + 500])
+            marks = ",".join("?" * len(batch))
+            rowids.extend(row[0] for row in conn.execute(f"SELECT rowid FROM {chunk_table} WHERE chunk_id IN ({marks})", batch))
+        self._delete_rowids(conn, fts_table, chunk_table, rowids)
+
+    def delete_ids(self, collection, ids):
+        if not ids or not self._exists(collection):
+            return
+        fts_table, chunk_table = self._tables(collection)
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            self._delete_ids(conn, fts_table, chunk_table, ids)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_files(self, collection, file_ids):
+        if not file_ids or not self._exists(collection):
+            return
+        fts_table, chunk_table = self._tables(collection)
+        conn = self._conn()
+        file_ids = [str(file_id) for file_id in file_ids]
+        marks = ",".join("?" * len(file_ids))
+        conn.execute("BEGIN")
+        try:
+            rowids = [row[0] for row in conn.execute(f"SELECT rowid FROM {chunk_table} WHERE file_id IN ({marks})", file_ids)]
+            self._delete_rowids(conn, fts_table, chunk_table, rowids)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def drop(self, collection):
+        fts_table, chunk_table = self._tables(collection)
+        conn = self._conn()
+        conn.execute(f"DROP TABLE IF EXISTS {fts_table}")
+        conn.execute(f"DROP TABLE IF EXISTS {chunk_table}")
+
+    def is_empty(self, collection):
+        if not self._exists(collection):
+            return True
+        _, chunk_table = self._tables(collection)
+        return self._conn().execute(f"SELECT 1 FROM {chunk_table} LIMIT 1").fetchone() is None
+
+    def count(self, collection):
+        if not self._exists(collection):
+            return 0
+        _, chunk_table = self._tables(collection)
+        return self._conn().execute(f"SELECT COUNT(*) FROM {chunk_table}").fetchone()[0]
+
+    def search(self, collection, query, topk=20):
+        """
+        BM25检索
+        Args:
+            collection: collection名称
+            query: 查询文本
+            topk: 返回数量
+        Returns:
+            list[tuple[str, float]]: (chunk_id, bm25分数)，分数越大越相关
+        """
+        tokens = list(dict.fromkeys(tokenize(query, for_query=True)))
+        if not tokens or not self._exists(collection):
+            return []
+        fts_table, chunk_table = self._tables(collection)
+        match = " OR ".join('"' + token.replace(".", "_") + '"' for token in tokens)
+        rows = self._conn().execute(
+            f"SELECT c.chunk_id, bm25({fts_table}) AS score FROM {fts_table} f JOIN {chunk_table} c ON c.rowid = f.rowid "
+            f"WHERE {fts_table} MATCH ? ORDER BY score LIMIT ?",
+            (match, topk)
+        ).fetchall()
+        # fts5的bm25越小越相关，取反
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    RRF融合多个排序结果
+    Args:
+        rankings: list[list[str]], 每个元素是一个按相关性排好序的ID列表
+        k: RRF常数
+    Returns:
+        list[tuple[str, float]]: 按融合分数排序的(ID, 分数)
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2024/8/19 09:16
+# @File  : cache_utils.py
+# @Author:  johnson
+# @Desc  : 缓存工具：内存LRU + 按key前缀分目录的磁盘缓存，支持过期时间和磁盘总大小上限；
+#          用JSON保存(不使用pickle)，先写临时文件再原子替换，同一个key并发未命中时只计算一次
+import os
+import json
+import time
+import base64
+import hashlib
+import inspect
+import asyncio
+import logging
+import importlib
+import sys
+import threading
+import collections
+from functools import wraps
+
+# 磁盘缓存目录，cache目录下还有chromadb等其它数据，函数缓存单独放在子目录中，淘汰时不会影响其它数据
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join("cache", "kv"))
+# 缓存的过期秒数，0表示不过期
+CACHE_TTL = float(os.getenv("CACHE_TTL", 30 * 24 * 3600))
+# 磁盘缓存的总大小上限，超过后按最近使用时间淘汰
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 1 << 30))
+# 内存中最多保留的条数和总大小
+CACHE_MEMORY_ITEMS = int(os.getenv("CACHE_MEMORY_ITEMS", 1024))
+CACHE_MEMORY_BYTES = int(os.getenv("CACHE_MEMORY_BYTES", 64 << 20))
+# 还原pydantic模型时允许导入的模块前缀，逗号分隔；已经导入的模块总是允许
+CACHE_MODEL_MODULES = [one.strip() for one in os.getenv("CACHE_MODEL_MODULES", "").split(",") if one.strip()]
+
+logger = logging.getLogger(__name__)
+
+
+def cal_md5(content):
+    """
+    计算content字符串的md5
+    :param content:
+    :return:
+    """
+    # 使用encode
+    content = str(content)
+    result = hashlib.md5(content.encode())
+    # 打印hash
+    md5 = result.hexdigest()
+    return md5
+
+
+# ---------- 序列化：JSON加类型标记，支持tuple、set、bytes和pydantic模型 ----------
+_TAGS = ("__tuple__", "__set__", "__bytes__", "__model__", "__dict__")
+
+
+def encode_value(obj):
+    """
+    转换成可以json.dumps的结构，不支持的类型抛出TypeError
+    """
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, list):
+        return [encode_value(one) for one in obj]
+    if isinstance(obj, tuple):
+        return {"__tuple__": [encode_value(one) for one in obj]}
+    if isinstance(obj, (set, frozenset)):
+        items = [encode_value(one) for one in obj]
+        # 排序后生成的key才稳定
+        return {"__set__": sorted(items, key=lambda one: json.dumps(one, sort_keys=True, ensure_ascii=False))}
+    if isinstance(obj, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(bytes(obj)).decode("ascii")}
+    if isinstance(obj, dict):
+        if all(isinstance(key, str) for key in obj) and not (len(obj) == 1 and next(iter(obj)) in _TAGS):
+            return {key: encode_value(value) for key, value in obj.items()}
+        pairs = [[encode_value(key), encode_value(value)] for key, value in obj.items()]
+        return {"__dict__": sorted(pairs, key=lambda one: json.dumps(one[0], sort_keys=True, ensure_ascii=False))}
+    if hasattr(obj, "model_dump") and hasattr(type(obj), "model_validate"):
+        cls = type(obj)
+        return {"__model__": [f"{cls.__module__}:{cls.__qualname__}", obj.model_dump(mode="json")]}
+    raise TypeError(f"不支持缓存的类型: {type(obj).__name__}")
+
+
+def decode_value(obj):
+    if isinstance(obj, list):
+        return [decode_value(one) for one in obj]
+    if not isinstance(obj, dict):
+        return obj
+    if len(obj) == 1:
+        tag, value = next(iter(obj.items()))
+        if tag == "__tuple__":
+            return tuple(decode_value(one) for one in value)
+        if tag == "__set__":
+            return set(decode_value(one) for one in value)
+        if tag == "__bytes__":
+            return base64.b64decode(value)
+        if tag == "__dict__":
+            return {decode_value(key): decode_value(one) for key, one in value}
+        if tag == "__model__":
+            path, data = value
+            module_name, _, qualname = path.partition(":")
+            # 先检查模块再导入，缓存文件不能让进程导入任意模块
+            if module_name not in sys.modules and not any(
+                    module_name == prefix or module_name.startswith(f"{prefix}.") for prefix in CACHE_MODEL_MODULES):
+                raise ValueError(f"缓存中的模型所在模块不在允许列表中: {path}")
+            cls = importlib.import_module(module_name)
+            for name in qualname.split("."):
+                cls = getattr(cls, name)
+            # 只还原pydantic模型，缓存文件不能指定任意的类
+            if not (isinstance(cls, type) and hasattr(cls, "model_validate") and hasattr(cls, "model_fields")):
+                raise ValueError(f"缓存中的类型不是pydantic模型: {path}")
+            return cls.model_validate(data)
+    return {key: decode_value(value) for key, value in obj.items()}
+
+
+def make_key(func, args, kwargs):
+    """
+    函数名和参数生成稳定的key：参数按函数签名绑定并补上默认值，传不传默认参数、位置参数还是关键字参数得到的key相同；
+    方法的self/cls不参与
+    """
+    try:
+        signature = inspect.signature(func)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        first = next(iter(signature.parameters), None)
+        if first in ("self", "cls"):
+            params.pop(first, None)
+    except (TypeError, ValueError):
+        if args and not isinstance(args[0], (int, float, str, list, tuple, dict)):
+            args = args[1:]
+        params = {"args": list(args), "kwargs": kwargs}
+
+    def default(obj):
+        # 不支持的参数类型用repr，例如对象参数
+        return repr(obj)
+
+    try:
+        encoded = encode_value(params)
+    except TypeError:
+        encoded = {key: _encode_or_repr(value) for key, value in params.items()}
+    payload = json.dumps([f"{func.__module__}.{func.__qualname__}", encoded], sort_keys=True, ensure_ascii=False,
+                         separators=(",", ":"), default=default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _encode_or_repr(value):
+    try:
+        return encode_value(value)
+    except TypeError:
+        return repr(value)
+
+
+class CacheStore(object):
+    def __init__(self, cache_dir=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES,
+                 memory_items=CACHE_MEMORY_ITEMS, memory_bytes=CACHE_MEMORY_BYTES):
+        """
+        Args:
+            cache_dir: 磁盘缓存目录，文件保存在 cache_dir/key前2位/key.json
+            ttl: 默认过期秒数，0表示不过期
+            max_bytes: 磁盘缓存总大小上限，超过后删除最久没有使用的文件，直到低于上限的90%
+            memory_items: 内存LRU的条数上限
+            memory_bytes: 内存LRU的总大小上限(按序列化后的大小计算)
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory_bytes = memory_bytes
+        self._lock = threading.Lock()
+        # key -> (过期时间, 序列化后的数据, 值, 大小)，能序列化的只保存数据，每次命中都还原出新的对象，调用方修改结果不会影响缓存
+        self._memory = collections.OrderedDict()
+        self._memory_size = 0
+        # 磁盘缓存的总大小，第一次写入时扫描目录得到
+        self._disk_bytes = None
+        self._inflight = {}
+        self._async_inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    # ---------- 内存 ----------
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return False, None
+            expires_at, data, value, size = entry
+            if expires_at and expires_at < time.time():
+                del self._memory[key]
+                self._memory_size -= size
+                return False, None
+            self._memory.move_to_end(key)
+        if data is not None:
+            value = decode_value(json.loads(data)["value"])
+        return True, value
+
+    def _memory_set(self, key, expires_at, data, value=None):
+        size = len(data) if data is not None else 0
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= old[3]
+            self._memory[key] = (expires_at, data, value if data is None else None, size)
+            self._memory_size += size
+            while self._memory and (len(self._memory) > self.memory_items or self._memory_size > self.memory_bytes):
+                _, old = self._memory.popitem(last=False)
+                self._memory_size -= old[3]
+
+    # ---------- 读写 ----------
+    def get(self, key):
+        """
+        Returns:
+            (是否命中, 值)
+        """
+        hit, value = self._memory_get(key)
+        if hit:
+            self.hits += 1
+            return True, value
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            entry = json.loads(data)
+            expires_at = entry.get("expires_at") or 0
+            if expires_at and expires_at < time.time():
+                self._remove(path)
+                self.misses += 1
+                return False, None
+            value = decode_value(entry["value"])
+        except FileNotFoundError:
+            self.misses += 1
+            return False, None
+        except Exception as e:
+            logger.warning(f"读取缓存文件{path}失败，删除后重新计算: {e}")
+            self._remove(path)
+            self.misses += 1
+            return False, None
+        # 修改时间作为最近使用时间，淘汰时先删除最久没有使用的
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._memory_set(key, expires_at, data)
+        self.hits += 1
+        return True, value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl and ttl > 0 else 0
+        try:
+            data = json.dumps({"expires_at": expires_at, "value": encode_value(value)}, ensure_ascii=False).encode("utf-8")
+        except (TypeError, ValueError) as e:
+            # 不能序列化的结果只放在内存中
+            logger.warning(f"缓存结果不能序列化，只保存在内存中: {e}")
+            self._memory_set(key, expires_at, None, value)
+            return
+        self._memory_set(key, expires_at, data)
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            # 先写临时文件再原子替换，并发写入或者中途退出都不会留下不完整的文件
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"写入缓存文件{path}失败: {e}")
+            return
+        self._add_disk_bytes(len(data) - old_size)
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory_size -= entry[3]
+        self._remove(self._path(key))
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+        for path, _, _ in self._iter_files():
+            self._remove(path)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "disk_bytes": self._disk_bytes,
+        }
+
+    # ---------- 磁盘大小控制 ----------
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self._add_disk_bytes(-size, evict=False)
+
+    def _iter_files(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def _add_disk_bytes(self, delta, evict=True):
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._iter_files())
+            else:
+                self._disk_bytes += delta
+            over = evict and self.max_bytes > 0 and self._disk_bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def _evict(self):
+        files = sorted(self._iter_files(), key=lambda one: one[2])
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._disk_bytes = total
+        logger.info(f"磁盘缓存超过{self.max_bytes}字节，删除了{removed}个最久没有使用的文件")
+
+    # ---------- 并发未命中时只计算一次 ----------
+    def get_or_compute(self, key, compute, usecache=True, ttl=None):
+        """
+        Args:
+            compute: 未命中时调用，返回值满足should_cache时写入缓存
+            usecache: False时不读缓存，结果仍然写入
+        """
+        if usecache:
+            hit, value = self.get(key)
+            if hit:
+                return value
+            with self._lock:
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._inflight[key] = {"event": threading.Event(), "result": None, "error": None}
+            if not leader:
+                flight["event"].wait()
+                if flight["error"] is not None:
+                    raise flight["error"]
+                return flight["result"]
+        else:
+            flight = None
+        try:
+            result = compute()
+            if should_cache(result):
+                self.set(key, result, ttl=ttl)
+            if flight is not None:
+                flight["result"] = result
+            return result
+        except BaseException as e:
+            if flight is not None:
+                flight["error"] = e
+            raise
+        finally:
+            if flight is not None:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                flight["event"].set()
+
+    async def aget_or_compute(self, key, compute, usecache=True, ttl=None):
+        """
+        异步版本，compute返回awaitable；同一个事件循环中相同key的并发请求等待同一个结果
+        """
+        if not usecache:
+            result = await compute()
+            if should_cache(result):
+                self.set(key, result, ttl=ttl)
+            return result
+        hit, value = self.get(key)
+        if hit:
+            return value
+        loop = asyncio.get_running_loop()
+        task = self._async_inflight.get(key)
+        if task is None or task.get_loop() is not loop:
+            # compute在单独的task中执行，第一个请求被取消时不会影响等待同一个结果的其它请求
+            task = asyncio.ensure_future(self._acompute(key, compute, ttl))
+            self._async_inflight[key] = task
+            task.add_done_callback(lambda done: self._async_done(key, done))
+        return await asyncio.shield(task)
+
+    async def _acompute(self, key, compute, ttl):
+        result = await compute()
+        if should_cache(result):
+            self.set(key, result, ttl=ttl)
+        return result
+
+    def _async_done(self, key, task):
+        if self._async_inflight.get(key) is task:
+            del self._async_inflight[key]
+        # 没有其它请求等待时，避免"exception was never retrieved"警告
+        if not task.cancelled():
+            task.exception()
+
+
+def should_cache(result):
+    # 如果返回的数据是一个元祖，并且第1个参数是False,说明这个函数报错了，那么就不缓存了，这是我们自己的一个设定
+    return not (isinstance(result, tuple) and result and result[0] == False)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = CacheStore()
+        return _default_store
+
+
+def cache_decorator(func=None, *, ttl=None, store=None):
+    """
+    cache先从内存中读取，再从文件中读取, 当func中存在usecache时，并且为False时，不使用缓存
+    可以直接用@cache_decorator，也可以用@cache_decorator(ttl=3600)指定过期时间
+    Args:
+        func ():
+        ttl: 过期秒数，默认使用CACHE_TTL
+        store: CacheStore，默认使用CACHE_DIR下的共享缓存
+    Returns:
+    """
+    if func is None:
+        return lambda one: cache_decorator(one, ttl=ttl, store=store)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        usecache = kwargs.pop("usecache", True)
+        cache_store = store or get_default_store()
+        key = make_key(func, args, kwargs)
+        return cache_store.get_or_compute(key, lambda: func(*args, **kwargs), usecache=usecache, ttl=ttl)
+
+    return wrapper
+
+
+def async_cache_decorator(func=None, *, ttl=None, store=None):
+    """
+    异步函数的缓存，参数和cache_decorator相同
+    """
+    if func is None:
+        return lambda one: async_cache_decorator(one, ttl=ttl, store=store)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        usecache = kwargs.pop("usecache", True)
+        cache_store = store or get_default_store()
+        key = make_key(func, args, kwargs)
+        return await cache_store.aget_or_compute(key, lambda: func(*args, **kwargs), usecache=usecache, ttl=ttl)
+
+    return wrapper
+
+
+if __name__ == '__main__':
+    print("final")
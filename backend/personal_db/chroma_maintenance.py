@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/21
+# @File  : chroma_maintenance.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 个人知识库chroma目录的维护工具，统计每个用户collection的大小、孤立向量、索引内存，并做压缩
+# python chroma_maintenance.py stats
+# python chroma_maintenance.py orphans --delete
+# python chroma_maintenance.py compact   # 只能离线执行，服务还在运行时拒绝压缩
+
+import sys
+import argparse
+import json
+from embedding_utils import ChromaDB
+from collection_manager import offline_lock
+
+
+def human_size(num):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num < 1024:
+            return f"{num:.1f}{unit}"
+        num /= 1024
+    return f"{num:.1f}TB"
+
+
+def cmd_stats(chroma, args):
+    stats = chroma.collection_stats(dimensions=args.dimensions)
+    stats.sort(key=lambda one: one["vectors"], reverse=True)
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return
+    print(f"{'collection':<24}{'vectors':>10}{'files':>8}{'orphans':>9}{'index_disk':>12}{'index_mem':>12}")
+    for one in stats:
+        print(f"{one['collection']:<24}{one['vectors']:>10}{one['files']:>8}{one['orphan_vectors']:>9}"
+              f"{human_size(one['index_disk_bytes']):>12}{human_size(one['index_memory_bytes']):>12}")
+    print(f"共 {len(stats)} 个collection, {sum(one['vectors'] for one in stats)} 个向量, "
+          f"估算索引内存 {human_size(sum(one['index_memory_bytes'] for one in stats))}")
+
+
+def cmd_orphans(chroma, args):
+    segments = chroma.find_orphan_segments()
+    print(f"孤立的HNSW目录: {len(segments)} 个")
+    for path in segments:
+        print(f"  {path}")
+    for one in chroma.collection_stats(dimensions=args.dimensions):
+        if not one["orphan_vectors"]:
+            continue
+        print(f"collection {one['collection']} 有 {one['orphan_vectors']} 个没有file_id的向量")
+        if args.delete:
+            deleted = chroma.delete_orphan_vectors(one["collection"])
+            print(f"  已删除 {deleted} 个")
+
+
+def cmd_compact(chroma, args):
+    # 压缩期间不能有读写，服务进程持有目录的共享锁，拿不到独占锁说明服务还在运行，直接退出
+    try:
+        with offline_lock(chroma.db_dir):
+            result = chroma.compact(remove_orphan_segments=not args.keep_segments)
+    except RuntimeError as e:
+        print(f"拒绝压缩: {e}")
+        sys.exit(1)
+    print(f"压缩完成: {human_size(result['before_bytes'])} -> {human_size(result['after_bytes'])}, "
+          f"删除孤立目录 {len(result['removed_segments'])} 个")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="个人知识库chroma维护工具")
+    parser.add_argument("--db_dir", default="cache/chromadb", help="chroma持久化目录")
+    parser.add_argument("--dimensions", type=int, default=None, help="HNSW索引的向量维度，用于估算索引内存，默认INDEX_DIMENSIONS")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats_parser = subparsers.add_parser("stats", help="每个用户collection的大小和索引内存")
+    stats_parser.add_argument("--json", action="store_true", help="以json输出")
+    orphans_parser = subparsers.add_parser("orphans", help="孤立的HNSW目录和没有file_id的向量")
+    orphans_parser.add_argument("--delete", action="store_true", help="删除没有file_id的向量")
+    compact_parser = subparsers.add_parser("compact", help="删除孤立目录并VACUUM，需要先停止服务")
+    compact_parser.add_argument("--keep_segments", action="store_true", help="不删除孤立的HNSW目录")
+    args = parser.parse_args()
+
+    chroma = ChromaDB(embedder=None, db_dir=args.db_dir)
+    {"stats": cmd_stats, "orphans": cmd_orphans, "compact": cmd_compact}[args.command](chroma, args)
+
+
+if __name__ == '__main__':
+    main()
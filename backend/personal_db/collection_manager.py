@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/28
+# @File  : collection_manager.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 用户collection的访问记录和预热: HNSW索引在第一次访问时由chroma加载，超过CHROMA_MEMORY_LIMIT_BYTES时
+# 由chroma按segment的LRU卸载，这里记录每个collection的访问次数，启动时根据访问日志预热热点用户
+
+import os
+import json
+import fcntl
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import embedding_utils
+
+logger = logging.getLogger(__name__)
+
+# 后台保存访问日志的间隔(秒)
+COLLECTION_ACCESS_LOG_INTERVAL = float(os.getenv("COLLECTION_ACCESS_LOG_INTERVAL", 60))
+# 启动时预热访问次数最多的多少个用户
+COLLECTION_PREWARM_USERS = int(os.getenv("COLLECTION_PREWARM_USERS", 20))
+COLLECTION_ACCESS_LOG = os.getenv("COLLECTION_ACCESS_LOG", "cache/collection_access.json")
+
+
+class CollectionManager(object):
+    def __init__(self, chroma, access_log=COLLECTION_ACCESS_LOG):
+        """
+        所有请求共用一个ChromaDB，索引的加载和按内存上限卸载交给chroma的LRU缓存，不需要暂停请求或重建client
+        Args:
+            chroma: 共用的ChromaDB实例，memory_limit_bytes决定LRU的内存上限
+            access_log: 访问日志文件，记录每个collection的访问次数和最后访问时间
+        """
+        self.chroma = chroma
+        self.access_log = access_log
+        self._access = self._load_access_log()
+        self._access_dirty = False
+        self._lock = threading.Lock()
+
+    def _load_access_log(self):
+        if not os.path.exists(self.access_log):
+            return {}
+        try:
+            with open(self.access_log, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"读取collection访问日志{self.access_log}失败: {e}")
+            return {}
+
+    def save_access_log(self):
+        with self._lock:
+            if not self._access_dirty:
+                return
+            access = dict(self._access)
+            self._access_dirty = False
+        log_dir = os.path.dirname(self.access_log)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        temp_path = f"{self.access_log}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(access, f)
+        os.replace(temp_path, self.access_log)
+
+    def _estimate_bytes(self, count):
+        # 和collection_stats的估算一致: float32向量加上HNSW每个节点大约M*2个int32的邻居
+        return count * (self.chroma.index_dimensions * 4 + 16 * 2 * 4)
+
+    def _warm(self, name):
+        """
+        查询一次让chroma把HNSW索引加载到内存
+        Returns:
+            int: 估算的索引内存，collection不存在时返回None
+        """
+        try:
+            col = self.chroma.client.get_collection(name)
+        except Exception:
+            return None
+        count = col.count()
+        if count:
+            # 用collection中已有的向量查询，兼容不同维度的旧数据
+            sample = col.get(limit=1, include=["embeddings"])["embeddings"]
+            col.query(query_embeddings=[list(sample[0])], n_results=1, include=[])
+        return self._estimate_bytes(count)
+
+    @contextmanager
+    def use(self, *names):
+        """
+        使用collection，记录访问次数和最后访问时间，返回共用的ChromaDB
+        Args:
+            names: collection名称，可以是多个
+        """
+        now = time.time()
+        with self._lock:
+            for name in names:
+                access = self._access.setdefault(name, {"count": 0, "last_access": 0})
+                access["count"] += 1
+                access["last_access"] = now
+            self._access_dirty = True
+        yield self.chroma
+
+    def prewarm(self, top_n=COLLECTION_PREWARM_USERS):
+        """
+        按访问日志中的访问次数预热，不超过chroma的内存上限，否则预热的索引会被LRU立即卸载
+        Returns:
+            list[str]: 预热的collection
+        """
+        with self._lock:
+            hot = sorted(self._access.items(), key=lambda item: (item[1]["count"], item[1]["last_access"]), reverse=True)
+        warmed = []
+        total = 0
+        for name, _ in hot[:top_n]:
+            size = self._warm(name)
+            if size is None:
+                continue
+            if self.chroma.memory_limit_bytes and total + size > self.chroma.memory_limit_bytes:
+                break
+            total += size
+            warmed.append(name)
+        logger.info(f"预热collection {len(warmed)} 个，估算内存 {total} bytes")
+        return warmed
+
+    def start(self, interval=COLLECTION_ACCESS_LOG_INTERVAL, prewarm_users=COLLECTION_PREWARM_USERS):
+        """
+        后台线程: 先预热热点用户，然后定时保存访问日志
+        """
+        def loop():
+            try:
+                self.prewarm(prewarm_users)
+            except Exception as e:
+                logger.error(f"预热collection失败: {e}", exc_info=True)
+            while True:
+                time.sleep(interval)
+                try:
+                    self.save_access_log()
+                except Exception as e:
+                    logger.error(f"保存collection访问日志失败: {e}", exc_info=True)
+
+        thread = threading.Thread(target=loop, name="collection_manager", daemon=True)
+        thread.start()
+        return thread
+
+
+def service_lock_path(db_dir):
+    return f"{db_dir.rstrip('/')}.lock"
+
+
+def hold_service_lock(db_dir):
+    """
+    服务进程持有chroma目录的共享文件锁直到退出，多个worker可以同时持有，离线维护工具据此判断服务是否在运行
+    Returns:
+        打开的锁文件，关闭后释放
+    """
+    f = open(service_lock_path(db_dir), "w")
+    fcntl.flock(f, fcntl.LOCK_SH)
+    return f
+
+
+@contextmanager
+def offline_lock(db_dir):
+    """
+    离线维护时获取chroma目录的独占文件锁，服务仍在使用这个目录时抛出RuntimeError，不等待
+    """
+    with open(service_lock_path(db_dir), "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f"{db_dir} 正在被服务使用，请先停止服务")
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+_service_lock = None
+
+
+def get_collection_manager():
+    """
+    进程内共用的CollectionManager，服务中的ChromaDB都从这里获取
+    """
+    global _manager, _service_lock
+    with _manager_lock:
+        if _manager is None:
+            embedder = embedding_utils.EmbeddingModel() if os.getenv("ALI_API_KEY") else None
+            chroma = embedding_utils.ChromaDB(embedder)
+            _service_lock = hold_service_lock(chroma.db_dir)
+            _manager = CollectionManager(chroma)
+        return _manager
@@ -9,101 +9,89 @@ import os
 from typing import Any, Dict, List, Optional
 import time
 import copy
+import collections
 import json
 import logging
 import requests
 import numpy as np
-import pickle
-import hashlib
-from functools import wraps
+import shutil
+import sqlite3
 import string
+import threading
+from contextlib import contextmanager
 import chromadb  #pip install chromadb
 from chromadb.config import Settings
 from openai import OpenAI
 from dotenv import load_dotenv
+from bm25_index import BM25Index, reciprocal_rank_fusion
+import reranker
+from quantized_store import Int8VectorStore, truncate_normalize
+from cache_utils import cal_md5, cache_decorator
 # 加载环境变量
 load_dotenv()
 
 
 logger = logging.getLogger(__name__)
 
-def cal_md5(content):
-    """
-    计算content字符串的md5
-    :param content:
-    :return:
-    """
-    # 使用encode
-    content = str(content)
-    result = hashlib.md5(content.encode())
-    # 打印hash
-    md5 = result.hexdigest()
-    return md5
-
-
-def cache_decorator(func):
-    """
-    cache从文件中读取, 当func中存在usecache时，并且为False时，不使用缓存
-    Args:
-        func ():
-    Returns:
-    """
-    cache_path = "cache" #cache目录
-    if not os.path.exists(cache_path):
-        os.mkdir(cache_path)
-
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        # 将args和kwargs转换为哈希键， 当装饰类中的函数的时候，args的第一个参数是实例化的类，这会通常导致改变，我们不想检测它是否改变，那么就忽略它
-        usecache = kwargs.get("usecache", True)
-        if "usecache" in kwargs:
-            del kwargs["usecache"]
-        if len(args)> 0:
-            if isinstance(args[0],(int, float, str, list, tuple, dict)):
-                key = str(args) + str(kwargs)
-            else:
-                # 第1个参数以后的内容
-                key = str(args[1:]) + str(kwargs)
-        else:
-            key = str(args) + str(kwargs)
-        # 变成md5字符串
-        key_file = os.path.join(cache_path, cal_md5(key) + "_cache.pkl")
-        # 如果结果已缓存，则返回缓存的结果
-        if os.path.exists(key_file) and usecache:
-            # 去掉kwargs中的usecache
-            print(f"函数{func.__name__}被调用，缓存被命中，使用已缓存结果，对于参数{key}")
-            try:
-                with open(key_file, 'rb') as f:
-                    result = pickle.load(f)
-                    return result
-            except Exception as e:
-                print(f"函数{func.__name__}被调用，缓存被命中，读取文件:{key_file}失败，错误信息:{e}")
-        result = func(*args, **kwargs)
-        # 将结果缓存到文件中
-        # 如果返回的数据是一个元祖，并且第1个参数是False,说明这个函数报错了，那么就不缓存了，这是我们自己的一个设定
-        if isinstance(result, tuple) and result[0] == False:
-            print(f"函数{func.__name__}被调用，返回结果为False，对于参数{key}, 不缓存")
-        else:
-            with open(key_file, 'wb') as f:
-                pickle.dump(result, f)
-            print(f"函数{func.__name__}被调用，缓存未命中，结果被缓存，对于参数{key}, 写入文件:{key_file}")
-        return result
-
-    return wrapper
+# embedding模型输出的维度，text-embedding-v4支持64到2048
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 1024))
+# HNSW索引中存储的维度，小于EMBEDDING_DIMENSIONS时截断并重新归一化，减少索引的内存和磁盘
+INDEX_DIMENSIONS = int(os.getenv("INDEX_DIMENSIONS", EMBEDDING_DIMENSIONS))
+# int8: 完整维度的向量量化成int8另外存储，检索时对候选用float查询向量重新打分; none: 不重新打分
+VECTOR_RESCORE = os.getenv("VECTOR_RESCORE", "none")
+# 重新打分时HNSW召回的候选数是topk的多少倍
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", 4))
+# 已加载HNSW索引的内存上限(字节，按索引目录的磁盘大小计算)，超过后chroma按LRU卸载最久没访问的collection，0表示不限制
+CHROMA_MEMORY_LIMIT_BYTES = int(os.getenv("CHROMA_MEMORY_LIMIT_BYTES", 0))
 
 
 class ChromaDB(object):
-    def __init__(self, embedder, db_dir="cache/chromadb"):
+    def __init__(self, embedder, db_dir="cache/chromadb", index_dimensions=INDEX_DIMENSIONS, rescore=VECTOR_RESCORE,
+                 memory_limit_bytes=CHROMA_MEMORY_LIMIT_BYTES):
         """
         Args:
             embedder: 实例化后的embedding
             chromadb的相关操作
+            index_dimensions: HNSW索引中向量的维度
+            rescore: int8表示另外保存int8量化的完整向量，用于对候选重新打分
+            memory_limit_bytes: 大于0时使用chroma按segment的LRU缓存，已加载的HNSW索引超过上限时卸载最久没访问的
         """
         # 目前支持的模型,
         self.embedder = embedder
+        self.db_dir = db_dir
         if not os.path.exists(db_dir):
             os.makedirs(db_dir)
-        self.client = chromadb.PersistentClient(path=db_dir, settings=Settings(anonymized_telemetry=False))
+        self.memory_limit_bytes = memory_limit_bytes
+        if memory_limit_bytes > 0:
+            settings = Settings(anonymized_telemetry=False, chroma_segment_cache_policy="LRU",
+                                chroma_memory_limit_bytes=memory_limit_bytes)
+        else:
+            settings = Settings(anonymized_telemetry=False)
+        self.client = chromadb.PersistentClient(path=db_dir, settings=settings)
+        # 和chroma同步的BM25倒排索引，用于混合检索
+        self.bm25 = BM25Index(f"{db_dir.rstrip('/')}_bm25.sqlite3")
+        self.index_dimensions = index_dimensions
+        self.int8_store = Int8VectorStore(f"{db_dir.rstrip('/')}_int8.sqlite3") if rescore == "int8" else None
+        # 每个collection的条数，混合检索时不再每次查询都COUNT，写入和删除时失效
+        self._counts = {}
+        # 每个collection一个写锁，同一个用户的写入(diff、embedding、upsert/delete、BM25同步)串行执行
+        self._write_locks = {}
+        self._write_locks_guard = threading.Lock()
+
+    @contextmanager
+    def write_lock(self, *collections):
+        """
+        获取这些collection的写锁，按名称排序获取，多个collection同时写入时不会死锁
+        """
+        with self._write_locks_guard:
+            locks = [self._write_locks.setdefault(name, threading.RLock()) for name in sorted(set(collections))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
 
     def delete_one_collection(self, collection):
         """
@@ -113,7 +101,12 @@ class ChromaDB(object):
         Returns:
         """
         try:
-            self.client.delete_collection(name=collection)
+            with self.write_lock(collection):
+                self.client.delete_collection(name=collection)
+                self._counts.pop(collection, None)
+                self.bm25.drop(collection)
+                if self.int8_store:
+                    self.int8_store.drop(collection)
         except Exception as e:
             print(f"删除collection:{collection}失败，错误信息:{e}")
             return "fail"
@@ -121,33 +114,35 @@ class ChromaDB(object):
 
     def delete_one_document(self, collection, doc_id):
         """
-        删除指定集合中的一条数据（根据 ID），并验证是否删除成功。
+        删除指定集合中的一条数据（根据 ID）
         Args:
             collection (str): 集合名称。
             doc_id (str): 要删除的文档 ID。
         Returns:
             str: "success" 表示删除成功，"fail" 表示失败。
         """
+        return self.delete_documents(collection, [doc_id])
+
+    def delete_documents(self, collection, doc_ids):
+        """
+        批量删除指定集合中的数据，chroma的delete是同步的，不再逐条查询验证
+        Args:
+            collection (str): 集合名称。
+            doc_ids (list[str]): 要删除的文档 ID。
+        Returns:
+            str: "success" 表示删除成功，"fail" 表示失败。
+        """
         try:
-            col = self.client.get_or_create_collection(collection)
-            # 删除指定 ID 的文档
-            col.delete(ids=[doc_id])
-            print(f"尝试删除集合 '{collection}' 中的文档 ID '{doc_id}'。")
-
-            # 验证是否删除成功：查询该 ID，如果结果为空，则成功
-            check_result = col.get(ids=[doc_id])
-            if not check_result['ids']:  # 如果 IDs 列表为空，说明已删除
-                print(f"验证成功：集合 '{collection}' 中的文档 ID '{doc_id}' 已删除。")
-                return "success"
-            else:
-                print(f"验证失败：集合 '{collection}' 中的文档 ID '{doc_id}' 仍存在。")
-                return "fail"
+            col = self.client.get_collection(collection)
+            with self.write_lock(collection):
+                col.delete(ids=list(doc_ids))
+                self._sync_delete_ids(collection, list(doc_ids))
+            print(f"删除集合 '{collection}' 中的文档 {len(doc_ids)} 条。")
+            return "success"
         except Exception as e:
-            print(f"删除集合 '{collection}' 中的文档 ID '{doc_id}' 失败，错误信息: {e}")
+            print(f"删除集合 '{collection}' 中的文档 ID '{doc_ids}' 失败，错误信息: {e}")
             return "fail"
 
-
-
     def insert2collection(self, collection, documents, meta=None):
         """
         Args:
@@ -160,42 +155,208 @@ class ChromaDB(object):
         vectors_result = self.embedder.do_embedding(documents)
         vectors = vectors_result["data"]
         embeddings = [one["embedding"] for one in vectors]
-        col.add(
-            embeddings=embeddings,
+        ids = [str(i) for i in range(len(documents))]
+        with self.write_lock(collection):
+            self._write_vectors(col, collection, ids, embeddings, documents, meta or None)
+        return "success"
+
+    def _write_vectors(self, col, collection, ids, embeddings, documents, metadatas):
+        """
+        写入chroma，HNSW中存截断后的低维向量，同时同步BM25索引和int8向量
+        """
+        col.upsert(
+            embeddings=self._index_vectors(embeddings),
             documents=documents,
-            metadatas=meta,
-            ids=[str(i) for i in range(len(documents))]
+            metadatas=metadatas,
+            ids=ids
         )
-        return "success"
+        self._counts.pop(collection, None)
+        file_ids = [(meta or {}).get("file_id", "") for meta in (metadatas or [None] * len(ids))]
+        self.bm25.upsert(collection, ids, documents, file_ids)
+        if self.int8_store:
+            self.int8_store.upsert(collection, ids, embeddings, file_ids)
+
+    def _sync_delete_ids(self, collection, ids):
+        self._counts.pop(collection, None)
+        self.bm25.delete_ids(collection, ids)
+        if self.int8_store:
+            self.int8_store.delete_ids(collection, ids)
+
+    def _index_vectors(self, embeddings):
+        if not len(embeddings) or len(embeddings[0]) <= self.index_dimensions:
+            return embeddings
+        return truncate_normalize(embeddings, self.index_dimensions).tolist()
+
+    def _dense_query(self, col, collection, embeddings, n_results, where_document=None):
+        """
+        向量检索，开启int8重新打分时先用低维向量召回n_results*RESCORE_FACTOR条候选，
+        再用完整的float查询向量和int8向量计算余弦距离，重新排序后取n_results条
+        """
+        n_candidates = n_results * RESCORE_FACTOR if self.int8_store else n_results
+        kwargs = {"where_document": where_document} if where_document else {}
+        query_result = col.query(
+            query_embeddings=self._index_vectors(embeddings),
+            n_results=n_candidates,
+            include=["metadatas", "documents", "distances"],
+            **kwargs
+        )
+        if not self.int8_store:
+            return query_result
+        result = {key: [] for key in ["ids", "documents", "metadatas", "distances"]}
+        for i, embedding in enumerate(embeddings):
+            ids = query_result["ids"][i]
+            full_vectors = self.int8_store.get(collection, ids)
+            query_vector = np.asarray(embedding, dtype=np.float32)
+            query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+            distances = []
+            for chunk_id, distance in zip(ids, query_result["distances"][i]):
+                vector = full_vectors.get(chunk_id)
+                if vector is not None and len(vector) == len(query_vector):
+                    distance = 1.0 - float(np.dot(query_vector, vector) / (np.linalg.norm(vector) or 1.0))
+                distances.append(distance)
+            order = sorted(range(len(ids)), key=lambda index: distances[index])[:n_results]
+            result["ids"].append([ids[index] for index in order])
+            result["documents"].append([query_result["documents"][i][index] for index in order])
+            result["metadatas"].append([query_result["metadatas"][i][index] for index in order])
+            result["distances"].append([distances[index] for index in order])
+        return result
 
-    def query2collection(self, collection, query_documents, keyword="", topk=3):
+    def query2collection(self, collection, query_documents, keyword="", topk=3, mode="dense", candidates=None,
+                         rerank=False, rerank_candidates=50):
         """
         查询向量，混合搜索
         Args:
             collection ():
             query_documents (): list[str]
-            keyword: 是否同时对documents执行关键字搜索
+            keyword: dense模式下强制documents包含这个关键词，hybrid模式下作为BM25的额外查询词
+            topk: 返回数量
+            mode: dense只用向量检索，hybrid同时做BM25检索，用RRF融合两路结果
+            candidates: hybrid模式下每一路召回的数量，默认max(topk*4, 20)
+            rerank: 是否先召回rerank_candidates条，再用本地reranker重排序取topk
+            rerank_candidates: 重排序的候选数量
         Returns:
         """
         col = self.client.get_or_create_collection(collection)
         vectors_result = self.embedder.do_embedding(texts=query_documents)
         vectors = vectors_result["data"]
         embeddings = [one["embedding"] for one in vectors]
-        if keyword:
-            query_result = col.query(
-                query_embeddings=embeddings,
-                n_results=topk,
-                where_document={"$contains": keyword},
-                include=["metadatas", "documents", "distances"]
-            )
+        n_results = max(rerank_candidates, topk) if rerank else topk
+        if mode == "hybrid":
+            query_result = self._hybrid_query(col, collection, query_documents, embeddings, keyword, n_results,
+                                              max(candidates or 0, n_results) or None)
+        elif keyword:
+            query_result = self._dense_query(col, collection, embeddings, n_results, where_document={"$contains": keyword})
         else:
-            query_result = col.query(
-                query_embeddings=embeddings,
-                n_results=topk,
-                include=["metadatas", "documents", "distances"]
-            )
+            query_result = self._dense_query(col, collection, embeddings, n_results)
+        if rerank:
+            query_result = self._rerank_result(query_documents, query_result, topk)
         return query_result
 
+    def _rerank_result(self, query_documents, query_result, topk):
+        """
+        对每个查询的候选重排序，只保留topk条，增加rerank_scores字段
+        """
+        scorer = reranker.get_reranker()
+        keys = [key for key in ["ids", "documents", "metadatas", "distances", "scores"] if query_result.get(key)]
+        result = {key: [] for key in keys}
+        result["rerank_scores"] = []
+        for i, query in enumerate(query_documents):
+            documents = query_result["documents"][i]
+            chunk_hashes = [(meta or {}).get("chunk_hash") or cal_md5(document) for document, meta in
+                            zip(documents, query_result["metadatas"][i])]
+            ranked = scorer.rerank(query, documents, topk, chunk_hashes=chunk_hashes)
+            for key in keys:
+                result[key].append([query_result[key][i][index] for index, _ in ranked])
+            result["rerank_scores"].append([score for _, score in ranked])
+        return result
+
+    def batch_query2collection(self, collection, query_documents, keyword="", topk=3, mode="dense",
+                               rerank=False, rerank_candidates=50):
+        """
+        多个查询一次检索：一次embedding请求，一次多向量的col.query，然后跨查询去重
+        Args:
+            collection ():
+            query_documents (): list[str]
+            keyword: 同query2collection
+            topk: 每个查询返回的数量
+            mode: dense或hybrid
+            rerank, rerank_candidates: 同query2collection
+        Returns:
+            dict: 去重后的ids、documents、metadatas、distances，以及每条结果被哪些查询命中(query_hits, 查询的下标)
+                  结果按各查询的排名轮流排列，保证每个查询的第1名都在前面
+        """
+        query_result = self.query2collection(collection, query_documents, keyword=keyword, topk=topk, mode=mode,
+                                             rerank=rerank, rerank_candidates=rerank_candidates)
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": [], "query_hits": []}
+        position = {}
+        for rank in range(topk):
+            for query_index in range(len(query_documents)):
+                ids = query_result["ids"][query_index]
+                if rank >= len(ids):
+                    continue
+                chunk_id = ids[rank]
+                if chunk_id in position:
+                    result["query_hits"][position[chunk_id]].append(query_index)
+                    continue
+                position[chunk_id] = len(result["ids"])
+                result["ids"].append(chunk_id)
+                result["documents"].append(query_result["documents"][query_index][rank])
+                result["metadatas"].append(query_result["metadatas"][query_index][rank])
+                result["distances"].append(query_result["distances"][query_index][rank])
+                result["query_hits"].append([query_index])
+        return result
+
+    def rebuild_bm25(self, collection):
+        """
+        根据chroma中已有的数据重建BM25索引，用于启用混合检索之前就已经存在的collection
+        """
+        col = self.client.get_collection(collection)
+        data = col.get(include=["documents", "metadatas"])
+        self.bm25.drop(collection)
+        file_ids = [(meta or {}).get("file_id", "") for meta in data["metadatas"]]
+        self.bm25.upsert(collection, data["ids"], data["documents"], file_ids)
+        logger.info(f"重建集合 {collection} 的BM25索引，共 {len(data['ids'])} 条")
+        return len(data["ids"])
+
+    def _collection_count(self, col, collection):
+        count = self._counts.get(collection)
+        if count is None:
+            count = col.count()
+            self._counts[collection] = count
+        return count
+
+    def _hybrid_query(self, col, collection, query_documents, embeddings, keyword, topk, candidates):
+        """
+        向量检索和BM25检索各召回candidates条，RRF融合后取topk，返回格式和col.query一致，另外多一个scores字段
+        """
+        candidates = candidates or max(topk * 4, 20)
+        total = self._collection_count(col, collection)
+        if total and self.bm25.is_empty(collection):
+            with self.write_lock(collection):
+                # 等锁期间可能已经被其它请求重建
+                if self.bm25.is_empty(collection):
+                    self.rebuild_bm25(collection)
+        dense_result = self._dense_query(col, collection, embeddings, min(candidates, max(total, 1)))
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": [], "scores": []}
+        for i, query in enumerate(query_documents):
+            dense_ids = dense_result["ids"][i]
+            lexical = self.bm25.search(collection, f"{query} {keyword}" if keyword else query, candidates)
+            fused = reciprocal_rank_fusion([dense_ids, [chunk_id for chunk_id, _ in lexical]])[:topk]
+            known = {chunk_id: (document, meta, distance) for chunk_id, document, meta, distance in
+                     zip(dense_ids, dense_result["documents"][i], dense_result["metadatas"][i], dense_result["distances"][i])}
+            # 只有BM25召回的chunk需要再取一次内容
+            missing = [chunk_id for chunk_id, _ in fused if chunk_id not in known]
+            if missing:
+                extra = col.get(ids=missing, include=["documents", "metadatas"])
+                for chunk_id, document, meta in zip(extra["ids"], extra["documents"], extra["metadatas"]):
+                    known[chunk_id] = (document, meta, None)
+            fused = [(chunk_id, score) for chunk_id, score in fused if chunk_id in known]
+            result["ids"].append([chunk_id for chunk_id, _ in fused])
+            result["documents"].append([known[chunk_id][0] for chunk_id, _ in fused])
+            result["metadatas"].append([known[chunk_id][1] for chunk_id, _ in fused])
+            result["distances"].append([known[chunk_id][2] for chunk_id, _ in fused])
+            result["scores"].append([score for _, score in fused])
+        return result
 
     def delete_file_vectors(self, user_id: int, file_id: int):
         """
@@ -206,19 +367,44 @@ class ChromaDB(object):
         Returns:
             str: "success" 表示删除成功，"fail" 表示失败
         """
+        return self.delete_files_vectors(user_id, [file_id])
+
+    def delete_files_vectors(self, user_id: int, file_ids: List[int]):
+        """
+        根据用户ID和多个文件ID删除对应的向量，一次$in删除，用户还没有collection时直接返回成功
+        Args:
+            user_id (int): 用户ID
+            file_ids (List[int]): 文件ID列表
+        Returns:
+            str: "success" 表示删除成功，"fail" 表示失败
+        """
+        collection_name = f"user_{user_id}"
         try:
-            collection_name = f"user_{user_id}"
-            col = self.client.get_or_create_collection(collection_name)
-            col.delete(where={"file_id": file_id})
-            logger.info(f"成功删除用户 {user_id} 的文件 {file_id} 对应的向量")
+            try:
+                col = self.client.get_collection(collection_name)
+            except Exception:
+                logger.info(f"用户 {user_id} 没有collection，无需删除")
+                return "success"
+            file_ids = list(file_ids)
+            if len(file_ids) == 1:
+                where = {"file_id": file_ids[0]}
+            else:
+                where = {"file_id": {"$in": file_ids}}
+            with self.write_lock(collection_name):
+                col.delete(where=where)
+                self._counts.pop(collection_name, None)
+                self.bm25.delete_files(collection_name, file_ids)
+                if self.int8_store:
+                    self.int8_store.delete_files(collection_name, file_ids)
+            logger.info(f"成功删除用户 {user_id} 的文件 {file_ids} 对应的向量")
             return "success"
         except Exception as e:
-            logger.error(f"删除用户 {user_id} 的文件 {file_id} 向量失败: {str(e)}", exc_info=True)
+            logger.error(f"删除用户 {user_id} 的文件 {file_ids} 向量失败: {str(e)}", exc_info=True)
             return "fail"
 
     def insert_file_vectors(self, file_name:str, user_id: int, file_id: int, file_type: str, url: str, folder_id: int, documents: List[str]):
         """
-        将文件内容插入到ChromaDB中，生成并存储embedding向量
+        将文件内容插入到ChromaDB中，生成并存储embedding向量，重复保存同一个文件时只对新增或修改的chunk做embedding
         Args:
             file_name: file_name, 文件名称
             user_id (int): 用户ID
@@ -228,29 +414,135 @@ class ChromaDB(object):
             folder_id (int): 文件夹ID
             documents (List[str]): 文件内容列表
         Returns:
-            dict: 包含embedding结果
+            dict: 新增、更新、删除、未变化的chunk数量以及embed/index耗时
         """
         try:
             collection_name = f"user_{user_id}"
-            vectors_result = self.embedder.do_embedding(texts=documents)
-            vectors = vectors_result["data"]
-            embeddings = [one["embedding"] for one in vectors]
-            meta = [{"file_name": file_name,"file_id": file_id, "user_id": user_id, "folder_id": folder_id, "url": url, "file_type": file_type} for _ in documents]
-            ids = [f"{file_id}_{i}" for i in range(len(documents))]
-            col = self.client.get_or_create_collection(collection_name, metadata={"hnsw:space": "cosine"})
-            col.add(
-                embeddings=embeddings,
-                documents=documents,
-                metadatas=meta,
-                ids=ids
-            )
-            logger.info(f"成功插入文件 {file_id} 的向量到集合 {collection_name}")
-            return vectors_result
+            result = self.insert_files_vectors([{
+                "file_name": file_name,
+                "user_id": user_id,
+                "file_id": file_id,
+                "file_type": file_type,
+                "url": url,
+                "folder_id": folder_id,
+                "documents": documents,
+            }])
+            logger.info(f"成功插入文件 {file_id} 的向量到集合 {collection_name}: {result}")
+            return result
         except Exception as e:
             logger.error(f"插入用户 {user_id} 的文件 {file_id} 向量失败: {str(e)}", exc_info=True)
             raise ValueError(f"插入向量失败: {str(e)}")
 
+    def diff_file_chunks(self, col, one: Dict[str, Any]):
+        """
+        对比文件新内容和collection中已有的chunk，chunk的ID由文件ID、内容hash和相同内容的出现次数组成，
+        已有chunk的metadata中的chunk_hash就是这个文件的manifest
+        Args:
+            col: chroma的collection
+            one: dict, 包含 file_name, user_id, file_id, file_type, url, folder_id, documents
+        Returns:
+            dict: add(需要embedding的chunk)，update(内容没变，只更新metadata的chunk)，delete(需要删除的chunk ID)，unchanged数量
+        """
+        file_id = one["file_id"]
+        existing = col.get(where={"file_id": file_id}, include=["metadatas"])
+        manifest = {chunk_id: (meta or {}) for chunk_id, meta in zip(existing["ids"], existing["metadatas"])}
+        plan = {"add": {"ids": [], "documents": [], "metadatas": []}, "update": {"ids": [], "metadatas": []}, "delete": [], "unchanged": 0}
+        occurrences = collections.Counter()
+        new_ids = set()
+        for document in one["documents"]:
+            chunk_hash = cal_md5(document)
+            chunk_id = f"{file_id}_{chunk_hash}_{occurrences[chunk_hash]}"
+            occurrences[chunk_hash] += 1
+            new_ids.add(chunk_id)
+            meta = {"file_name": one["file_name"], "file_id": file_id, "user_id": one["user_id"], "folder_id": one["folder_id"],
+                    "url": one["url"], "file_type": one["file_type"], "chunk_hash": chunk_hash}
+            old_meta = manifest.get(chunk_id)
+            if old_meta is None or old_meta.get("chunk_hash") != chunk_hash:
+                plan["add"]["ids"].append(chunk_id)
+                plan["add"]["documents"].append(document)
+                plan["add"]["metadatas"].append(meta)
+            elif old_meta != meta:
+                # 内容没变，文件名、文件夹等信息变化，不需要重新embedding；metadata中不存chunk的位置，
+                # 否则在文件开头插入一个chunk会让后面所有chunk都需要update
+                plan["update"]["ids"].append(chunk_id)
+                plan["update"]["metadatas"].append(meta)
+            else:
+                plan["unchanged"] += 1
+        plan["delete"] = [chunk_id for chunk_id in manifest if chunk_id not in new_ids]
+        return plan
 
+    def insert_files_vectors(self, files: List[Dict[str, Any]]):
+        """
+        批量插入多个文件，只对新增或修改的chunk做embedding，所有文件需要embedding的chunk合并后一起请求，保证每个批次都是满的。
+        embedding全部成功后，每个collection再依次执行一次upsert、update、delete，embedding失败时不会修改collection
+        Args:
+            files: list[dict], 每个元素包含 file_name, user_id, file_id, file_type, url, folder_id, documents
+        Returns:
+            dict: {"files": 文件数, "chunks": chunk数, "added": 新增数, "updated": 更新数, "deleted": 删除数,
+                   "unchanged": 未变化数, "collections": collection数, "timings": {"embed": 秒, "index": 秒}}
+        """
+        # 同一个文件在一批中出现多次时只保留最后一次
+        files = list({(one["user_id"], one["file_id"]): one for one in files}.values())
+        # 从diff到写入完成都持有写锁，同一个文件的两次更新不会基于同一份旧chunk各自写入
+        with self.write_lock(*{f"user_{one['user_id']}" for one in files}):
+            return self._insert_files_vectors(files)
+
+    def _insert_files_vectors(self, files: List[Dict[str, Any]]):
+        grouped = {}
+        for one in files:
+            collection_name = f"user_{one['user_id']}"
+            if collection_name not in grouped:
+                col = self.client.get_or_create_collection(collection_name, metadata={"hnsw:space": "cosine"})
+                grouped[collection_name] = {"col": col, "add": {"ids": [], "documents": [], "metadatas": []},
+                                            "update": {"ids": [], "metadatas": []}, "delete": [], "unchanged": 0}
+            group = grouped[collection_name]
+            plan = self.diff_file_chunks(group["col"], one)
+            for key in ["ids", "documents", "metadatas"]:
+                group["add"][key].extend(plan["add"][key])
+            for key in ["ids", "metadatas"]:
+                group["update"][key].extend(plan["update"][key])
+            group["delete"].extend(plan["delete"])
+            group["unchanged"] += plan["unchanged"]
+
+        add_documents = []
+        for group in grouped.values():
+            add_documents.extend(group["add"]["documents"])
+        start_time = time.time()
+        embeddings = []
+        if add_documents:
+            vectors_result = self.embedder.do_embedding(texts=add_documents)
+            embeddings = [one["embedding"] for one in vectors_result["data"]]
+            if len(embeddings) != len(add_documents):
+                raise ValueError(f"插入向量失败: embedding数量{len(embeddings)}和文本数量{len(add_documents)}不一致")
+        embed_time = time.time() - start_time
+
+        start_time = time.time()
+        offset = 0
+        for collection_name, group in grouped.items():
+            col = group["col"]
+            add = group["add"]
+            if add["ids"]:
+                self._write_vectors(col, collection_name, add["ids"], embeddings[offset:offset + len(add["ids"])],
+                                    add["documents"], add["metadatas"])
+                offset += len(add["ids"])
+            if group["update"]["ids"]:
+                col.update(**group["update"])
+            if group["delete"]:
+                col.delete(ids=group["delete"])
+                self._sync_delete_ids(collection_name, group["delete"])
+            logger.info(f"集合 {collection_name} 增量更新完成: 新增 {len(add['ids'])}, 更新 {len(group['update']['ids'])}, "
+                        f"删除 {len(group['delete'])}, 未变化 {group['unchanged']}")
+        index_time = time.time() - start_time
+        return {
+            "files": len(files),
+            "chunks": sum(len(one["documents"]) for one in files),
+            "added": len(add_documents),
+            "updated": sum(len(group["update"]["ids"]) for group in grouped.values()),
+            "deleted": sum(len(group["delete"]) for group in grouped.values()),
+            "unchanged": sum(group["unchanged"] for group in grouped.values()),
+            "collections": len(grouped),
+            "timings": {"embed": embed_time, "index": index_time},
+        }
 
     def list_collection(self, collection, number=100):
         """
@@ -273,16 +565,128 @@ class ChromaDB(object):
         Returns:
         """
         collections_info = self.client.list_collections()
-        collections = [i.name for i in collections_info]
+        collections = [i if isinstance(i, str) else i.name for i in collections_info]
         return collections
 
+    def _sqlite_path(self):
+        return os.path.join(self.db_dir, "chroma.sqlite3")
+
+    def _vector_segments(self):
+        """
+        从chroma的sqlite中读取向量段，每个向量段在db_dir下有一个同名的HNSW目录
+        Returns:
+            dict: {segment_id: collection_name}
+        """
+        conn = sqlite3.connect(f"file:{self._sqlite_path()}?mode=ro", uri=True, timeout=30)
+        try:
+            rows = conn.execute(
+                "SELECT s.id, c.name FROM segments s JOIN collections c ON s.collection = c.id WHERE s.scope = 'VECTOR'"
+            ).fetchall()
+        finally:
+            conn.close()
+        return {segment_id: name for segment_id, name in rows}
+
+    @staticmethod
+    def _dir_size(path):
+        total = 0
+        for root, _, names in os.walk(path):
+            for name in names:
+                total += os.path.getsize(os.path.join(root, name))
+        return total
+
+    def find_orphan_segments(self):
+        """
+        找出db_dir下已经没有collection引用的HNSW目录，通常是删除collection后残留的
+        Returns:
+            list[str]: 孤立目录路径
+        """
+        segments = self._vector_segments()
+        orphans = []
+        for name in os.listdir(self.db_dir):
+            path = os.path.join(self.db_dir, name)
+            if os.path.isdir(path) and name not in segments:
+                orphans.append(path)
+        return orphans
+
+    def collection_stats(self, dimensions=None):
+        """
+        统计每个collection的向量数、文件数、没有file_id的孤立向量数、HNSW索引在磁盘上的大小，以及估算的索引内存
+        Args:
+            dimensions: HNSW索引中向量的维度，默认使用index_dimensions
+        Returns:
+            list[dict]
+        """
+        dimensions = dimensions or self.index_dimensions
+        segment_dirs = {}
+        for segment_id, name in self._vector_segments().items():
+            path = os.path.join(self.db_dir, segment_id)
+            if os.path.isdir(path):
+                segment_dirs[name] = segment_dirs.get(name, 0) + self._dir_size(path)
+        stats = []
+        for name in self.list_exist_collections():
+            col = self.client.get_collection(name)
+            data = col.get(include=["metadatas"])
+            metadatas = [meta or {} for meta in data["metadatas"]]
+            file_ids = {meta["file_id"] for meta in metadatas if "file_id" in meta}
+            count = len(data["ids"])
+            stats.append({
+                "collection": name,
+                "vectors": count,
+                "files": len(file_ids),
+                "orphan_vectors": sum(1 for meta in metadatas if "file_id" not in meta),
+                "index_disk_bytes": segment_dirs.get(name, 0),
+                # float32向量加上HNSW每个节点大约M*2个int32的邻居
+                "index_memory_bytes": count * (dimensions * 4 + 16 * 2 * 4),
+                "int8_bytes": self.int8_store.size_bytes(name) if self.int8_store else 0,
+            })
+        return stats
+
+    def delete_orphan_vectors(self, collection):
+        """
+        删除collection中没有file_id的向量
+        """
+        col = self.client.get_collection(collection)
+        with self.write_lock(collection):
+            data = col.get(include=["metadatas"])
+            orphan_ids = [doc_id for doc_id, meta in zip(data["ids"], data["metadatas"]) if "file_id" not in (meta or {})]
+            if orphan_ids:
+                col.delete(ids=orphan_ids)
+                self._sync_delete_ids(collection, orphan_ids)
+        return len(orphan_ids)
+
+    def compact(self, remove_orphan_segments=True):
+        """
+        压缩持久化目录：删除孤立的HNSW目录，对sqlite执行VACUUM回收已删除数据占用的空间
+        期间不能有其它读写，刚创建的collection也可能被当成孤立目录删除，只能在服务停止后通过chroma_maintenance.py compact离线调用
+        Returns:
+            dict: 压缩前后的磁盘大小以及删除的孤立目录
+        """
+        before = self._dir_size(self.db_dir)
+        removed = []
+        if remove_orphan_segments:
+            for path in self.find_orphan_segments():
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+        conn = sqlite3.connect(self._sqlite_path(), timeout=60, isolation_level=None)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        after = self._dir_size(self.db_dir)
+        logger.info(f"chroma目录压缩完成: {before} -> {after} bytes, 删除孤立目录 {len(removed)} 个")
+        return {"before_bytes": before, "after_bytes": after, "removed_segments": removed}
+
+
 class EmbeddingModel(object):
-    def __init__(self, model="text-embedding-v4", provider="aliyun"):
+    def __init__(self, model="text-embedding-v4", provider="aliyun", dimensions=EMBEDDING_DIMENSIONS):
         """
         Args:
+            dimensions: 输出向量的维度
         """
         self.model = model
         self.provider = provider
+        self.dimensions = dimensions
         if provider == "aliyun":
             api_key = os.getenv("ALI_API_KEY")
             assert api_key, "ALI_API_KEY没有设置，无法使用嵌入模型"
@@ -293,7 +697,6 @@ class EmbeddingModel(object):
         else:
             raise Exception("目前只支持阿里云的模型")
 
-    @cache_decorator
     def do_embedding(self, texts: list[str]):
         """
         对数据进行embedding，处理批量大小限制，确保所有文本都被处理
@@ -302,6 +705,11 @@ class EmbeddingModel(object):
         Returns:
             dict: 包含所有输入文本的embedding结果
         """
+        # 缓存的key按函数签名补上默认值，传不传dimensions=1024得到的key相同
+        return self._do_embedding(texts=texts, dimensions=self.dimensions)
+
+    @cache_decorator
+    def _do_embedding(self, texts: list[str], dimensions=1024):
         max_batch_size = 10  # 最大批量大小限制 避免报错
         result = {"data": []}  # 用于收集所有批次的嵌入结果
 
@@ -312,7 +720,7 @@ class EmbeddingModel(object):
                 completion = self.client.embeddings.create(
                     model=self.model,
                     input=batch_texts,
-                    dimensions=1024,
+                    dimensions=dimensions,
                     encoding_format="float"
                 )
                 batch_result = completion.dict()
@@ -11,11 +11,14 @@ import logging
 import pika
 import asyncio
 import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form
 from pydantic import BaseModel, ValidationError
-from typing import List, Optional
-import embedding_utils
+from typing import List, Literal, Optional
 import read_all_files
+import tika_client
+import collection_manager
 from urllib.parse import urlparse
 
 # 配置日志
@@ -37,6 +40,12 @@ class RabbitMessage(BaseModel):
     url: str
     folderId: int
 
+# MQ消费者并发数和prefetch
+MQ_CONCURRENCY = int(os.getenv("MQ_CONCURRENCY", 4))
+MQ_PREFETCH = int(os.getenv("MQ_PREFETCH", MQ_CONCURRENCY))
+# 批量导入时并行下载的线程数
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 8))
+
 # 创建临时下载目录
 TEMP_DIR = "temp_download"
 if not os.path.exists(TEMP_DIR):
@@ -52,11 +61,44 @@ class RabbitMessage(BaseModel):
     ids: Optional[List[int]] = None  # ids 字段，用于 removeById
 
 
+@app.on_event("startup")
+def startup_event():
+    """启动时拉起tika服务池并完成健康检查，避免第一个文件等待JVM启动，预热热点用户的collection"""
+    tika_client.get_tika_pool()
+    collection_manager.get_collection_manager().start()
+
+
+class BatchSearchQuery(BaseModel):
+    userId: int | str
+    queries: List[str]
+    keyword: Optional[str] = ""
+    topk: Optional[int] = 3
+    mode: Optional[Literal["dense", "hybrid"]] = "dense"
+    rerank: Optional[bool] = False
+    rerank_candidates: Optional[int] = 50
+
+
+class BatchFileItem(BaseModel):
+    id: int
+    userId: int
+    name: Optional[str] = "unknown"
+    fileType: Optional[str] = None
+    url: str
+    folderId: Optional[int] = 0
+
+
+class BatchRequest(BaseModel):
+    files: List[BatchFileItem]
+
+
 class SearchQuery(BaseModel):
     userId: int | str
     query: str
     keyword: Optional[str] = ""
     topk: Optional[int] = 3
+    mode: Optional[Literal["dense", "hybrid"]] = "dense"  # hybrid: BM25和向量检索RRF融合
+    rerank: Optional[bool] = False  # 先召回rerank_candidates条，本地重排序后取topk
+    rerank_candidates: Optional[int] = 50
 
 @app.post("/search")
 def search_personal_knowledge_base(query: SearchQuery):
@@ -65,33 +107,62 @@ def search_personal_knowledge_base(query: SearchQuery):
     """
     try:
         logger.info(f"收到搜索请求: {query}")
-        embedder = embedding_utils.EmbeddingModel()
-        chroma = embedding_utils.ChromaDB(embedder)
         collection_name = f"user_{query.userId}"
-
-        result = chroma.query2collection(
-            collection=collection_name,
-            query_documents=[query.query],
-            keyword=query.keyword,
-            topk=query.topk
-        )
+        with collection_manager.get_collection_manager().use(collection_name) as chroma:
+            result = chroma.query2collection(
+                collection=collection_name,
+                query_documents=[query.query],
+                keyword=query.keyword,
+                topk=query.topk,
+                mode=query.mode,
+                rerank=query.rerank,
+                rerank_candidates=query.rerank_candidates
+            )
         logger.info("搜索成功")
         return result
     except Exception as e:
         logger.error(f"搜索失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
+@app.post("/search/batch")
+def batch_search_personal_knowledge_base(query: BatchSearchQuery):
+    """
+    多个查询一起搜索个人知识库，一次embedding，一次col.query，结果跨查询去重
+    """
+    if not query.queries:
+        raise HTTPException(status_code=400, detail="queries不能为空")
+    try:
+        logger.info(f"收到批量搜索请求: {query}")
+        collection_name = f"user_{query.userId}"
+        with collection_manager.get_collection_manager().use(collection_name) as chroma:
+            result = chroma.batch_query2collection(
+                collection=collection_name,
+                query_documents=query.queries,
+                keyword=query.keyword,
+                topk=query.topk,
+                mode=query.mode,
+                rerank=query.rerank,
+                rerank_candidates=query.rerank_candidates
+            )
+        logger.info(f"批量搜索成功, 查询数: {len(query.queries)}, 去重后结果数: {len(result['ids'])}")
+        return result
+    except Exception as e:
+        logger.error(f"批量搜索失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"批量搜索失败: {str(e)}")
+
 def process_and_vectorize_local_file(file_name: str, temp_file_path: str, id: int, user_id: int, file_type: str, url: str, folder_id: int):
     """
     从本地文件路径处理文件、进行向量化并存储
     """
     # 步骤2: 使用read_all_files读取文件内容
     logger.info(f"开始读取文件内容: {temp_file_path}")
+    start_time = time.time()
     content: List[str] = read_all_files.read_file_content(temp_file_path)
+    parse_time = time.time() - start_time
     if not content or all(not line.strip() for line in content):
         logger.error(f"文件内容为空或无效: {temp_file_path}")
         raise ValueError("文件内容为空或无效")
-    logger.info(f"文件内容读取成功，长度: {len(content)}")
+    logger.info(f"文件内容读取成功，长度: {len(content)}, 解析耗时: {parse_time:.2f}s")
 
     # 步骤3: 检查环境变量
     if not os.getenv("ALI_API_KEY"):
@@ -99,20 +170,19 @@ def process_and_vectorize_local_file(file_name: str, temp_file_path: str, id: in
         raise ValueError("ALI_API_KEY环境变量未设置")
 
     # 步骤4: 使用embedding_utils插入向量
-    logger.info("初始化embedding模型")
-    embedder = embedding_utils.EmbeddingModel()
-    chroma = embedding_utils.ChromaDB(embedder)
     logger.info(f"开始插入文件 {id} 的向量")
-    embedding_result = chroma.insert_file_vectors(
-        file_name=file_name,
-        user_id=user_id,
-        file_id=id,
-        file_type=file_type or "unknown",
-        url=url or "",
-        folder_id=folder_id or 0,
-        documents=content
-    )
-    logger.info("向量插入成功")
+    start_time = time.time()
+    with collection_manager.get_collection_manager().use(f"user_{user_id}") as chroma:
+        embedding_result = chroma.insert_file_vectors(
+            file_name=file_name,
+            user_id=user_id,
+            file_id=id,
+            file_type=file_type or "unknown",
+            url=url or "",
+            folder_id=folder_id or 0,
+            documents=content
+        )
+    logger.info(f"向量插入成功, embedding和写入耗时: {time.time() - start_time:.2f}s")
 
     result = {
         "id": id,
@@ -127,9 +197,11 @@ def process_and_vectorize_local_file(file_name: str, temp_file_path: str, id: in
     return result
 
 
-def process_file_sync(file_name:str, id: int, user_id: int, file_type: str, url: str, folder_id: int):
+def download_file(url: str, user_id: int):
     """
-    处理文件下载、读取和生成embedding的同步版本
+    下载文件到临时目录，文件名加上uuid前缀，避免并发下载时同名文件互相覆盖
+    Returns:
+        str: 本地临时文件路径
     """
     if not url:
         logger.error("url为空")
@@ -142,26 +214,35 @@ def process_file_sync(file_name:str, id: int, user_id: int, file_type: str, url:
 
     parsed_url = urlparse(url)
     logger.info(f"解析后的URL: {parsed_url.geturl()}")
-    temp_file_path = None
+    local_file_name = os.path.basename(parsed_url.path) or f"downloaded_file_{user_id}"
+    temp_file_path = os.path.join(TEMP_DIR, f"{uuid.uuid4().hex}_{local_file_name}")
+    logger.info(f"开始下载文件: {url}")
     try:
-        # 步骤1: 下载文件
-        local_file_name = os.path.basename(parsed_url.path) or f"downloaded_file_{user_id}"
-        temp_file_path = os.path.join(TEMP_DIR, local_file_name)
-        logger.info(f"开始下载文件: {url}")
         response = requests.get(url, timeout=60, proxies=None)
         response.raise_for_status()
-        with open(temp_file_path, 'wb') as f:
-            f.write(response.content)
-        logger.info(f"文件下载成功: {temp_file_path}")
-
-        return process_and_vectorize_local_file(file_name, temp_file_path, id, user_id, file_type, url, folder_id)
-
     except requests.exceptions.Timeout as e:
         logger.error(f"下载文件超时: {str(e)}", exc_info=True)
         raise ValueError(f"下载文件超时: {str(e)}")
     except requests.exceptions.RequestException as e:
         logger.error(f"下载文件失败: {str(e)}", exc_info=True)
         raise ValueError(f"下载文件失败: {str(e)}")
+    with open(temp_file_path, 'wb') as f:
+        f.write(response.content)
+    logger.info(f"文件下载成功: {temp_file_path}")
+    return temp_file_path
+
+
+def process_file_sync(file_name:str, id: int, user_id: int, file_type: str, url: str, folder_id: int):
+    """
+    处理文件下载、读取和生成embedding的同步版本
+    """
+    temp_file_path = None
+    try:
+        # 步骤1: 下载文件
+        start_time = time.time()
+        temp_file_path = download_file(url, user_id)
+        logger.info(f"文件 {id} 下载耗时: {time.time() - start_time:.2f}s")
+        return process_and_vectorize_local_file(file_name, temp_file_path, id, user_id, file_type, url, folder_id)
     except ValueError as e:
         logger.error(f"处理失败: {str(e)}", exc_info=True)
         raise
@@ -174,6 +255,98 @@ def process_file_sync(file_name:str, id: int, user_id: int, file_type: str, url:
             logger.info(f"临时文件已删除: {temp_file_path}")
 
 
+def process_files_batch(files: List[BatchFileItem]):
+    """
+    批量处理多个文件：并行下载，并行解析，所有文件的chunk合并成满批次做embedding，每个collection一次col.add
+    单个文件下载或解析失败不影响其它文件，embedding或写入失败时这一批解析成功的文件都标记为失败
+    Returns:
+        dict: 每个文件的处理状态，chunk数量，以及download/parse/embed/index各阶段耗时
+    """
+    timings = {"download": 0.0, "parse": 0.0, "embed": 0.0, "index": 0.0}
+    # 按位置记录状态，同一批中重复的id也各自有结果
+    status = [{"id": one.id, "userId": one.userId, "file_name": one.name, "success": False, "error": None} for one in files]
+    # 临时文件路径 -> 在files中的位置
+    downloaded = {}
+
+    def safe_download(index):
+        try:
+            return index, download_file(files[index].url, files[index].userId), None
+        except Exception as e:
+            return index, None, str(e)
+
+    try:
+        # 步骤1: 并行下载
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="download") as executor:
+            for index, temp_file_path, error in executor.map(safe_download, range(len(files))):
+                if error:
+                    status[index]["error"] = error
+                else:
+                    downloaded[temp_file_path] = index
+        timings["download"] = time.time() - start_time
+
+        # 步骤2: 通过tika服务池并行解析
+        start_time = time.time()
+        items = []
+        item_indexes = []
+        for temp_file_path, content, error in read_all_files.read_files_content(list(downloaded)):
+            index = downloaded[temp_file_path]
+            one = files[index]
+            if error or not content or all(not line.strip() for line in content):
+                status[index]["error"] = error or "文件内容为空或无效"
+                continue
+            item_indexes.append(index)
+            items.append({
+                "file_name": one.name,
+                "user_id": one.userId,
+                "file_id": one.id,
+                "file_type": one.fileType or "unknown",
+                "url": one.url,
+                "folder_id": one.folderId or 0,
+                "documents": content,
+            })
+        timings["parse"] = time.time() - start_time
+
+        # 步骤3: 合并embedding并写入
+        chunks = 0
+        if items:
+            try:
+                if not os.getenv("ALI_API_KEY"):
+                    raise ValueError("ALI_API_KEY环境变量未设置")
+                collection_names = {f"user_{item['user_id']}" for item in items}
+                with collection_manager.get_collection_manager().use(*collection_names) as chroma:
+                    insert_result = chroma.insert_files_vectors(items)
+            except Exception as e:
+                logger.error(f"批量embedding和写入失败: {str(e)}", exc_info=True)
+                for index in item_indexes:
+                    status[index]["error"] = f"embedding或写入失败: {str(e)}"
+            else:
+                timings.update(insert_result["timings"])
+                chunks = insert_result["chunks"]
+                for index in item_indexes:
+                    status[index]["success"] = True
+    finally:
+        for temp_file_path in downloaded:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+    logger.info(f"批量处理完成，文件数: {len(files)}, chunk数: {chunks}, 各阶段耗时: {timings}")
+    return {"files": status, "chunks": chunks, "timings": timings}
+
+
+@app.post("/upload/batch")
+def batch_upload_and_vectorize_endpoint(request: BatchRequest):
+    """
+    批量通过URL导入文件并向量化
+    """
+    if not request.files:
+        raise HTTPException(status_code=400, detail="files不能为空")
+    try:
+        return process_files_batch(request.files)
+    except Exception as e:
+        logger.error(f"批量上传和向量化失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/upload/")
 async def upload_and_vectorize_endpoint(
     userId: int = Form(...),
@@ -229,9 +402,11 @@ async def upload_and_vectorize_endpoint(
             os.remove(temp_file_path)
             logger.info(f"临时文件已删除: {temp_file_path}")
 
-def rabbitmq_callback(ch, method, properties, body):
+def process_rabbitmq_message(body):
     """
-    RabbitMQ消息回调函数 - 使用同步处理
+    解析并处理一条RabbitMQ消息
+    Returns:
+        bool: True表示ack，False表示nack(不重新入队)
     """
     try:
         logger.info(f"接收到RabbitMQ消息: {body}")
@@ -269,6 +444,17 @@ def rabbitmq_callback(ch, method, properties, body):
                 print(f"文件进行embedding处理完成")
             except ValidationError as e:
                 logger.error(f"消息格式不符合RabbitMessage模型: {str(e)}", exc_info=True)
+        elif msg_type == "batchUpdateOrSave":
+            print(f"收到了batchUpdateOrSave的消息，开始进行处理")
+            try:
+                batch = BatchRequest(files=[one for one in msg_content.get("files", []) if one.get("fileType") != "image"])
+                if not batch.files:
+                    logger.info("batchUpdateOrSave 消息中没有需要处理的文件")
+                else:
+                    result = process_files_batch(batch.files)
+                    print(f"批量embedding处理完成, 文件数: {len(batch.files)}, 耗时: {result['timings']}")
+            except ValidationError as e:
+                logger.error(f"消息格式不符合BatchRequest模型: {str(e)}", exc_info=True)
         elif msg_type == "removeById" and file_type != "image":
             print(f"收到了removeById的消息，开始进行处理")
             try:
@@ -282,46 +468,76 @@ def rabbitmq_callback(ch, method, properties, body):
                 if not rabbit_msg.ids:
                     logger.error("removeById 消息中 ids 字段为空或缺失")
                     raise ValueError("ids 字段不能为空")
-                embedder = embedding_utils.EmbeddingModel()
-                chroma = embedding_utils.ChromaDB(embedder)
-                for file_id in rabbit_msg.ids:
-                    result = chroma.delete_file_vectors(
+                with collection_manager.get_collection_manager().use(f"user_{rabbit_msg.userId}") as chroma:
+                    result = chroma.delete_files_vectors(
                         user_id=rabbit_msg.userId,
-                        file_id=file_id
+                        file_ids=rabbit_msg.ids
                     )
-                    if result == "success":
-                        print(f"成功删除文件 ID {file_id} 的向量")
-                        logger.info(f"成功删除文件 ID {file_id} 的向量")
-                    else:
-                        print(f"删除文件 ID {file_id} 的向量失败")
-                        logger.error(f"删除文件 ID {file_id} 的向量失败")
+                if result == "success":
+                    print(f"成功删除文件 ID {rabbit_msg.ids} 的向量")
+                    logger.info(f"成功删除文件 ID {rabbit_msg.ids} 的向量")
+                else:
+                    print(f"删除文件 ID {rabbit_msg.ids} 的向量失败")
+                    logger.error(f"删除文件 ID {rabbit_msg.ids} 的向量失败")
             except ValidationError as e:
                 logger.error(f"消息格式不符合RabbitMessage模型: {str(e)}", exc_info=True)
             except ValueError as e:
                 logger.error(f"处理失败: {str(e)}", exc_info=True)
         else:
             logger.info(f"忽略非updateOrSave或removeById类型的消息: {msg_type}  文件类型是{file_type}")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return True
     except json.JSONDecodeError as e:
         logger.error(f"JSON解析失败: {str(e)}", exc_info=True)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return True
     except Exception as e:
         logger.error(f"RabbitMQ消息处理失败: {str(e)}", exc_info=True)
+        return False
+
+def rabbitmq_callback(ch, method, properties, body):
+    """
+    RabbitMQ消息回调函数 - 使用同步处理
+    """
+    if process_rabbitmq_message(body):
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+    else:
         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
 def start_rabbitmq_consumer():
     """
-    启动RabbitMQ消费者
+    启动RabbitMQ消费者，消息交给线程池处理，最多同时处理MQ_CONCURRENCY条消息，
+    prefetch控制broker最多推送多少条未ack的消息，避免一个慢文件阻塞其它用户的上传
     """
     print(f"RABBITMQ_URL={os.getenv('RABBITMQ_URL')}")
     print(f"QUEUE_NAME_QUESTION={os.getenv('QUEUE_NAME_QUESTION')}")
+    print(f"MQ_CONCURRENCY={MQ_CONCURRENCY}, MQ_PREFETCH={MQ_PREFETCH}")
     connection_params = pika.URLParameters(os.getenv("RABBITMQ_URL"))
     connection = pika.BlockingConnection(connection_params)
     channel = connection.channel()
     channel.queue_declare(queue=os.getenv("QUEUE_NAME_QUESTION"), durable=True)
-    channel.basic_consume(queue=os.getenv("QUEUE_NAME_QUESTION"), on_message_callback=rabbitmq_callback)
+    channel.basic_qos(prefetch_count=MQ_PREFETCH)
+    executor = ThreadPoolExecutor(max_workers=MQ_CONCURRENCY, thread_name_prefix="mq_worker")
+
+    def handle_in_worker(delivery_tag, body):
+        ack = process_rabbitmq_message(body)
+        # pika的channel不是线程安全的，ack需要回到连接所在的线程执行
+        def do_ack():
+            if not channel.is_open:
+                logger.error(f"channel已关闭，无法确认消息: {delivery_tag}")
+            elif ack:
+                channel.basic_ack(delivery_tag=delivery_tag)
+            else:
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+        connection.add_callback_threadsafe(do_ack)
+
+    def on_message(ch, method, properties, body):
+        executor.submit(handle_in_worker, method.delivery_tag, body)
+
+    channel.basic_consume(queue=os.getenv("QUEUE_NAME_QUESTION"), on_message_callback=on_message)
     print("开始监听RabbitMQ消息...")
-    channel.start_consuming()
+    try:
+        channel.start_consuming()
+    finally:
+        executor.shutdown(wait=True)
 
 if __name__ == "__main__":
     """
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/27
+# @File  : migrate_vectors.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 把已有的collection按新的存储方式重新编码: HNSW中存截断后的低维向量，完整向量量化成int8另外存储
+# python migrate_vectors.py --index_dimensions 256 --rescore int8
+# python migrate_vectors.py --collection user_123 --index_dimensions 512 --rescore int8 --reembed
+
+import argparse
+import numpy as np
+from embedding_utils import ChromaDB, EmbeddingModel, EMBEDDING_DIMENSIONS
+
+BATCH_SIZE = 1000
+
+
+def migrate_collection(chroma, name, embedder=None):
+    """
+    先写入临时collection，全部成功后再删除旧的并改名，迁移中途失败不影响原collection
+    Args:
+        chroma: 使用新存储方式的ChromaDB
+        name: collection名称
+        embedder: 不为None时用embedding模型重新生成完整维度的向量，否则使用collection中已有的向量
+    Returns:
+        int: 迁移的向量数
+    """
+    col = chroma.client.get_collection(name)
+    data = col.get(include=["embeddings", "documents", "metadatas"])
+    ids = data["ids"]
+    if not ids:
+        return 0
+    if embedder is not None:
+        vectors_result = embedder.do_embedding(texts=data["documents"])
+        embeddings = np.asarray([one["embedding"] for one in vectors_result["data"]], dtype=np.float32)
+        assert len(embeddings) == len(ids), f"重新embedding的数量{len(embeddings)}和向量数量{len(ids)}不一致"
+    else:
+        embeddings = np.asarray(data["embeddings"], dtype=np.float32)
+    temp_name = f"{name}__migrate"
+    try:
+        chroma.client.delete_collection(temp_name)
+    except Exception:
+        pass
+    temp_col = chroma.client.create_collection(temp_name, metadata={"hnsw:space": "cosine"})
+    for start in range(0, len(ids), BATCH_SIZE):
+        end = start + BATCH_SIZE
+        metadatas = data["metadatas"][start:end] if data["metadatas"] else None
+        # BM25和int8向量直接写到正式的collection名称下
+        chroma._write_vectors(temp_col, name, ids[start:end], embeddings[start:end].tolist(), data["documents"][start:end], metadatas)
+    chroma.client.delete_collection(name)
+    temp_col.modify(name=name)
+    return len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重新编码collection的向量")
+    parser.add_argument("--db_dir", default="cache/chromadb", help="chroma持久化目录")
+    parser.add_argument("--collection", default="", help="只迁移这个collection，默认全部")
+    parser.add_argument("--index_dimensions", type=int, required=True, help="HNSW索引中向量的维度")
+    parser.add_argument("--rescore", default="int8", choices=["int8", "none"], help="是否保存int8量化的完整向量用于重新打分")
+    parser.add_argument("--reembed", action="store_true", help=f"用embedding模型重新生成{EMBEDDING_DIMENSIONS}维向量，已有向量维度不足时需要")
+    args = parser.parse_args()
+
+    embedder = EmbeddingModel() if args.reembed else None
+    chroma = ChromaDB(embedder, db_dir=args.db_dir, index_dimensions=args.index_dimensions, rescore=args.rescore)
+    names = [args.collection] if args.collection else [name for name in chroma.list_exist_collections() if not name.endswith("__migrate")]
+    for name in names:
+        count = migrate_collection(chroma, name, embedder)
+        print(f"collection {name} 迁移完成，共 {count} 个向量")
+    print("迁移完成，请把INDEX_DIMENSIONS和VECTOR_RESCORE设置成相同的值后重启服务")
+
+
+if __name__ == '__main__':
+    main()
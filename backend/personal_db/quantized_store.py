@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/27
+# @File  : quantized_store.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 降维和int8量化的向量存储。HNSW中只存截断后的低维向量，完整维度的向量量化成int8存到sqlite，
+#          检索时先用低维向量召回候选，再用完整的float查询向量对候选重新打分
+
+import os
+import re
+import sqlite3
+import threading
+import numpy as np
+
+
+def truncate_normalize(vectors, dimensions):
+    """
+    取向量的前dimensions维并重新归一化，text-embedding-v4这类模型的前缀维度本身就是可用的低维表示
+    Args:
+        vectors: list[list[float]] 或 np.ndarray
+        dimensions: 目标维度
+    Returns:
+        np.ndarray, float32
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)[:, :dimensions]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_int8(vectors):
+    """
+    按向量做对称int8量化
+    Returns:
+        tuple[np.ndarray(int8), np.ndarray(float32)]: 量化后的向量和每个向量的scale
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.round(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def dequantize_int8(quantized, scales):
+    return quantized.astype(np.float32) * scales[:, None]
+
+
+class Int8VectorStore(object):
+    def __init__(self, db_path="cache/chromadb_int8.sqlite3"):
+        """
+        Args:
+            db_path: sqlite文件路径，每个collection一张表: chunk_id, file_id, scale, int8向量
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _table(collection):
+        return "int8_" + re.sub(r"[^0-9A-Za-z_]", "_", str(collection))
+
+    def _exists(self, collection):
+        row = self._conn().execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (self._table(collection),)).fetchone()
+        return row is not None
+
+    def upsert(self, collection, ids, vectors, file_ids):
+        """
+        Args:
+            ids: list[str]
+            vectors: 完整维度的float向量
+            file_ids: 每个向量对应的文件ID
+        """
+        if not len(ids):
+            return
+        table = self._table(collection)
+        conn = self._conn()
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (chunk_id TEXT PRIMARY KEY, file_id TEXT, scale REAL, vec BLOB)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_file ON {table}(file_id)")
+        quantized, scales = quantize_int8(vectors)
+        rows = [(chunk_id, str(file_id), float(scale), vector.tobytes())
+                for chunk_id, file_id, scale, vector in zip(ids, file_ids, scales, quantized)]
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, collection, ids):
+        """
+        Returns:
+            dict: {chunk_id: 反量化后的float32向量}
+        """
+        if not ids or not self._exists(collection):
+            return {}
+        table = self._table(collection)
+        result = {}
+        for i in range(0, len(ids), 500):
+            batch = list(ids[i:i + 500])
+            marks = ",".join("?" * len(batch))
+            for chunk_id, scale, blob in self._conn().execute(f"SELECT chunk_id, scale, vec FROM {table} WHERE chunk_id IN ({marks})", batch):
+                result[chunk_id] = np.frombuffer(blob, dtype=np.int8).astype(np.float32) * scale
+        return result
+
+    def delete_ids(self, collection, ids):
+        if not ids or not self._exists(collection):
+            return
+        table = self._table(collection)
+        for i in range(0, len(ids), 500):
+            batch = list(ids[i:i + 500])
+            self._conn().execute(f"DELETE FROM {table} WHERE chunk_id IN ({','.join('?' * len(batch))})", batch)
+
+    def delete_files(self, collection, file_ids):
+        if not file_ids or not self._exists(collection):
+            return
+        file_ids = [str(file_id) for file_id in file_ids]
+        self._conn().execute(f"DELETE FROM {self._table(collection)} WHERE file_id IN ({','.join('?' * len(file_ids))})", file_ids)
+
+    def drop(self, collection):
+        self._conn().execute(f"DROP TABLE IF EXISTS {self._table(collection)}")
+
+    def size_bytes(self, collection):
+        if not self._exists(collection):
+            return 0
+        row = self._conn().execute(f"SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM {self._table(collection)}").fetchone()
+        return row[0]
@@ -7,30 +7,27 @@
 # @Desc  : 读取各种个样的文件
 
 import os
-import re
-import string
-import json
-import hashlib
-import os
-import pickle
-import asyncio
-from functools import wraps
-import tika
-from tika import parser as tikaParser
-tika_server = r"./bin/tika-server.jar"
-assert os.path.exists(tika_server), "tika-server.jar not found"
-TIKA_SERVER_JAR = f"file:///{tika_server}"
-os.environ['TIKA_SERVER_JAR'] = TIKA_SERVER_JAR
-def read_file_content(file_path):
+from tika_client import get_tika_pool
+
+
+def read_file_content(file_path, timeout=None):
     assert os.path.exists(file_path), f"给定文件不存在: {file_path}"
-    tika_jar_path = TIKA_SERVER_JAR.replace('file:///', '')
-    assert os.path.exists(tika_jar_path), "tika jar包不存在"
-    tika.initVM()
-    parsed = tikaParser.from_file(file_path)
-    content_text = parsed["content"]
+    content_text = get_tika_pool().extract(file_path, timeout=timeout)
     content = content_text.split("\n")
     return content
 
+
+def read_files_content(file_paths, timeout=None):
+    """
+    并行读取多个文件
+    Args:
+        file_paths: list[str]
+    Returns:
+        list[tuple[str, list[str]|None, str|None]]: (文件路径, 按行切分的内容, 错误信息)
+    """
+    results = get_tika_pool().extract_many(file_paths, timeout=timeout)
+    return [(path, text.split("\n") if text is not None else None, error) for path, text, error in results]
+
 if __name__ == '__main__':
     content = read_file_content("/Users/admin/Downloads/多Agent进行PPT生成.docx")
-    print(content)
\ No newline at end of file
+    print(content)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/25
+# @File  : reranker.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 检索结果的本地重排序，支持CPU上的轻量词法打分和cross-encoder，打分结果按(query, chunk hash)缓存
+
+import os
+import hashlib
+import logging
+import threading
+import collections
+from bm25_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+RERANKER = os.environ.get("RERANKER", "lexical")
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "BAAI/bge-reranker-base")
+RERANK_CACHE_SIZE = int(os.environ.get("RERANK_CACHE_SIZE", 100000))
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", 32))
+
+
+class ScoreCache(object):
+    def __init__(self, max_size=RERANK_CACHE_SIZE):
+        """
+        (query, chunk hash) -> 分数的LRU缓存
+        """
+        self.max_size = max_size
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+class BaseReranker(object):
+    def __init__(self, cache_size=RERANK_CACHE_SIZE, batch_size=RERANK_BATCH_SIZE):
+        self.cache = ScoreCache(cache_size)
+        self.batch_size = batch_size
+
+    def _score_batch(self, query, documents):
+        raise NotImplementedError
+
+    def score(self, query, documents, chunk_hashes=None):
+        """
+        对一个查询的所有候选打分，命中缓存的跳过，其余的按batch_size批量打分
+        Args:
+            query: str
+            documents: list[str]
+            chunk_hashes: list[str], 每个候选的内容hash，为None时现算
+        Returns:
+            list[float]: 和documents一一对应，分数越大越相关
+        """
+        query_hash = hashlib.md5(query.encode()).hexdigest()
+        chunk_hashes = chunk_hashes or [hashlib.md5((document or "").encode()).hexdigest() for document in documents]
+        scores = [None] * len(documents)
+        pending = []
+        for i, chunk_hash in enumerate(chunk_hashes):
+            scores[i] = self.cache.get((query_hash, chunk_hash))
+            if scores[i] is None:
+                pending.append(i)
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            batch_scores = self._score_batch(query, [documents[i] for i in batch])
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+                self.cache.set((query_hash, chunk_hashes[i]), scores[i])
+        return scores
+
+    def rerank(self, query, documents, topk, chunk_hashes=None):
+        """
+        Returns:
+            list[tuple[int, float]]: 排序后的(候选下标, 分数)，取前topk个
+        """
+        scores = self.score(query, documents, chunk_hashes)
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+        return [(i, scores[i]) for i in order[:topk]]
+
+
+class LexicalReranker(BaseReranker):
+    """
+    词法打分: 查询词在chunk中的加权覆盖率，英文/编码整词权重3，中文二字权重2，单字权重1，
+    再加上连续命中的最长查询片段占比，奖励完整出现的药名和短语。只依赖查询和chunk本身，可以按(query, chunk)缓存
+    """
+
+    @staticmethod
+    def _weight(token):
+        if token.isascii():
+            return 3.0
+        return 2.0 if len(token) > 1 else 1.0
+
+    def _score_batch(self, query, documents):
+        query_tokens = set(tokenize(query))
+        total = sum(self._weight(token) for token in query_tokens) or 1.0
+        normalized_query = "".join(query.lower().split())
+        scores = []
+        for document in documents:
+            document_tokens = set(tokenize(document))
+            coverage = sum(self._weight(token) for token in query_tokens & document_tokens) / total
+            scores.append(coverage + 0.5 * self._longest_match(normalized_query, (document or "").lower()))
+        return scores
+
+    @staticmethod
+    def _longest_match(query, document):
+        """
+        查询中能在document里连续找到的最长片段占查询长度的比例
+        """
+        if not query:
+            return 0.0
+        best = 0
+        for start in range(len(query)):
+            length = best + 1
+            while start + length <= len(query) and query[start:start + length] in document:
+                best = length
+                length += 1
+        return best / len(query)
+
+
+class CrossEncoderReranker(BaseReranker):
+    def __init__(self, model_name=RERANK_MODEL, **kwargs):
+        """
+        cross-encoder重排序，需要安装sentence-transformers，CPU上运行
+        """
+        super().__init__(**kwargs)
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("使用cross-encoder重排序需要安装sentence-transformers: pip install sentence-transformers") from e
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def _score_batch(self, query, documents):
+        return self.model.predict([(query, document) for document in documents], batch_size=self.batch_size).tolist()
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """
+    获取全局的reranker，RERANKER=cross-encoder时使用cross-encoder，否则使用词法打分
+    """
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                if RERANKER == "cross-encoder":
+                    _reranker = CrossEncoderReranker()
+                else:
+                    _reranker = LexicalReranker()
+                logger.info(f"使用的reranker: {_reranker.__class__.__name__}")
+    return _reranker
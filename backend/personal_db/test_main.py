@@ -127,4 +127,57 @@ class KnowledgeBaseTestCase(unittest.TestCase):
             self.fail(f"An error occurred while requesting {exc.request.url!r}: {exc}")
         except httpx.HTTPStatusError as exc:
             self.fail(
-                f"Error response {exc.response.status_code} while requesting {exc.request.url!r}: {exc.response.text}")
\ No newline at end of file
+                f"Error response {exc.response.status_code} while requesting {exc.request.url!r}: {exc.response.text}")
+    def test_batch_upload_and_vectorize(self):
+        """
+        测试通过URL批量导入文件
+        """
+        url = f"{self.base_url}/upload/batch"
+        data = {
+            "files": [
+                {"id": 988, "userId": 123456, "name": "a.pdf", "fileType": "pdf", "url": "https://arxiv.org/pdf/1706.03762", "folderId": 543},
+                {"id": 989, "userId": 123456, "name": "b.pdf", "fileType": "pdf", "url": "https://arxiv.org/pdf/1810.04805", "folderId": 543},
+            ]
+        }
+        try:
+            start_time = time.time()
+            response = httpx.post(url, json=data, timeout=300.0)
+            print(f"test_batch_upload_and_vectorize 请求花费时间: {time.time() - start_time}秒")
+            response.raise_for_status()
+            result = response.json()
+            self.assertEqual(len(result["files"]), 2)
+            for stage in ["download", "parse", "embed", "index"]:
+                self.assertIn(stage, result["timings"])
+            print("Response body:", result)
+        except httpx.RequestError as exc:
+            self.fail(f"An error occurred while requesting {exc.request.url!r}: {exc}")
+        except httpx.HTTPStatusError as exc:
+            self.fail(
+                f"Error response {exc.response.status_code} while requesting {exc.request.url!r}: {exc.response.text}")
+
+    def test_personal_db_batch_search(self):
+        """
+        多个关键词一起搜索知识库
+        """
+        url = f"{self.base_url}/search/batch"
+        data = {
+            "userId": 123456,
+            "queries": ["特斯拉", "Robotaxi", "马斯克"],
+            "keyword": "",
+            "topk": 3
+        }
+        try:
+            start_time = time.time()
+            response = httpx.post(url, json=data, timeout=20.0)
+            response.raise_for_status()
+            result = response.json()
+            for key in ["ids", "documents", "metadatas", "distances", "query_hits"]:
+                self.assertIn(key, result)
+            self.assertEqual(len(result["ids"]), len(set(result["ids"])))
+            print("Response body:", result)
+            print(f"test_personal_db_batch_search测试花费时间: {time.time() - start_time}秒")
+        except httpx.RequestError as exc:
+            self.fail(f"An error occurred while requesting {exc.request.url!r}: {exc}")
+        except httpx.HTTPStatusError as exc:
+            self.fail(
+                f"Error response {exc.response.status_code} while requesting {exc.request.url!r}: {exc.response.text}")
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/8/20
+# @File  : tika_client.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 常驻的Tika服务池，启动时拉起若干个tika-server进程并做健康检查，通过长连接PUT文件解析文本
+
+import os
+import math
+import time
+import shutil
+import logging
+import itertools
+import threading
+import subprocess
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+TIKA_SERVER_JAR = os.environ.get("TIKA_SERVER_JAR_PATH", "./bin/tika-server.jar")
+# 已经部署好的外部tika服务，逗号分隔，例如: http://127.0.0.1:9998,http://127.0.0.1:9999，设置后不再自己启动进程
+TIKA_SERVER_URLS = os.environ.get("TIKA_SERVER_URLS", "")
+TIKA_SERVER_NUM = int(os.environ.get("TIKA_SERVER_NUM", 1))
+TIKA_BASE_PORT = int(os.environ.get("TIKA_BASE_PORT", 9998))
+TIKA_WORKERS = int(os.environ.get("TIKA_WORKERS", 4))
+TIKA_FILE_TIMEOUT = float(os.environ.get("TIKA_FILE_TIMEOUT", 120))
+TIKA_STARTUP_TIMEOUT = float(os.environ.get("TIKA_STARTUP_TIMEOUT", 60))
+TIKA_HEALTH_INTERVAL = float(os.environ.get("TIKA_HEALTH_INTERVAL", 30))
+
+
+class TikaServer(object):
+    def __init__(self, url, port=None, jar_path=None):
+        """
+        单个tika-server，如果给定了jar_path，那么由我们自己启动和重启进程
+        Args:
+            url: tika服务地址，例如 http://127.0.0.1:9998
+            port: 本地启动时使用的端口
+            jar_path: tika-server.jar的路径，为None表示外部服务
+        """
+        self.url = url.rstrip("/")
+        self.port = port
+        self.jar_path = jar_path
+        self.process = None
+        self.healthy = False
+
+    def start(self):
+        """
+        启动tika-server进程，外部服务直接跳过
+        """
+        if not self.jar_path:
+            return
+        if self.process and self.process.poll() is None:
+            return
+        java = shutil.which("java")
+        assert java, "没有找到java，无法启动tika-server"
+        cmd = [java, "-jar", self.jar_path, "--host", "127.0.0.1", "--port", str(self.port)]
+        logger.info(f"启动tika-server: {' '.join(cmd)}")
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self.healthy = False
+
+    def check(self, session, timeout=5):
+        """
+        健康检查，GET /tika 返回200即认为可用
+        """
+        try:
+            response = session.get(f"{self.url}/tika", timeout=timeout)
+            self.healthy = response.status_code == 200
+        except requests.exceptions.RequestException:
+            self.healthy = False
+        return self.healthy
+
+
+class TikaPool(object):
+    def __init__(self, server_urls=None, server_num=TIKA_SERVER_NUM, base_port=TIKA_BASE_PORT,
+                 jar_path=TIKA_SERVER_JAR, workers=TIKA_WORKERS, file_timeout=TIKA_FILE_TIMEOUT):
+        """
+        Tika服务池，多个tika-server轮询使用，N个线程并行解析
+        Args:
+            server_urls: list[str], 外部tika服务地址，为空时在本地启动server_num个进程
+            server_num: 本地启动的tika-server数量
+            base_port: 本地tika-server的起始端口
+            jar_path: tika-server.jar路径
+            workers: 并行解析的线程数
+            file_timeout: 单个文件的解析超时时间，秒
+        """
+        if server_urls:
+            self.servers = [TikaServer(url) for url in server_urls]
+        else:
+            assert os.path.exists(jar_path), f"tika-server.jar not found: {jar_path}"
+            self.servers = [TikaServer(f"http://127.0.0.1:{base_port + i}", port=base_port + i, jar_path=jar_path)
+                            for i in range(server_num)]
+        self.workers = workers
+        self.file_timeout = file_timeout
+        # requests.Session不是线程安全的，每个线程一个session，各自复用到每个服务的keep-alive连接
+        self._local = threading.local()
+        self._sessions = []
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tika")
+        self._cycle = itertools.cycle(self.servers)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._health_thread = None
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=len(self.servers), pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def start(self, startup_timeout=TIKA_STARTUP_TIMEOUT):
+        """
+        启动所有tika-server并等待健康检查通过，然后启动后台健康检查线程
+        """
+        for server in self.servers:
+            server.start()
+        deadline = time.time() + startup_timeout
+        pending = list(self.servers)
+        while pending and time.time() < deadline:
+            pending = [server for server in pending if not server.check(self.session)]
+            if pending:
+                time.sleep(1)
+        if len(pending) == len(self.servers):
+            raise RuntimeError(f"没有可用的tika-server: {[server.url for server in self.servers]}")
+        for server in pending:
+            logger.warning(f"tika-server启动超时: {server.url}")
+        logger.info(f"tika服务池启动完成，可用服务数: {len(self.servers) - len(pending)}/{len(self.servers)}")
+        self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+        return self
+
+    def _health_loop(self):
+        """
+        定时健康检查，本地启动的进程挂掉后自动重启
+        """
+        while not self._stop_event.wait(TIKA_HEALTH_INTERVAL):
+            for server in self.servers:
+                if server.check(self.session):
+                    continue
+                logger.warning(f"tika-server健康检查失败: {server.url}")
+                if server.jar_path and (server.process is None or server.process.poll() is not None):
+                    server.start()
+
+    def _next_server(self, exclude=None):
+        """
+        轮询取一个健康的服务；全部不健康时立即重新探测一次，仍然没有时也返回一个服务去尝试，
+        不会因为短暂的错误让服务池在下一次健康检查之前完全不可用
+        """
+        with self._lock:
+            for _ in range(len(self.servers)):
+                server = next(self._cycle)
+                if server.healthy and server is not exclude:
+                    return server
+        for server in self.servers:
+            if server is not exclude and server.check(self.session):
+                return server
+        with self._lock:
+            server = next(self._cycle)
+        logger.warning(f"没有健康的tika-server，仍然尝试: {server.url}")
+        return server
+
+    def _put(self, server, file_path, timeout):
+        file_name = os.path.basename(file_path)
+        headers = {
+            "Accept": "text/plain; charset=UTF-8",
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file_name)}",
+        }
+        with open(file_path, "rb") as f:
+            response = self.session.put(f"{server.url}/tika", data=f, headers=headers, timeout=(5, timeout))
+        response.raise_for_status()
+        response.encoding = "utf-8"
+        return response.text or ""
+
+    def extract(self, file_path, timeout=None):
+        """
+        解析单个文件，返回纯文本；连接错误时重新探测这个服务，探测通过说明是短暂的错误，在同一个服务上重试，
+        否则标记为不健康，换一个服务重试，只重试一次
+        Args:
+            file_path: 本地文件路径
+            timeout: 超时时间，默认使用file_timeout
+        Returns:
+            str: 文件内容
+        """
+        assert os.path.exists(file_path), f"给定文件不存在: {file_path}"
+        timeout = timeout or self.file_timeout
+        server = self._next_server()
+        try:
+            return self._put(server, file_path, timeout)
+        except requests.exceptions.ConnectionError as e:
+            if server.check(self.session):
+                logger.warning(f"tika-server连接错误，探测正常，重试: {server.url}, {e}")
+                retry_server = server
+            else:
+                logger.warning(f"tika-server连接错误，探测失败，换一个服务重试: {server.url}, {e}")
+                retry_server = self._next_server(exclude=server) if len(self.servers) > 1 else server
+        return self._put(retry_server, file_path, timeout)
+
+    def extract_many(self, file_paths, timeout=None):
+        """
+        并行解析多个文件，单个文件失败或超时不影响其它文件；整批共用一个截止时间，
+        按线程数估算需要几轮，每轮最多timeout秒，到期后还在排队的文件取消，还在解析的标记为超时
+        Args:
+            file_paths: list[str]
+        Returns:
+            list[tuple[str, str|None, str|None]]: (文件路径, 内容, 错误信息)，和输入顺序一致
+        """
+        timeout = timeout or self.file_timeout
+        futures = [(path, self.executor.submit(self.extract, path, timeout)) for path in file_paths]
+        if not futures:
+            return []
+        batch_timeout = math.ceil(len(futures) / max(self.workers, 1)) * timeout + 5
+        wait([future for _, future in futures], timeout=batch_timeout)
+        results = []
+        for path, future in futures:
+            if not future.done():
+                if future.cancel():
+                    results.append((path, None, f"批量解析超过{batch_timeout}s，没有开始解析，已取消"))
+                else:
+                    results.append((path, None, f"解析超时: {batch_timeout}s"))
+                continue
+            try:
+                results.append((path, future.result(), None))
+            except Exception as e:
+                results.append((path, None, str(e)))
+        return results
+
+    def close(self):
+        self._stop_event.set()
+        self.executor.shutdown(wait=False)
+        for server in self.servers:
+            server.stop()
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_tika_pool():
+    """
+    获取全局的Tika服务池，第一次调用时启动
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                server_urls = [url.strip() for url in TIKA_SERVER_URLS.split(",") if url.strip()]
+                _pool = TikaPool(server_urls=server_urls).start()
+    return _pool
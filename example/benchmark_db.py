@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/08/30
+# @File  : benchmark_db.py
+# @Author: johnson
+# @Desc  : 创新点写入吞吐(rows/s)测试：原来每次调用新建连接、逐行INSERT并捕获IntegrityError，对比innovation_db的批量写入
+# python benchmark_db.py --rows 10000 1000000 --round_size 48
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import datetime as dt
+
+from pydantic import BaseModel, Field
+
+from innovation_db import DB
+
+
+class Evidence(BaseModel):
+    quote: str = ""
+    loc: str = ""
+
+
+class Innovation(BaseModel):
+    text: str
+    canonical: str
+    hash: str
+    paper_id: str
+    paper_title: str
+    source_url: str
+    evidence: Evidence = Field(default_factory=Evidence)
+    confidence: float = 0.7
+    novelty: float = 0.7
+    created_at: str = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc).isoformat())
+
+
+def make_items(count):
+    return [
+        Innovation(text=f"创新点 {i}", canonical=f"创新点 {i}", hash=f"{i:032x}", paper_id=f"p{i // 8}",
+                   paper_title=f"论文 {i // 8}", source_url=f"https://example.com/{i // 8}", evidence=Evidence(quote="引用", loc="p1"))
+        for i in range(count)
+    ]
+
+
+def legacy_upsert_innovations(path, topic, items):
+    """原来的实现，用于对比"""
+    con = sqlite3.connect(path)
+    cur = con.cursor()
+    for it in items:
+        try:
+            cur.execute(
+                """
+                INSERT INTO innovations(
+                    topic, paper_id, paper_title, source_url, text, canonical, hash,
+                    evidence, confidence, novelty, created_at
+                ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
+                """,
+                (topic, it.paper_id, it.paper_title, it.source_url, it.text, it.canonical, it.hash,
+                 json.dumps(it.evidence.model_dump(), ensure_ascii=False), it.confidence, it.novelty, it.created_at),
+            )
+        except sqlite3.IntegrityError:
+            pass
+    con.commit()
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="创新点数据库写入吞吐测试")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 1000000])
+    parser.add_argument("--round_size", type=int, default=48, help="每次调用写入的新创新点数量")
+    parser.add_argument("--legacy_max", type=int, default=100000, help="原来的实现只测到这个数量")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        for total in args.rows:
+            items = make_items(total)
+            rounds = [items[i:i + args.round_size] for i in range(0, total, args.round_size)]
+
+            for background in (False, True):
+                path = os.path.join(work_dir, f"new_{total}_{background}.db")
+                start_time = time.time()
+                db = DB(path, background=background)
+                loop_start = time.time()
+                for one in rounds:
+                    db.upsert_innovations("topic", one)
+                loop_cost = time.time() - loop_start
+                db.close()
+                cost = time.time() - start_time
+                name = "批量写入+后台线程" if background else "批量写入"
+                print(f"{total} 行 {name}: {total / cost:,.0f} rows/s (总耗时 {cost:.2f}s, 调用方阻塞 {loop_cost:.2f}s)")
+
+            if total <= args.legacy_max:
+                path = os.path.join(work_dir, f"legacy_{total}.db")
+                DB(path, background=False).close()
+                start_time = time.time()
+                for one in rounds:
+                    legacy_upsert_innovations(path, "topic", one)
+                cost = time.time() - start_time
+                print(f"{total} 行 原实现(每次新连接、逐行插入): {total / cost:,.0f} rows/s (总耗时 {cost:.2f}s)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/08/30
+# @File  : benchmark_dedupe.py
+# @Author: johnson
+# @Desc  : 对比原来的semantic_dedupe(每轮重新embedding全部已有创新点，逐个候选计算范数)和DedupeIndex的每轮耗时；
+#          embedding用hash生成的随机向量代替，只统计调用次数和文本条数，不需要OPENAI_API_KEY
+# python benchmark_dedupe.py --sizes 1000 10000 100000 --batch 48
+
+import os
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+
+from dedupe_index import DedupeIndex, embedding_cache_path
+
+
+class FakeEmbeddings:
+    def __init__(self, dim):
+        self.dim = dim
+        self.calls = 0
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int(hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest(), 16)
+            vectors[i] = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+        return vectors
+
+
+def make_items(start, count):
+    items = []
+    for i in range(start, start + count):
+        canonical = f"innovation {i}"
+        items.append(SimpleNamespace(canonical=canonical, hash=hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()))
+    return items
+
+
+def legacy_semantic_dedupe(emb, existing, candidates, sim_threshold=0.85):
+    """原来的实现，用于对比"""
+    merged = list(existing)
+    seen_hash = {it.hash for it in existing}
+    vec_c = emb.embed_documents([c.canonical for c in candidates]) if candidates else []
+    vec_e = emb.embed_documents([e.canonical for e in existing]) if existing else []
+    E = np.array(vec_e) if len(vec_e) else np.zeros((0, emb.dim))
+    for i, cand in enumerate(candidates):
+        if cand.hash in seen_hash:
+            continue
+        dup = False
+        if len(E):
+            v = np.array(vec_c[i])
+            sims = (E @ v) / (np.linalg.norm(E, axis=1) * np.linalg.norm(v) + 1e-9)
+            if float(np.max(sims)) >= sim_threshold:
+                dup = True
+        if not dup:
+            merged.append(cand)
+            seen_hash.add(cand.hash)
+            E = np.vstack([E, vec_c[i]]) if E.size else np.array([vec_c[i]])
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="创新点语义去重的性能测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="已有创新点的数量")
+    parser.add_argument("--batch", type=int, default=48, help="每轮候选数量(6篇论文 x 8条)")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--legacy_max", type=int, default=20000, help="原来的实现只测到这个数量，更大时太慢")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        for size in args.sizes:
+            existing = make_items(0, size)
+            candidates = make_items(size, args.batch)
+            cache_path = embedding_cache_path(os.path.join(work_dir, f"innovation_{size}.db"))
+
+            emb = FakeEmbeddings(args.dim)
+            index = DedupeIndex(emb.embed_documents, path=cache_path)
+            index.reset(existing)
+            emb.calls = emb.texts = 0
+            start_time = time.time()
+            accepted = index.dedupe(candidates)
+            index_cost = time.time() - start_time
+            print(f"N={size}: DedupeIndex 每轮 {index_cost * 1000:.1f}ms, embedding {emb.calls} 次/{emb.texts} 条, 新增 {len(accepted)}")
+
+            # 重启: 从磁盘加载embedding缓存，重建索引不需要embedding
+            emb = FakeEmbeddings(args.dim)
+            start_time = time.time()
+            restarted = DedupeIndex(emb.embed_documents, path=cache_path)
+            restarted.reset(existing + accepted)
+            print(f"N={size}: 重启后重建索引 {time.time() - start_time:.2f}s, embedding {emb.texts} 条")
+
+            if size <= args.legacy_max:
+                emb = FakeEmbeddings(args.dim)
+                start_time = time.time()
+                merged = legacy_semantic_dedupe(emb, existing, candidates)
+                legacy_cost = time.time() - start_time
+                print(f"N={size}: 原实现 每轮 {legacy_cost * 1000:.1f}ms, embedding {emb.calls} 次/{emb.texts} 条, 新增 {len(merged) - size}, "
+                      f"加速 {legacy_cost / index_cost:.0f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,10 @@ import dotenv
 from pydantic import BaseModel, Field
 from pydantic import TypeAdapter
 from cache_utils import cache_decorator
+from dedupe_index import DedupeIndex, embedding_cache_path
+from innovation_db import get_db
+from paper_search import paper_id, search_many
+from extract_pool import extract_concurrently, EXTRACT_BATCH_SIZE, EXTRACT_TIMEOUT
 # LangChain / LangGraph
 from langchain_core.messages import BaseMessage, ToolMessage, SystemMessage, HumanMessage
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
@@ -118,94 +122,7 @@ class CandidateList(BaseModel):
 
 
 # ===================== DB Layer (SQLite) =====================
-class DB:
-    def __init__(self, path: str = "innovation.db"):
-        self.path = path
-        self._ensure()
-
-    def _ensure(self):
-        con = sqlite3.connect(self.path)
-        cur = con.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS papers (
-                id TEXT PRIMARY KEY,
-                title TEXT,
-                url TEXT,
-                source TEXT,
-                year INT,
-                pdf_url TEXT,
-                meta JSON
-            );
-            """
-        )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS innovations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                topic TEXT,
-                paper_id TEXT,
-                paper_title TEXT,
-                source_url TEXT,
-                text TEXT,
-                canonical TEXT,
-                hash TEXT UNIQUE,
-                evidence JSON,
-                confidence REAL,
-                novelty REAL,
-                created_at TEXT
-            );
-            """
-        )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_innov_topic ON innovations(topic)")
-        con.commit()
-        con.close()
-
-    def upsert_papers(self, papers: List[PaperMeta]):
-        con = sqlite3.connect(self.path)
-        cur = con.cursor()
-        for p in papers:
-            cur.execute(
-                """
-                INSERT OR REPLACE INTO papers(id, title, url, source, year, pdf_url, meta)
-                VALUES(?,?,?,?,?,?,?)
-                """,
-                (p.id, p.title, p.url, p.source, p.year, p.pdf_url or "", json.dumps(p.model_dump())),
-            )
-        con.commit()
-        con.close()
-
-    def upsert_innovations(self, topic: str, items: List[Innovation]):
-        con = sqlite3.connect(self.path)
-        cur = con.cursor()
-        for it in items:
-            try:
-                cur.execute(
-                    """
-                    INSERT INTO innovations(
-                        topic, paper_id, paper_title, source_url, text, canonical, hash,
-                        evidence, confidence, novelty, created_at
-                    ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
-                    """,
-                    (
-                        topic,
-                        it.paper_id,
-                        it.paper_title,
-                        it.source_url,
-                        it.text,
-                        it.canonical,
-                        it.hash,
-                        json.dumps(it.evidence.model_dump()),
-                        it.confidence,
-                        it.novelty,
-                        it.created_at,
-                    ),
-                )
-            except sqlite3.IntegrityError:
-                # hash UNIQUE: 忽略重复
-                pass
-        con.commit()
-        con.close()
+# 写入使用 innovation_db.get_db：单连接、WAL、批量写入、后台线程刷盘
 
 def hash_key(text: str) -> str:
     return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
@@ -225,7 +142,7 @@ def arxiv_search(keyword: str, max_results: int = 20) -> List[PaperMeta]:
         logger.debug("WebSearch | received %d results", len(items))
         results = [
             PaperMeta(
-                id= uuid.uuid4().hex,
+                id=paper_id(item.get('url', ''), item.get('title', '')),
                 url=item.get('url', ''),
                 title=item.get('title', ''),
                 snippet=item.get('content', '')
@@ -240,9 +157,11 @@ def arxiv_search(keyword: str, max_results: int = 20) -> List[PaperMeta]:
 # ===================== LLMs =====================
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 # 用于生成计划和提取创新点的模型
-llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0)
+llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0, timeout=EXTRACT_TIMEOUT)
 # 用于计算创新点之间的相似性，用于去重
 emb = OpenAIEmbeddings(model=os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small"))
+# 已有创新点的向量索引，embedding 缓存写在 innovation.db 旁边，重启后不需要重新 embedding
+dedupe_index = DedupeIndex(emb.embed_documents, path=embedding_cache_path("innovation.db"))
 
 
 EXTRACT_PROMPT = (
@@ -253,7 +172,7 @@ EXTRACT_PROMPT = (
 )
 
 
-def extract_innovations_with_llm(text: str, max_chars: int = 12000, max_items: int = 8) -> List[Candidate]:
+def extract_innovations_with_llm(text: str, max_chars: int = 12000, max_items: int = 8, raise_errors: bool = False) -> List[Candidate]:
     if not text:
         return []
     # 截断，避免超长
@@ -269,51 +188,43 @@ def extract_innovations_with_llm(text: str, max_chars: int = 12000, max_items: i
             result = CandidateList(**result)
         return result.items
     except Exception as e:
+        # 并发抽取时由 extract_concurrently 负责重试
+        if raise_errors:
+            raise
         logger.warning("LLM extract failed: %s", e)
         return []
 
 
 # ===================== Dedupe =====================
 
+def dedupe_candidates(existing: List[Innovation], candidates: List[Innovation], sim_threshold: float, index: DedupeIndex) -> List[Innovation]:
+    """返回 candidates 中需要新增的创新点；existing 的向量保存在 index 中，每轮只对新的候选做 embedding。"""
+    try:
+        # 索引里的创新点和 existing 不一致时（例如新的一次运行）重建，已缓存的 embedding 不会重新计算
+        if not index.in_sync(existing):
+            index.reset(existing)
+        return index.dedupe(candidates, sim_threshold=sim_threshold)
+    except Exception as e:
+        logger.warning("Embedding failed, fallback to hash-only dedupe: %s", e)
+        seen_hash: Set[str] = set()
+        in_index = index.in_sync(existing)
+        if not in_index:
+            seen_hash = {it.hash for it in existing}
+        accepted = []
+        for cand in candidates:
+            if cand.hash not in seen_hash and not (in_index and cand.hash in index):
+                accepted.append(cand)
+                seen_hash.add(cand.hash)
+        return accepted
+
+
 def semantic_dedupe(
-    existing: List[Innovation], candidates: List[Innovation], sim_threshold: float = 0.85
+    existing: List[Innovation], candidates: List[Innovation], sim_threshold: float = 0.85, index: Optional[DedupeIndex] = None
 ) -> Tuple[List[Innovation], Set[str]]:
     """将 candidates 与 existing 合并去重，返回新集合与 seen_keys。"""
     merged = list(existing)
-    seen_hash: Set[str] = {it.hash for it in existing}
-
-    # 先把所有文本做 embedding（批量）
-    cand_texts = [c.canonical for c in candidates]
-    exist_texts = [e.canonical for e in existing]
-    try:
-        vec_c = emb.embed_documents(cand_texts) if cand_texts else []
-        vec_e = emb.embed_documents(exist_texts) if exist_texts else []
-        E = np.array(vec_e) if vec_e else np.zeros((0, 1536))
-    except Exception as e:
-        logger.warning("Embedding failed, fallback to hash-only dedupe: %s", e)
-        vec_c, E = [], np.zeros((0, 1))
-
-    for i, cand in enumerate(candidates):
-        if cand.hash in seen_hash:
-            continue
-        dup = False
-        if len(E) and vec_c:
-            v = np.array(vec_c[i])
-            # 余弦相似
-            if len(E):
-                sims = (E @ v) / (np.linalg.norm(E, axis=1) * np.linalg.norm(v) + 1e-9)
-                if len(sims) and float(np.max(sims)) >= sim_threshold:
-                    dup = True
-        if not dup:
-            merged.append(cand)
-            seen_hash.add(cand.hash)
-            # 增量扩展 E（避免再次 embed existing）
-            if vec_c:
-                if E.size == 0:
-                    E = np.array([vec_c[i]])
-                else:
-                    E = np.vstack([E, vec_c[i]])
-    return merged, seen_hash
+    merged.extend(dedupe_candidates(existing, candidates, sim_threshold, index if index is not None else dedupe_index))
+    return merged, {it.hash for it in merged}
 
 
 # ===================== Agent State =====================
@@ -358,47 +269,34 @@ def plan_queries(topic: str, state: Annotated[AgentState, InjectedState], tool_c
 def search_papers(state: Annotated[AgentState, InjectedState], tool_call_id: Annotated[str, InjectedToolCallId], per_query: int = 10) -> Any:
     """使用 arXiv API 检索论文，合并去重到 papers_queue。"""
     queries: List[str] = state.get("queries", [])
-    all_results: List[PaperMeta] = []
-    for query in queries:
-        try:
-            res = arxiv_search(query, max_results=per_query)
-        except Exception as e:
-            logger.warning(f"search_papers: 搜索关键词{query}发生了错误: {e}")
-            res = []
-        all_results.extend(res)
-
-    # 合并去重: 按 (source,id) 唯一
-    seen: Set[str] = set()
-    merged: List[PaperMeta] = []
-    for p in sorted(all_results, key=lambda x: (-(x.year or 0), -len(x.title))):
-        key = f"{p.source}:{p.id}"
-        if key not in seen:
-            seen.add(key)
-            merged.append(p)
+    # 并发搜索，不同检索式搜到的同一篇论文按规范化URL生成的id合并
+    results: List[PaperMeta] = search_many(queries, lambda q: arxiv_search(q, max_results=per_query))
+    merged: List[PaperMeta] = sorted(results, key=lambda x: (-(x.year or 0), -len(x.title)))
 
     # 合入队列，过滤已访问
     visited: Set[str] = set(state.get("visited_ids", set()))
     old_queue: List[PaperMeta] = state.get("papers_queue", [])
     existing_ids = {f"{p.source}:{p.id}" for p in old_queue}
     new_queue = old_queue + [p for p in merged if f"{p.source}:{p.id}" not in existing_ids and p.id not in visited]
-    resulut_msg = f"已经搜索了{len(all_results)} 条结果了。"
+    resulut_msg = f"已经搜索了{len(merged)} 条不重复的结果了。"
     logger.info(f"Searcher 搜索到了{len(new_queue)}篇文献，其中新增{max(0, len(new_queue) - len(old_queue))}篇。")
     return Command(update={"papers_queue": new_queue, "messages": [ToolMessage(content=resulut_msg, tool_call_id=tool_call_id)]})
 
 
 # 子图：单篇论文的读取 + 抽取
-def paper_worker(paper: PaperMeta) -> List[Candidate]:
+def paper_worker(paper: PaperMeta, raise_errors: bool = False) -> List[Candidate]:
     """
     读取论文，并提取创新点，返回候选的可能创新点Candidate
     Args:
         paper:
+        raise_errors: 抽取出错时抛出异常，由 extract_concurrently 重试
     Returns:
 
     """
     text = paper.snippet
     if not text:
         return []
-    cands = extract_innovations_with_llm(text, max_items=8)
+    cands = extract_innovations_with_llm(text, max_items=8, raise_errors=raise_errors)
     return cands
 
 
@@ -406,24 +304,18 @@ def paper_worker(paper: PaperMeta) -> List[Candidate]:
 def batch_read_extract(state: Annotated[AgentState, InjectedState], tool_call_id: Annotated[str, InjectedToolCallId]) -> Any:
     """从 papers_queue 取所有要处理的论文内容，读取文章并抽取候选创新点，写入 candidates_buffer 与 visited_ids。"""
     papers_queue: List[PaperMeta] = state.get("papers_queue", [])
-    print(f"只保留6篇论文进行处理")
-    papers_queue = papers_queue[:6]
     # 读取过的文章
     visited: Set[str] = set(state.get("visited_ids", set()))
-    print(f"现有{len(papers_queue)}篇论文，其中已处理{len(visited)}篇。")
-    batch: List[PaperMeta] = []
-    for p in papers_queue:
-        if p.id not in visited:
-            batch.append(p)
+    print(f"现有{len(papers_queue)}篇论文，其中已处理{len(visited)}篇，本次最多处理{EXTRACT_BATCH_SIZE}篇。")
+    batch: List[PaperMeta] = [p for p in papers_queue if p.id not in visited][:EXTRACT_BATCH_SIZE]
     if not batch:
         logger.info("Batch | no papers to process")
         return Command(update={"messages": [ToolMessage(content="没有待处理的论文了。", tool_call_id=tool_call_id)]})
 
     all_cands: List[Innovation] = []
-    for one_paper in tqdm(batch, desc="处理论文"):
-        #cands代表候选创新点
-        cands = paper_worker(one_paper)
-        for one_cand in tqdm(cands, desc="处理创新点"):
+    # 并发抽取，按完成顺序收集，cands代表候选创新点
+    for one_paper, cands in tqdm(extract_concurrently(batch, lambda p: paper_worker(p, raise_errors=True)), total=len(batch), desc="处理论文"):
+        for one_cand in cands:
             canonical = one_cand.text
             # 创新点收集
             h = hash_key(canonical)
@@ -478,7 +370,7 @@ def dedupe_merge(state: Annotated[AgentState, InjectedState], tool_call_id: Anno
 @tool
 def store_to_db(state: Annotated[AgentState, InjectedState], db_path: str = "innovation.db") -> Any:
     """把 papers 与 innovations 幂等入库（SQLite）。"""
-    db = DB(db_path)
+    db = get_db(db_path)
     # 已访问的论文里，可能没有全部保存在 papers_queue。因此汇总：
     papers_pool: List[PaperMeta] = state.get("papers_queue", [])
     logger.info(f"store_to_db 存储创新点到数据库: {papers_pool}")
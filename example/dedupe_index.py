@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/08/30
+# @File  : dedupe_index.py
+# @Author: johnson
+# @Desc  : 创新点语义去重的增量索引：归一化后的float32矩阵按倍数扩容，embedding按hash缓存并追加写入磁盘，
+#          每轮的候选一次矩阵乘法完成打分，重启后不需要重新embedding
+
+from __future__ import annotations
+import os
+import logging
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger("innovation_collector")
+
+
+def embedding_cache_path(db_path: str) -> str:
+    """embedding缓存和innovation.db放在一起，例如 innovation.db -> innovation_embeddings"""
+    return f"{os.path.splitext(db_path)[0]}_embeddings"
+
+
+class DedupeIndex:
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]], path: Optional[str] = None, initial_capacity: int = 1024):
+        """
+        Args:
+            embed_fn: 批量embedding函数，例如 OpenAIEmbeddings().embed_documents
+            path: 缓存文件前缀，向量写入 {path}.f32，hash写入 {path}.hashes；为None时不持久化
+            initial_capacity: 索引矩阵的初始行数
+        """
+        self.embed_fn = embed_fn
+        self.path = path
+        self.initial_capacity = initial_capacity
+        self.dim: Optional[int] = None
+        # embedding缓存: hash -> 归一化后的向量
+        self.cache: Dict[str, np.ndarray] = {}
+        # 参与去重的向量，前_size行有效，容量不够时按2倍扩容
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._size = 0
+        self._hashes: List[str] = []
+        self._hash_set = set()
+        self.embed_calls = 0
+        if path:
+            self._load()
+
+    # ---------- 持久化 ----------
+    def _load(self):
+        vec_file, hash_file = f"{self.path}.f32", f"{self.path}.hashes"
+        if not (os.path.exists(vec_file) and os.path.exists(hash_file)):
+            return
+        with open(hash_file, "r", encoding="utf-8") as f:
+            header = f.readline().strip()
+            # 没有换行结尾的最后一行是写入中途退出留下的，不完整
+            hashes = [line.strip() for line in f if line.endswith("\n") and line.strip()]
+        if not header.startswith("dim="):
+            logger.warning("DedupeIndex | 缓存文件格式不对，忽略: %s", hash_file)
+            return
+        dim = int(header[4:])
+        vectors = np.fromfile(vec_file, dtype=np.float32)
+        # 写入中途退出时两个文件可能不一致，按较短的一个截断
+        count = min(len(hashes), len(vectors) // dim)
+        if len(vectors) != count * dim or os.path.getsize(hash_file) != self._hash_file_size(dim, hashes[:count]):
+            self._truncate_files(dim, hashes[:count])
+        vectors = vectors[:count * dim].reshape(count, dim)
+        self.dim = dim
+        self.cache = {h: vectors[i] for i, h in enumerate(hashes[:count])}
+        logger.info("DedupeIndex | 从%s加载了%d个embedding缓存", self.path, count)
+
+    @staticmethod
+    def _hash_file_size(dim: int, hashes: Sequence[str]) -> int:
+        return len(f"dim={dim}\n".encode("utf-8")) + sum(len(f"{h}\n".encode("utf-8")) for h in hashes)
+
+    def _truncate_files(self, dim: int, hashes: Sequence[str]):
+        """把两个文件都截断到前len(hashes)条，否则之后追加的向量和hash会错位"""
+        vec_file, hash_file = f"{self.path}.f32", f"{self.path}.hashes"
+        os.truncate(vec_file, len(hashes) * dim * np.dtype(np.float32).itemsize)
+        temp_file = f"{hash_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(f"dim={dim}\n")
+            f.write("".join(f"{h}\n" for h in hashes))
+        os.replace(temp_file, hash_file)
+        logger.warning("DedupeIndex | 缓存文件不一致，已截断到%d条: %s", len(hashes), self.path)
+
+    def _append_to_disk(self, hashes: Sequence[str], vectors: np.ndarray):
+        if not self.path or not len(hashes):
+            return
+        vec_file, hash_file = f"{self.path}.f32", f"{self.path}.hashes"
+        new_file = not os.path.exists(hash_file)
+        with open(vec_file, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(hash_file, "a", encoding="utf-8") as f:
+            if new_file:
+                f.write(f"dim={self.dim}\n")
+            f.write("".join(f"{h}\n" for h in hashes))
+
+    # ---------- embedding ----------
+    def embed(self, items) -> np.ndarray:
+        """
+        返回items(有hash和canonical字段)的归一化向量，缓存中没有的一次批量embedding
+        Returns:
+            np.ndarray: (len(items), dim)
+        """
+        missing = {}
+        for it in items:
+            if it.hash not in self.cache and it.hash not in missing:
+                missing[it.hash] = it.canonical
+        if missing:
+            self.embed_calls += 1
+            vectors = np.asarray(self.embed_fn(list(missing.values())), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-9
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            for h, v in zip(missing, vectors):
+                self.cache[h] = v
+            self._append_to_disk(list(missing), vectors)
+        if not items:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.stack([self.cache[it.hash] for it in items])
+
+    # ---------- 索引 ----------
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, h: str) -> bool:
+        return h in self._hash_set
+
+    @property
+    def hashes(self) -> List[str]:
+        return self._hashes
+
+    def in_sync(self, items) -> bool:
+        """
+        索引是否和items一致。调用方只在items末尾追加dedupe保留的候选，所以比较条数和最后一条即可，不用每轮重建hash集合；
+        不一致时(例如新的一次运行)调用reset，reset时完整重建
+        """
+        if self._size != len(items):
+            return False
+        return not items or self._hashes[-1] == items[-1].hash
+
+    def _append(self, hashes: List[str], vectors: np.ndarray):
+        need = self._size + len(hashes)
+        if need > self._matrix.shape[0] or self._matrix.shape[1] != vectors.shape[1]:
+            capacity = max(self.initial_capacity, self._matrix.shape[0])
+            while capacity < need:
+                capacity *= 2
+            matrix = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+            if self._size:
+                matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+        self._matrix[self._size:need] = vectors
+        self._size = need
+        self._hashes.extend(hashes)
+        self._hash_set.update(hashes)
+
+    def reset(self, items):
+        """用items重建索引，例如一次新的运行开始时，只对缓存中没有的embedding"""
+        self._size = 0
+        self._hashes = []
+        self._hash_set = set()
+        unique = list({it.hash: it for it in items}.values())
+        if unique:
+            self._append([it.hash for it in unique], self.embed(unique))
+
+    def dedupe(self, candidates, sim_threshold: float = 0.85) -> list:
+        """
+        对候选去重并把保留的加入索引：hash已存在、和索引中已有的相似度超过阈值、或和本批更早保留的候选相似度超过阈值的都丢弃
+        Returns:
+            list: 保留的候选，顺序和输入相同
+        """
+        pending = []
+        pending_hashes = set()
+        for cand in candidates:
+            if cand.hash in self._hash_set or cand.hash in pending_hashes:
+                continue
+            pending.append(cand)
+            pending_hashes.add(cand.hash)
+        if not pending:
+            return []
+        C = self.embed(pending)
+        # 和已有的全部创新点一次矩阵乘法
+        if self._size:
+            max_exist = (C @ self._matrix[:self._size].T).max(axis=1)
+        else:
+            max_exist = np.full(len(pending), -1.0, dtype=np.float32)
+        # 本批候选之间的相似度，按顺序保留
+        within = C @ C.T
+        accepted_idx: List[int] = []
+        for i in range(len(pending)):
+            if max_exist[i] >= sim_threshold:
+                continue
+            if accepted_idx and within[i, accepted_idx].max() >= sim_threshold:
+                continue
+            accepted_idx.append(i)
+        accepted = [pending[i] for i in accepted_idx]
+        if accepted:
+            self._append([it.hash for it in accepted], C[accepted_idx])
+        return accepted
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/08/30
+# @File  : extract_pool.py
+# @Author: johnson
+# @Desc  : 并发读取论文并抽取创新点：线程池控制并发，令牌桶限制大模型的请求速率，每篇论文有超时和重试，
+#          按完成顺序返回结果，调用方可以边抽取边去重，每轮的耗时从所有论文之和降到最慢的一篇左右
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger("innovation_collector")
+
+# 同时抽取的论文数
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", 8))
+# 每秒最多发给大模型的请求数，0表示不限制
+EXTRACT_RATE_LIMIT = float(os.getenv("EXTRACT_RATE_LIMIT", 0))
+# 令牌桶容量，允许的瞬时并发请求数
+EXTRACT_RATE_BURST = int(os.getenv("EXTRACT_RATE_BURST", EXTRACT_CONCURRENCY))
+# 每篇论文单次抽取的超时秒数
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", 120))
+# 超时或者出错后的重试次数
+EXTRACT_RETRIES = int(os.getenv("EXTRACT_RETRIES", 2))
+# 每轮最多处理的论文数
+EXTRACT_BATCH_SIZE = int(os.getenv("EXTRACT_BATCH_SIZE", 24))
+
+P = TypeVar("P")
+R = TypeVar("R")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[int] = None):
+        """
+        Args:
+            rate: 每秒补充的令牌数，<=0时不限制
+            capacity: 桶的容量，默认和rate相同
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity if capacity is not None else int(rate) or 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，没有令牌时等待"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+# 所有抽取共用一个限速器，多个CollectorAgent或者多次调用工具也不会超过大模型的速率限制
+rate_limiter = TokenBucket(EXTRACT_RATE_LIMIT, EXTRACT_RATE_BURST)
+
+
+def extract_concurrently(
+    papers: Sequence[P],
+    worker: Callable[[P], List[R]],
+    concurrency: int = EXTRACT_CONCURRENCY,
+    timeout: float = EXTRACT_TIMEOUT,
+    retries: int = EXTRACT_RETRIES,
+    limiter: Optional[TokenBucket] = None,
+) -> Iterator[Tuple[P, List[R]]]:
+    """
+    并发调用worker处理papers，按完成的先后顺序返回
+    Args:
+        papers: 要处理的论文
+        worker: 处理一篇论文，出错时抛出异常才会重试
+        concurrency: 线程数
+        timeout: 单次调用的超时秒数，超时的调用不再等待，结果丢弃后重试
+        retries: 重试次数，全部失败时这篇论文返回空列表
+        limiter: 每次调用worker之前取令牌，默认用模块级的rate_limiter
+    Yields:
+        (paper, worker的返回值)
+    """
+    if not papers:
+        return
+    limiter = limiter or rate_limiter
+
+    def call(paper, attempt):
+        limiter.acquire()
+        # 超时从真正开始调用worker时算起，排队等线程和令牌的时间不算
+        attempt["started"] = time.monotonic()
+        return worker(paper)
+
+    def submit(paper, attempt_no):
+        attempt = {"no": attempt_no, "started": None}
+        running[executor.submit(call, paper, attempt)] = (paper, attempt)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(papers))), thread_name_prefix="extract")
+    # future -> (paper, {"no": 第几次尝试, "started": 开始调用worker的时间，还在排队时为None})
+    running = {}
+    try:
+        for paper in papers:
+            submit(paper, 0)
+        while running:
+            # 最早到期的调用决定这次最多等多久，还在排队的最早也要now+timeout才到期
+            now = time.monotonic()
+            next_deadline = min((attempt["started"] or now) + timeout for _, attempt in running.values())
+            done, _ = wait(list(running), timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in list(running):
+                paper, attempt = running[future]
+                started = attempt["started"]
+                if future in done:
+                    error = future.exception()
+                elif started is not None and now - started >= timeout:
+                    future.cancel()
+                    error = TimeoutError(f"超过{timeout}秒")
+                else:
+                    continue
+                del running[future]
+                if error is None:
+                    yield paper, future.result()
+                elif attempt["no"] < retries:
+                    logger.warning("Extract | %s 第%d次抽取失败，重试: %s", getattr(paper, "id", paper), attempt["no"] + 1, error)
+                    submit(paper, attempt["no"] + 1)
+                else:
+                    logger.warning("Extract | %s 抽取失败，跳过: %s", getattr(paper, "id", paper), error)
+                    yield paper, []
+    finally:
+        # 调用方提前结束(例如已经达到目标条数)时，不再等待还在运行的抽取
+        executor.shutdown(wait=False, cancel_futures=True)
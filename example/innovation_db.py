@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/08/30
+# @File  : innovation_db.py
+# @Author: johnson
+# @Desc  : 创新点数据库(SQLite)：整个进程共用一个WAL模式的连接，executemany批量写入，重复数据由ON CONFLICT忽略；
+#          后台线程从队列中取数据写入，Agent的循环不需要等待磁盘
+
+import os
+import json
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger("innovation_collector")
+
+# 为True时写入放到后台线程
+INNOVATION_DB_BACKGROUND = os.getenv("INNOVATION_DB_BACKGROUND", "true").lower() == "true"
+
+PAPER_SQL = """
+    INSERT INTO papers(id, title, url, source, year, pdf_url, meta)
+    VALUES(?,?,?,?,?,?,?)
+    ON CONFLICT(id) DO UPDATE SET
+        title=excluded.title, url=excluded.url, source=excluded.source,
+        year=excluded.year, pdf_url=excluded.pdf_url, meta=excluded.meta
+"""
+
+INNOVATION_SQL = """
+    INSERT INTO innovations(
+        topic, paper_id, paper_title, source_url, text, canonical, hash,
+        evidence, confidence, novelty, created_at
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(hash) DO NOTHING
+"""
+
+
+class DB:
+    def __init__(self, path: str = "innovation.db", background: bool = INNOVATION_DB_BACKGROUND):
+        """
+        Args:
+            path: SQLite文件路径
+            background: 为True时upsert只放入队列，由后台线程写入；flush()等待写完
+        """
+        self.path = path
+        self.background = background
+        # 所有写入都在持有锁时使用这个连接，后台线程和调用方不会同时写
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # 本进程已经写入的hash，每轮传入全部创新点时只写新增的部分
+        self._written_hashes = set()
+        self._ensure()
+        self._queue: Optional[queue.Queue] = None
+        if background:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._flush_loop, name="innovation-db", daemon=True)
+            self._thread.start()
+
+    def _ensure(self):
+        with self._lock:
+            cur = self._con.cursor()
+            # WAL模式下读取不阻塞写入，synchronous=NORMAL只在checkpoint时fsync
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS papers (
+                    id TEXT PRIMARY KEY,
+                    title TEXT,
+                    url TEXT,
+                    source TEXT,
+                    year INT,
+                    pdf_url TEXT,
+                    meta JSON
+                );
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS innovations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic TEXT,
+                    paper_id TEXT,
+                    paper_title TEXT,
+                    source_url TEXT,
+                    text TEXT,
+                    canonical TEXT,
+                    hash TEXT UNIQUE,
+                    evidence JSON,
+                    confidence REAL,
+                    novelty REAL,
+                    created_at TEXT
+                );
+                """
+            )
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_innov_topic ON innovations(topic)")
+            self._con.commit()
+
+    @staticmethod
+    def _paper_rows(papers):
+        return [
+            (p.id, p.title, p.url, p.source, p.year, p.pdf_url or "", json.dumps(p.model_dump(), ensure_ascii=False))
+            for p in papers
+        ]
+
+    @staticmethod
+    def _innovation_rows(topic, items):
+        return [
+            (
+                topic,
+                it.paper_id,
+                it.paper_title,
+                it.source_url,
+                it.text,
+                it.canonical,
+                it.hash,
+                json.dumps(it.evidence.model_dump(), ensure_ascii=False),
+                it.confidence,
+                it.novelty,
+                it.created_at,
+            )
+            for it in items
+        ]
+
+    def upsert_papers(self, papers):
+        self._submit(PAPER_SQL, self._paper_rows, list(papers))
+
+    def upsert_innovations(self, topic: str, items):
+        new_items = []
+        for it in items:
+            if it.hash not in self._written_hashes:
+                self._written_hashes.add(it.hash)
+                new_items.append(it)
+        self._submit(INNOVATION_SQL, lambda batch: self._innovation_rows(topic, batch), new_items)
+
+    def _submit(self, sql: str, to_rows: Callable[[list], List[tuple]], items: list):
+        # 转换成行(json序列化)也放在后台线程，调用方只复制列表
+        if not items:
+            return
+        if self._queue is not None:
+            self._queue.put((sql, to_rows, items))
+        else:
+            self._write([(sql, to_rows, items)])
+
+    def _write(self, batches):
+        # 积压的多批数据在一个事务中提交，每批一次executemany
+        with self._lock:
+            try:
+                with self._con:
+                    for sql, to_rows, items in batches:
+                        self._con.executemany(sql, to_rows(items))
+            except sqlite3.Error as e:
+                logger.warning("DB write failed: %s", e)
+                # 写入失败的创新点下次需要重新写，重复的由ON CONFLICT忽略
+                self._written_hashes.clear()
+
+    def _flush_loop(self):
+        while True:
+            item = self._queue.get()
+            batches = [item]
+            # 把队列中已经积压的都取出来，一个事务写完
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batches)
+            for _ in batches:
+                self._queue.task_done()
+
+    def flush(self):
+        """等待队列中的数据全部写入"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._con.close()
+
+
+_dbs: Dict[str, DB] = {}
+_dbs_lock = threading.Lock()
+
+
+def get_db(path: str = "innovation.db") -> DB:
+    """同一个路径在进程内只打开一次，例如store_to_db每轮调用时复用"""
+    key = os.path.abspath(path)
+    with _dbs_lock:
+        if key not in _dbs:
+            _dbs[key] = DB(path)
+        return _dbs[key]
+
+
+@atexit.register
+def _flush_all():
+    for db in list(_dbs.values()):
+        db.flush()
@@ -34,6 +34,10 @@ import numpy as np
 import requests
 import dotenv
 from pydantic import BaseModel, Field
+from dedupe_index import DedupeIndex, embedding_cache_path
+from innovation_db import get_db
+from paper_search import paper_id, search_many
+from extract_pool import extract_concurrently, EXTRACT_BATCH_SIZE, EXTRACT_TIMEOUT
 
 dotenv.load_dotenv()
 
@@ -80,8 +84,9 @@ except Exception as e:
     raise
 
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0)
+llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0, timeout=EXTRACT_TIMEOUT)
 emb = OpenAIEmbeddings(model=os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small"))
+dedupe_index = DedupeIndex(emb.embed_documents)
 
 # ===================== Data Models =====================
 class PaperMeta(BaseModel):
@@ -123,94 +128,7 @@ class CandidateList(BaseModel):
     items: List[Candidate]
 
 # ===================== DB Layer (SQLite) =====================
-class DB:
-    def __init__(self, path: str = "innovation.db"):
-        self.path = path
-        self._ensure()
-
-    def _ensure(self):
-        con = sqlite3.connect(self.path)
-        cur = con.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS papers (
-                id TEXT PRIMARY KEY,
-                title TEXT,
-                url TEXT,
-                source TEXT,
-                year INT,
-                pdf_url TEXT,
-                meta JSON
-            );
-            """
-        )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS innovations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                topic TEXT,
-                paper_id TEXT,
-                paper_title TEXT,
-                source_url TEXT,
-                text TEXT,
-                canonical TEXT,
-                hash TEXT UNIQUE,
-                evidence JSON,
-                confidence REAL,
-                novelty REAL,
-                created_at TEXT
-            );
-            """
-        )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_innov_topic ON innovations(topic)")
-        con.commit()
-        con.close()
-
-    def upsert_papers(self, papers: List[PaperMeta]):
-        con = sqlite3.connect(self.path)
-        cur = con.cursor()
-        for p in papers:
-            cur.execute(
-                """
-                INSERT OR REPLACE INTO papers(id, title, url, source, year, pdf_url, meta)
-                VALUES(?,?,?,?,?,?,?)
-                """,
-                (p.id, p.title, p.url, p.source, p.year, p.pdf_url or "", json.dumps(p.model_dump(), ensure_ascii=False)),
-            )
-        con.commit()
-        con.close()
-
-    def upsert_innovations(self, topic: str, items: List[Innovation]):
-        con = sqlite3.connect(self.path)
-        cur = con.cursor()
-        for it in items:
-            try:
-                cur.execute(
-                    """
-                    INSERT INTO innovations(
-                        topic, paper_id, paper_title, source_url, text, canonical, hash,
-                        evidence, confidence, novelty, created_at
-                    ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
-                    """,
-                    (
-                        topic,
-                        it.paper_id,
-                        it.paper_title,
-                        it.source_url,
-                        it.text,
-                        it.canonical,
-                        it.hash,
-                        json.dumps(it.evidence.model_dump(), ensure_ascii=False),
-                        it.confidence,
-                        it.novelty,
-                        it.created_at,
-                    ),
-                )
-            except sqlite3.IntegrityError:
-                # hash UNIQUE: 忽略重复
-                pass
-        con.commit()
-        con.close()
+# 写入使用 innovation_db.get_db：单连接、WAL、批量写入、后台线程刷盘
 
 # ===================== Utils =====================
 def hash_key(text: str) -> str:
@@ -237,7 +155,7 @@ def arxiv_search(keyword: str, max_results: int = 20) -> List[PaperMeta]:
         items = response.get("search_result", []) or []
         results = [
             PaperMeta(
-                id=uuid.uuid4().hex,
+                id=paper_id(item.get("url", ""), item.get("title", "")),
                 url=item.get("url", ""),
                 title=item.get("title", ""),
                 snippet=item.get("content", ""),
@@ -277,23 +195,11 @@ def plan_queries(topic: str, old: Optional[List[str]] = None, k: int = 10) -> Li
 
 
 def search_papers(queries: List[str], per_query: int = 10) -> List[PaperMeta]:
-    all_results: List[PaperMeta] = []
-    for q in queries:
-        res = arxiv_search(q, max_results=per_query) or []
-        all_results.extend(res)
-    # 合并去重：基于 (url,title) 近似去重
-    seen: Set[Tuple[str, str]] = set()
-    merged: List[PaperMeta] = []
-    for p in all_results:
-        key = (p.url, p.title)
-        if key not in seen:
-            seen.add(key)
-            merged.append(p)
-    logger.info("Searcher | %d unique papers", len(merged))
-    return merged
+    # 并发搜索，按规范化URL生成的id去重
+    return search_many(queries, lambda q: arxiv_search(q, max_results=per_query))
 
 
-def extract_innovations_with_llm(text: str, max_chars: int = 12000, max_items: int = 8) -> List[Candidate]:
+def extract_innovations_with_llm(text: str, max_chars: int = 12000, max_items: int = 8, raise_errors: bool = False) -> List[Candidate]:
     if not text:
         return []
     snippet = text[:max_chars]
@@ -305,51 +211,47 @@ def extract_innovations_with_llm(text: str, max_chars: int = 12000, max_items: i
             result = CandidateList(**result)
         return result.items
     except Exception as e:
+        # 并发抽取时由 extract_concurrently 负责重试
+        if raise_errors:
+            raise
         logger.warning("LLM extract failed: %s", e)
         return []
 
 
-def paper_worker(paper: PaperMeta, max_items: int = 8) -> List[Candidate]:
+def paper_worker(paper: PaperMeta, max_items: int = 8, raise_errors: bool = False) -> List[Candidate]:
     text = paper.snippet
     if not text:
         return []
-    return extract_innovations_with_llm(text, max_items=max_items)
-
+    return extract_innovations_with_llm(text, max_items=max_items, raise_errors=raise_errors)
 
-def semantic_dedupe(existing: List[Innovation], candidates: List[Innovation], sim_threshold: float = 0.85) -> Tuple[List[Innovation], int]:
-    """把 candidates 合并到 existing，并做语义去重；返回 (merged, 新增条数)。"""
-    merged = list(existing)
-    seen_hash: Set[str] = {it.hash for it in existing}
-
-    cand_texts = [c.canonical for c in candidates]
-    exist_texts = [e.canonical for e in existing]
 
+def dedupe_candidates(existing: List[Innovation], candidates: List[Innovation], sim_threshold: float, index: DedupeIndex) -> List[Innovation]:
+    """返回 candidates 中需要新增的创新点；existing 的向量保存在 index 中，每轮只对新的候选做 embedding。"""
     try:
-        vec_c = emb.embed_documents(cand_texts) if cand_texts else []
-        vec_e = emb.embed_documents(exist_texts) if exist_texts else []
-        E = np.array(vec_e) if vec_e else np.zeros((0, 1536))
+        # 索引里的创新点和 existing 不一致时（例如新的一次运行）重建，已缓存的 embedding 不会重新计算
+        if not index.in_sync(existing):
+            index.reset(existing)
+        return index.dedupe(candidates, sim_threshold=sim_threshold)
     except Exception as e:
         logger.warning("Embedding failed, fallback to hash-only dedupe: %s", e)
-        vec_c, E = [], np.zeros((0, 1))
-
-    added = 0
-    for i, cand in enumerate(candidates):
-        if cand.hash in seen_hash:
-            continue
-        dup = False
-        if len(E) and vec_c:
-            v = np.array(vec_c[i])
-            if E.size and v.size:
-                sims = (E @ v) / (np.linalg.norm(E, axis=1) * np.linalg.norm(v) + 1e-9)
-                if sims.size and float(np.max(sims)) >= sim_threshold:
-                    dup = True
-        if not dup:
-            merged.append(cand)
-            seen_hash.add(cand.hash)
-            added += 1
-            if vec_c:
-                E = np.vstack([E, vec_c[i]]) if E.size else np.array([vec_c[i]])
-    return merged, added
+        seen_hash: Set[str] = set()
+        in_index = index.in_sync(existing)
+        if not in_index:
+            seen_hash = {it.hash for it in existing}
+        accepted = []
+        for cand in candidates:
+            if cand.hash not in seen_hash and not (in_index and cand.hash in index):
+                accepted.append(cand)
+                seen_hash.add(cand.hash)
+        return accepted
+
+
+def semantic_dedupe(existing: List[Innovation], candidates: List[Innovation], sim_threshold: float = 0.85,
+                    index: Optional[DedupeIndex] = None) -> Tuple[List[Innovation], int]:
+    """把 candidates 去重后追加到 existing（原地修改，不复制已有的创新点）；返回 (existing, 新增条数)。"""
+    accepted = dedupe_candidates(existing, candidates, sim_threshold, index if index is not None else dedupe_index)
+    existing.extend(accepted)
+    return existing, len(accepted)
 
 
 # ===================== 顺序 Agent =====================
@@ -365,9 +267,11 @@ class AgentState(TypedDict, total=False):
 
 class CollectorAgent:
     def __init__(self, db_path: str = "innovation.db"):
-        self.db = DB(db_path)
+        self.db = get_db(db_path)
+        # 已有创新点的向量索引，embedding 缓存写在数据库旁边，重启后不需要重新 embedding
+        self.dedupe_index = DedupeIndex(emb.embed_documents, path=embedding_cache_path(db_path))
 
-    def run(self, topic: str, target_n: int = 50, per_query: int = 10, max_rounds: int = 50, per_batch: int = 6, sim_threshold: float = 0.85) -> AgentState:
+    def run(self, topic: str, target_n: int = 50, per_query: int = 10, max_rounds: int = 50, per_batch: int = EXTRACT_BATCH_SIZE, sim_threshold: float = 0.85) -> AgentState:
         state: AgentState = {
             "topic": topic,
             "target_n": target_n,
@@ -412,42 +316,50 @@ class CollectorAgent:
                 state["queries"] = plan_queries(topic, old=state["queries"]) or state["queries"]
                 continue
 
-            all_cands: List[Innovation] = []
-            for one in tqdm(batch, desc="处理论文"):
-                cands = paper_worker(one, max_items=8)
-                for c in cands:
-                    canonical = c.text
-                    h = hash_key(canonical)
-                    inv = Innovation(
-                        text=c.text,
-                        canonical=canonical,
-                        hash=h,
-                        paper_id=one.id,
-                        paper_title=one.title,
-                        source_url=one.url,
-                        evidence=Evidence(quote=c.evidence_quote or "", loc=c.loc or ""),
-                        confidence=float(c.confidence or 0.7),
-                        novelty=float(c.novelty or 0.7),
-                    )
-                    all_cands.append(inv)
+            # 3) 并发抽取，每篇论文完成后立即语义去重合并
+            added = 0
+            done_ids: Set[str] = set()
+            with tqdm(total=len(batch), desc="处理论文") as pbar:
+                for one, cands in extract_concurrently(batch, lambda p: paper_worker(p, max_items=8, raise_errors=True)):
+                    pbar.update(1)
+                    done_ids.add(one.id)
+                    paper_cands: List[Innovation] = []
+                    for c in cands:
+                        canonical = c.text
+                        h = hash_key(canonical)
+                        inv = Innovation(
+                            text=c.text,
+                            canonical=canonical,
+                            hash=h,
+                            paper_id=one.id,
+                            paper_title=one.title,
+                            source_url=one.url,
+                            evidence=Evidence(quote=c.evidence_quote or "", loc=c.loc or ""),
+                            confidence=float(c.confidence or 0.7),
+                            novelty=float(c.novelty or 0.7),
+                        )
+                        paper_cands.append(inv)
+                    merged, paper_added = semantic_dedupe(state["innovations"], paper_cands, sim_threshold=sim_threshold, index=self.dedupe_index)
+                    state["innovations"] = merged
+                    added += paper_added
+                    # 达到目标后不再等待剩余的论文，没处理完的论文留在队列里
+                    if len(merged) >= target_n:
+                        break
 
             # 标记访问 & 维护队列
-            visited |= {p.id for p in batch}
+            batch = [p for p in batch if p.id in done_ids]
+            visited |= done_ids
             state["visited_ids"] = visited
             state["papers_queue"] = [p for p in state["papers_queue"] if p.id not in visited]
             state["stats"]["read"] += len(batch)
-
-            # 3) 语义去重合并
-            merged, added = semantic_dedupe(state["innovations"], all_cands, sim_threshold=sim_threshold)
-            state["innovations"] = merged
             state["stats"]["new_points"] += added
             state["stats"]["_prev_added"] = added
-            logger.info("Dedupe | +%d new unique innovations (total=%d)", added, len(merged))
+            logger.info("Dedupe | +%d new unique innovations (total=%d)", added, len(state["innovations"]))
 
             # 4) 入库（幂等）
             try:
                 self.db.upsert_papers(batch)
-                self.db.upsert_innovations(topic, merged)
+                self.db.upsert_innovations(topic, state["innovations"])
                 logger.info("DB | upserted batch + merged innovations")
             except Exception as e:
                 logger.warning("DB upsert error: %s", e)
@@ -470,6 +382,8 @@ class CollectorAgent:
             if added == 0 or len(state["papers_queue"]) < per_batch:
                 state["queries"] = plan_queries(topic, old=state["queries"]) or state["queries"]
 
+        # 等待后台线程把剩余的数据写入
+        self.db.flush()
         logger.info("=== Done | collected=%d innovations ===", len(state.get("innovations", [])))
         return state
 
@@ -481,7 +395,7 @@ if __name__ == "__main__":
     parser.add_argument("--target", dest="target", type=int, default=5, help="目标创新点数量")
     parser.add_argument("--per_query", dest="per_query", type=int, default=10, help="每个检索式返回条数上限")
     parser.add_argument("--rounds", dest="rounds", type=int, default=50, help="最大轮数")
-    parser.add_argument("--batch", dest="batch", type=int, default=6, help="每轮处理论文数上限")
+    parser.add_argument("--batch", dest="batch", type=int, default=EXTRACT_BATCH_SIZE, help="每轮处理论文数上限")
     parser.add_argument("--sim", dest="sim", type=float, default=0.85, help="去重相似度阈值(0-1)")
     parser.add_argument("--db", dest="db", type=str, default="innovation.db", help="SQLite 路径")
     args = parser.parse_args()
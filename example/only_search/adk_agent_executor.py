@@ -1,3 +1,4 @@
+import time
 import asyncio
 import logging
 
@@ -5,8 +6,9 @@ from collections.abc import AsyncGenerator,AsyncIterable
 from google.adk import Runner
 
 from google.adk.events import Event
+from google.adk.sessions.state import State
 from google.genai import types
-from typing import Any, Dict, List, Literal, Optional, Union
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union
 from a2a.server.agent_execution import AgentExecutor
 from a2a.server.agent_execution.context import RequestContext
 from a2a.server.events.event_queue import EventQueue
@@ -36,6 +38,7 @@ from a2a.types import (
 from a2a.utils.errors import ServerError
 from a2a.utils.message import new_agent_text_message
 from google.adk.agents.base_agent import BaseAgent
+from slide_agent.reference_store import expand_references
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -52,10 +55,50 @@ def extract_agent_names(agent: BaseAgent, names=None):
         extract_agent_names(sub, names)
     return names
 
+class SessionStateView:
+    """
+    执行过程中 session.state 的本地副本：开始时读取一次，之后只应用每个事件的 state_delta，不再每个事件调用 get_session；
+    每个 key 记录版本号，materialize 只在 key 变化后才重新生成数据（例如展开 references）
+    """
+
+    def __init__(self, state: Optional[dict] = None):
+        self.state: Dict[str, Any] = dict(state or {})
+        self._versions: Dict[str, int] = {}
+        # key -> (生成时的版本号, 生成的数据)
+        self._materialized: Dict[str, Tuple[int, Any]] = {}
+
+    def apply(self, event: Event) -> List[str]:
+        """应用事件的 state_delta，返回变化的 key"""
+        delta = event.actions.state_delta if event.actions else None
+        if not delta:
+            return []
+        changed = []
+        for key, value in delta.items():
+            # temp: 开头的不会保存到 session 中，和 session_service 保持一致
+            if key.startswith(State.TEMP_PREFIX):
+                continue
+            self.state[key] = value
+            self._versions[key] = self._versions.get(key, 0) + 1
+            changed.append(key)
+        return changed
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.state.get(key, default)
+
+    def materialize(self, key: str, build: Callable[[Any], Any]) -> Any:
+        """key 没有变化时返回上次的结果，变化后才调用 build(当前值)"""
+        version = self._versions.get(key, 0)
+        cached = self._materialized.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, build(self.state.get(key)))
+            self._materialized[key] = cached
+        return cached[1]
+
+
 class ADKAgentExecutor(AgentExecutor):
     """An AgentExecutor that runs an ADK-based Agent."""
 
-    def __init__(self, runner: Runner, card: AgentCard, run_config, show_agent):
+    def __init__(self, runner: Runner, card: AgentCard, run_config, show_agent, stream_agents=None):
         self.runner = runner
         self._card = card
 
@@ -63,6 +106,8 @@ class ADKAgentExecutor(AgentExecutor):
         self.run_config = run_config
         # show_agent代表和前端联动，显示xml的ppt的结果
         self.show_agent = show_agent
+        # 流式输出(SSE)时转发增量文本的Agent，其它Agent(例如输出JSON的计划)的增量不转发，只发送完整的结果
+        self.stream_agents = set(stream_agents or [])
 
     def _run_agent(
         self, session_id, new_message: types.Content
@@ -97,17 +142,37 @@ class ADKAgentExecutor(AgentExecutor):
         logger.info(f"收到请求信息: {new_message}")
         agent_names = extract_agent_names(self.runner.agent)
         agent_names = list(agent_names)
+        # 开始时的 state 来自 _upsert_session，之后只应用事件的 state_delta
+        state_view = SessionStateView(session_obj.state)
+        start_time = time.time()
+        # 每个Agent第一次输出文本(包括增量)的耗时
+        first_output_time: Dict[str, float] = {}
         async for event in self._run_agent(session_id, new_message):
+            changed_keys = state_view.apply(event)
+            if changed_keys:
+                logger.debug(f"[adk executor] {event.author} 更新了state: {changed_keys}")
             agent_author = event.author
+            if agent_author not in first_output_time and event.content and any(p.text for p in event.content.parts or []):
+                first_output_time[agent_author] = time.time() - start_time
+                logger.info(f"[adk executor] {agent_author} 首次输出耗时 {first_output_time[agent_author]:.2f}s")
+            if event.partial:
+                # 增量事件不会写入session，完整的结果还会再来一个非partial的事件
+                if agent_author in self.stream_agents and event.content and event.content.parts:
+                    parts = convert_genai_parts_to_a2a([p for p in event.content.parts if p.text])
+                    if parts:
+                        await task_updater.update_status(
+                            TaskState.working,
+                            message=task_updater.new_agent_message(
+                                parts, metadata={"author": agent_author, "partial": True}
+                            ),
+                        )
+                continue
             if agent_author in self.show_agent:
                 logger.info(f"[adk executor] {agent_author}完成")
                 if event.content and event.content.parts:
-                    final_session = await self.runner.session_service.get_session(
-                        app_name=self.runner.app_name, user_id="self", session_id=session_id
-                    )
-                    print("最终的session中的结果final_session中的state: ", final_session.state)
-                    references = final_session.state.get("references", [])
-                    last_validation = final_session.state.get("last_validation", {})
+                    # state 中只有预览，references 变化后才重新读取完整的 snippet
+                    references = state_view.materialize("references", lambda value: expand_references(value, session_id))
+                    last_validation = state_view.materialize("last_validation", lambda value: value or {})
                     # 最后一个agent的输出了，输出成status
                     await task_updater.update_status(
                         TaskState.working,
@@ -125,12 +190,7 @@ class ADKAgentExecutor(AgentExecutor):
                 print(f"event.content没有结果，跳过, Agent是: {agent_author}, event是: {event}")
                 continue
             elif event.is_final_response():
-                final_session = await self.runner.session_service.get_session(
-                    app_name=self.runner.app_name, user_id="self", session_id=session_id
-                )
-                print("最终的session中的结果final_session中的state: ", final_session.state)
-                final_metadata = final_session.state.get("metadata")
-                references = final_session.state.get("references",[])
+                references = state_view.materialize("references", lambda value: expand_references(value, session_id))
                 agent_author = event.author
                 if agent_author in agent_names:
                     logger.info(f"[adk executor] {agent_author}完成")
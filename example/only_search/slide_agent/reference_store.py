@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/11/06
+# @File  : reference_store.py
+# @Author: johnson
+# @Desc  : 搜索到的文档登记：完整的snippet按(session_id, file_id)保存在进程内，session的state.references中只保留编号、标题、链接和预览，
+#          state的大小和每次get_session复制的数据量不再随着snippet的长度增长，需要全文时再按file_id读取
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# state.references 中每篇文档保留的预览字数
+REFERENCE_PREVIEW_CHARS = int(os.getenv("REFERENCE_PREVIEW_CHARS", 120))
+# 进程内最多保存的snippet数量，超过后淘汰最久没有用到的，被淘汰的文档读取时退回预览
+REFERENCE_STORE_ITEMS = int(os.getenv("REFERENCE_STORE_ITEMS", 20000))
+
+# (session_id, file_id) -> 完整的snippet
+_snippets: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def intern_snippet(session_id: str, file_id: str, snippet: str):
+    """
+    保存文档的完整snippet，每个session中同一篇文档只保存第一次搜到的片段，
+    和preview、模型第一次看到的内容一致，也不会受到其它session搜索结果的影响
+    """
+    if not file_id:
+        return
+    key = (session_id, file_id)
+    with _lock:
+        if key in _snippets:
+            _snippets.move_to_end(key)
+            return
+        _snippets[key] = snippet or ""
+        while len(_snippets) > REFERENCE_STORE_ITEMS:
+            _snippets.popitem(last=False)
+
+
+def load_snippet(session_id: str, file_id: str) -> Optional[str]:
+    """读取完整的snippet，没有保存过或者已经被淘汰时返回None"""
+    key = (session_id, file_id)
+    with _lock:
+        snippet = _snippets.get(key)
+        if snippet is not None:
+            _snippets.move_to_end(key)
+        return snippet
+
+
+def register_articles(references: Dict[str, dict], articles: Iterable[Dict[str, Any]], session_id: str) -> List[dict]:
+    """
+    把搜索结果登记到 references（原地修改），已经登记过的文档直接复用，新文档的 idx_val 依次递增
+    Args:
+        references: state.references，{file_id: {idx_val, file_id, title, publish_time, url, preview}}
+        articles: 搜索接口返回的 articles
+        session_id: references 所属的session
+    Returns:
+        list: 和 articles 顺序相同的引用条目
+    """
+    entries = []
+    for article_dict in articles:
+        file_id = article_dict["file_id"]
+        snippet = article_dict.get("snippet") or ""
+        intern_snippet(session_id, file_id, snippet)
+        entry = references.get(file_id)
+        if entry is None:
+            article_url = article_dict.get("url")
+            if not article_url:
+                article_url = "https://www.bing.com/search?q=" + article_dict.get("title", "")
+            entry = {
+                # 登记后不会删除，数量就是当前最大的编号
+                "idx_val": len(references) + 1,
+                "file_id": file_id,
+                "title": article_dict.get("title", ""),
+                "publish_time": article_dict.get("publish_time", ""),
+                "url": article_url,
+                "preview": snippet[:REFERENCE_PREVIEW_CHARS],
+            }
+            references[file_id] = entry
+        entries.append(entry)
+    return entries
+
+
+def expand_references(references: Optional[Dict[str, dict]], session_id: str,
+                      file_ids: Optional[Iterable[str]] = None) -> Dict[str, dict]:
+    """
+    返回带完整 snippet 的引用（新的字典，不修改state），用于最终结果和需要原文的Agent
+    Args:
+        references: state.references
+        session_id: references 所属的session
+        file_ids: 只展开这些文档，默认全部
+    """
+    references = references or {}
+    if file_ids is None:
+        file_ids = references.keys()
+    expanded = {}
+    missing = []
+    for file_id in file_ids:
+        entry = references.get(file_id)
+        if entry is None:
+            continue
+        snippet = load_snippet(session_id, file_id)
+        if snippet is None:
+            missing.append(file_id)
+            snippet = entry.get("preview", "")
+        item = {key: value for key, value in entry.items() if key != "preview"}
+        item["snippet"] = snippet
+        expanded[file_id] = item
+    if missing:
+        # 进程重启或者超过REFERENCE_STORE_ITEMS被淘汰后，只能返回state中的预览
+        logger.warning(f"session {session_id} 的 {len(missing)} 篇文档没有完整的snippet，使用预览代替: {missing[:10]}")
+    return expanded
@@ -10,6 +10,7 @@ from google.adk.agents.invocation_context import InvocationContext
 from google.genai.types import GenerateContentConfig
 from ...create_model import create_model
 from ...config import SUMMARY_AGENT_CONFIG
+from ...reference_store import expand_references
 from .prompt import SUMMARY_AGENT_PROMPT
 import logging
 
@@ -23,6 +24,17 @@ def _dynamic_instruction(ctx: InvocationContext) -> str:
         parts.append(json.dumps(agent_result, ensure_ascii=False))
     content = "\n".join(parts)
     prompt = SUMMARY_AGENT_PROMPT.format(question=question, search_results=content)
+    # 只展开 useful_docs 中引用到的文档，完整的 snippet 这时才从 reference_store 读取
+    cited_ids = []
+    for agent_result in search_results.values():
+        for doc in agent_result.get("useful_docs") or []:
+            ref_key = doc.get("ref_key") if isinstance(doc, dict) else None
+            if ref_key and ref_key not in cited_ids:
+                cited_ids.append(ref_key)
+    cited = expand_references(ctx.state.get("references"), ctx._invocation_context.session.id, cited_ids)
+    if cited:
+        docs = sorted(cited.values(), key=lambda item: item["idx_val"])
+        prompt += "\n【参考文献（按 idx_val 引用）】\n```json\n" + json.dumps(docs, ensure_ascii=False) + "\n```\n"
     return prompt
 
 
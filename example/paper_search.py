@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/08/30
+# @File  : paper_search.py
+# @Author: johnson
+# @Desc  : 多个检索式并发搜索，按规范化后的URL生成稳定的论文id，不同检索式搜到的同一篇论文在进入papers_queue之前合并
+
+import os
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Sequence
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+logger = logging.getLogger("innovation_collector")
+
+# 同时发出的搜索请求数
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 4))
+
+# 不影响页面内容的跟踪参数
+TRACKING_PARAMS = {"spm", "from", "ref", "source", "share", "share_source", "fbclid", "gclid", "mc_cid", "mc_eid"}
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    规范化URL：协议和域名小写、去掉www、锚点、跟踪参数和末尾的/，查询参数排序；
+    arXiv的abs/pdf链接和不同版本都转换成 arxiv.org/abs/编号
+    """
+    url = (url or "").strip()
+    if not url:
+        return ""
+    parts = urlsplit(url if "://" in url else f"https://{url}")
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    if host in ("arxiv.org", "export.arxiv.org") and (path.startswith("/abs/") or path.startswith("/pdf/")):
+        paper_no = path.split("/", 2)[2]
+        if paper_no.endswith(".pdf"):
+            paper_no = paper_no[:-4]
+        # 去掉版本号，例如 2401.12345v2
+        head, _, version = paper_no.rpartition("v")
+        if head and version.isdigit():
+            paper_no = head
+        return f"https://arxiv.org/abs/{paper_no}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit(("https", host, path, urlencode(query), ""))
+
+
+def paper_id(url: str, title: str = "") -> str:
+    """规范化URL的hash作为论文id，没有URL时用标题"""
+    key = canonicalize_url(url) or " ".join((title or "").lower().split())
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def search_many(queries: Sequence[str], search_fn: Callable[[str], list], concurrency: int = SEARCH_CONCURRENCY) -> list:
+    """
+    并发执行多个检索式，按检索式的顺序合并结果并按论文id去重
+    Args:
+        queries: 检索式
+        search_fn: 搜索一个检索式，返回有url和title字段的结果列表
+        concurrency: 同时搜索的检索式数量
+    Returns:
+        list: 去重后的结果，id已经设置为paper_id(url, title)
+    """
+    queries = list(dict.fromkeys(q for q in queries if q))
+    if not queries:
+        return []
+
+    def one(query):
+        try:
+            return search_fn(query) or []
+        except Exception as e:
+            logger.warning("WebSearch | 搜索关键词%r发生了错误: %s", query, e)
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(queries))), thread_name_prefix="search") as executor:
+        results_per_query = list(executor.map(one, queries))
+
+    merged = []
+    seen = set()
+    total = 0
+    for results in results_per_query:
+        for item in results:
+            total += 1
+            # 缓存中的旧结果可能还是随机id，这里统一重新计算
+            item.id = paper_id(item.url, item.title)
+            if item.id in seen:
+                continue
+            seen.add(item.id)
+            merged.append(item)
+    logger.info("Searcher | %d queries, %d results, %d unique papers", len(queries), total, len(merged))
+    return merged
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/11/06
+# @File  : benchmark_executor.py
+# @Author: johnson
+# @Desc  : 统计ADKAgentExecutor处理一次请求时get_session的调用次数和序列化的state字节数：
+#          原来每个ControllerAgent事件和最终结果都重新get_session并打印整个state，对比现在只应用state_delta
+# python benchmark_executor.py --steps 10 50 200 --refs_per_step 10
+
+import json
+import time
+import asyncio
+import argparse
+from typing import AsyncGenerator
+
+from google.adk.agents.base_agent import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.genai import types
+
+from adk_agent_executor import ADKAgentExecutor
+from slide_agent.reference_store import register_articles
+
+SHOW_AGENT = "ControllerAgent"
+
+
+class CountingSessionService(InMemorySessionService):
+    """记录get_session的次数和返回的state序列化后的字节数"""
+
+    def __init__(self):
+        super().__init__()
+        self.get_calls = 0
+        self.state_bytes = 0
+
+    async def get_session(self, **kwargs):
+        session = await super().get_session(**kwargs)
+        if session is not None:
+            self.get_calls += 1
+            self.state_bytes += len(json.dumps(session.state, ensure_ascii=False, default=str).encode("utf-8"))
+        return session
+
+
+class FakePlanAgent(BaseAgent):
+    """模拟计划执行：每一步搜索一次并更新references，ControllerAgent输出一次状态，最后输出总结"""
+    steps: int = 10
+    refs_per_step: int = 10
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        references = {}
+        history = []
+        for step in range(self.steps):
+            articles = [
+                {"file_id": f"s{step}-{i}", "title": f"文档 {step}-{i}", "url": "", "publish_time": "2024-01-01",
+                 "snippet": "检索片段" * 500}
+                for i in range(self.refs_per_step)
+            ]
+            register_articles(references, articles, ctx.session.id)
+            call = types.Part(function_call=types.FunctionCall(name="PaperSearch", args={"keyword": f"q{step}"}))
+            yield Event(invocation_id=ctx.invocation_id, author="StepExecuteSubAgent",
+                        content=types.Content(role="model", parts=[call]),
+                        actions=EventActions(state_delta={"references": references}))
+            history.append({"step_id": f"s{step}", "status": "success", "output": {"n": self.refs_per_step}})
+            yield Event(invocation_id=ctx.invocation_id, author=SHOW_AGENT,
+                        content=types.Content(role="model", parts=[types.Part(text=f"s{step} 完成")]),
+                        actions=EventActions(state_delta={"step_history": list(history),
+                                                          "last_validation": {"step_id": f"s{step}", "ok": True}}))
+        yield Event(invocation_id=ctx.invocation_id, author=self.name,
+                    content=types.Content(role="model", parts=[types.Part(text="# 总结")]))
+
+
+class RecordingUpdater:
+    """只记录发出的消息数量，代替a2a的TaskUpdater"""
+
+    def __init__(self):
+        self.messages = 0
+
+    def new_agent_message(self, parts, metadata=None):
+        return {"parts": parts, "metadata": metadata}
+
+    async def update_status(self, state, message=None):
+        self.messages += 1
+
+    async def add_artifact(self, parts, metadata=None):
+        self.messages += 1
+
+    async def complete(self):
+        pass
+
+
+class LegacyFetch:
+    """按原来的逻辑，在相同的事件上get_session并打印(序列化)整个state"""
+
+    def __init__(self, executor: ADKAgentExecutor, service: CountingSessionService):
+        self.executor = executor
+        self.service = service
+        self.printed_bytes = 0
+
+    def wrap(self, run_agent):
+        async def run(session_id, new_message):
+            async for event in run_agent(session_id, new_message):
+                has_content = bool(event.content and event.content.parts)
+                if (event.author in self.executor.show_agent and has_content) or (has_content and event.is_final_response()):
+                    session = await self.service.get_session(app_name=self.executor.runner.app_name, user_id="self",
+                                                             session_id=session_id)
+                    self.printed_bytes += len(str(session.state).encode("utf-8"))
+                yield event
+        return run
+
+
+async def run_once(steps: int, refs_per_step: int, legacy: bool):
+    service = CountingSessionService()
+    agent = FakePlanAgent(name="BenchRoot", steps=steps, refs_per_step=refs_per_step)
+    runner = Runner(app_name="bench", agent=agent, session_service=service)
+    executor = ADKAgentExecutor(runner, None, RunConfig(streaming_mode=StreamingMode.NONE), [SHOW_AGENT])
+    legacy_fetch = None
+    if legacy:
+        legacy_fetch = LegacyFetch(executor, service)
+        executor._run_agent = legacy_fetch.wrap(executor._run_agent)
+    updater = RecordingUpdater()
+    start_time = time.time()
+    await executor._process_request(types.UserContent(parts=[types.Part(text="开始")]), "s1", updater)
+    cost = time.time() - start_time
+    printed = legacy_fetch.printed_bytes if legacy_fetch else 0
+    return service.get_calls, service.state_bytes + printed, cost, updater.messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ADKAgentExecutor的get_session次数和state序列化字节数")
+    parser.add_argument("--steps", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--refs_per_step", type=int, default=10, help="每一步新增的文档数量")
+    args = parser.parse_args()
+    for steps in args.steps:
+        for legacy in (True, False):
+            calls, size, cost, messages = asyncio.run(run_once(steps, args.refs_per_step, legacy))
+            name = "原实现(每个事件get_session)" if legacy else "state_delta增量"
+            print(f"{steps} 步 {name}: get_session {calls} 次, 序列化 {size / 1024:,.1f} KB, "
+                  f"耗时 {cost:.2f}s, 发出消息 {messages} 条")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2025/11/06
+# @File  : benchmark_streaming.py
+# @Author: johnson
+# @Desc  : 测量最终总结的首字节时间(TTFB)：模拟一个逐块输出的大模型，对比普通模式和SSE流式模式下
+#          调用方第一次收到SummaryAgent内容的耗时，同时检查输出JSON的Agent没有发出增量
+# python benchmark_streaming.py --chunks 40 --chunk_delay 0.05
+
+import time
+import json
+import asyncio
+import argparse
+from typing import AsyncGenerator
+
+from google.adk.agents import SequentialAgent
+from google.adk.agents.llm_agent import LlmAgent
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.genai import types
+
+from adk_agent_executor import ADKAgentExecutor
+
+
+class ChunkedLlm(BaseLlm):
+    """按固定间隔逐块输出文本的模型，非流式时等全部生成完再返回"""
+    model: str = "chunked"
+    text: str = ""
+    chunks: int = 40
+    chunk_delay: float = 0.05
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        size = max(1, len(self.text) // self.chunks)
+        pieces = [self.text[i:i + size] for i in range(0, len(self.text), size)]
+        for piece in pieces:
+            await asyncio.sleep(self.chunk_delay)
+            if stream:
+                yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=piece)]), partial=True)
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=self.text)]))
+
+
+class TimingUpdater:
+    """记录每个Agent第一次发出消息的时间，以及增量消息的数量"""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.first_message = {}
+        self.partial_messages = {}
+
+    def new_agent_message(self, parts, metadata=None):
+        return {"parts": parts, "metadata": metadata or {}}
+
+    def _record(self, metadata):
+        author = metadata.get("author")
+        self.first_message.setdefault(author, time.time() - self.start_time)
+        if metadata.get("partial"):
+            self.partial_messages[author] = self.partial_messages.get(author, 0) + 1
+
+    async def update_status(self, state, message=None):
+        if message is not None:
+            self._record(message["metadata"])
+
+    async def add_artifact(self, parts, metadata=None):
+        self._record(metadata or {})
+
+    async def complete(self):
+        pass
+
+
+async def run_once(streaming: bool, chunks: int, chunk_delay: float):
+    plan_json = json.dumps({"steps": [{"id": f"s{i}", "title": f"步骤{i}", "depends_on": []} for i in range(8)]}, ensure_ascii=False)
+    plan_agent = LlmAgent(name="PlanAgent", model=ChunkedLlm(text=plan_json, chunks=chunks, chunk_delay=chunk_delay))
+    summary_agent = LlmAgent(name="SummaryAgent", model=ChunkedLlm(text="# 总结\n" + "检索结果要点。" * 200, chunks=chunks, chunk_delay=chunk_delay))
+    root = SequentialAgent(name="BenchRoot", sub_agents=[plan_agent, summary_agent])
+    runner = Runner(app_name="bench", agent=root, session_service=InMemorySessionService())
+    mode = StreamingMode.SSE if streaming else StreamingMode.NONE
+    executor = ADKAgentExecutor(runner, None, RunConfig(streaming_mode=mode), [], stream_agents=["SummaryAgent"])
+    updater = TimingUpdater()
+    await executor._process_request(types.UserContent(parts=[types.Part(text="开始")]), "s1", updater)
+    total = time.time() - updater.start_time
+    # 总结开始于计划完成之后，TTFB从计划完成(PlanAgent的完整结果)算起
+    plan_done = updater.first_message.get("PlanAgent", 0.0)
+    summary_first = updater.first_message.get("SummaryAgent", total)
+    return summary_first - plan_done, total, updater.partial_messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="最终总结的首字节时间(TTFB)")
+    parser.add_argument("--chunks", type=int, default=40, help="每次生成分成多少块")
+    parser.add_argument("--chunk_delay", type=float, default=0.05, help="每块的生成间隔(秒)")
+    args = parser.parse_args()
+    for streaming in (False, True):
+        ttfb, total, partial_messages = asyncio.run(run_once(streaming, args.chunks, args.chunk_delay))
+        name = "SSE流式" if streaming else "普通模式"
+        print(f"{name}: 总结TTFB {ttfb:.2f}s, 总耗时 {total:.2f}s, 增量消息 {partial_messages}")
+
+
+if __name__ == '__main__':
+    main()
@@ -39,8 +39,10 @@ from a2a.types import (
 from slide_agent.agent import root_agent
 
 def build_app(agent_url: str | None = None):
-    # 运行模式（默认非流式，避免结构化输出被打断）
-    streaming = False
+    # 运行模式：STREAMING=true 时使用 SSE 流式输出，只有 STREAM_AGENTS 中的 Agent 转发增量文本，
+    # 输出 JSON 的 Agent（计划、修复计划、步骤执行的 step_result）只发送完整的结果，结构化输出不会被打断
+    streaming = os.getenv("STREAMING", "false").lower() == "true"
+    stream_agents = [name.strip() for name in os.getenv("STREAM_AGENTS", "SummaryAgent").split(",") if name.strip()]
     show_agent = ["ControllerAgent"]
 
     agent_card_name = "Search Agent"
@@ -87,7 +89,7 @@ def build_app(agent_url: str | None = None):
         logger.info("使用普通输出模式")
         run_config = RunConfig(streaming_mode=StreamingMode.NONE, max_llm_calls=500)
 
-    agent_executor = ADKAgentExecutor(runner, agent_card, run_config, show_agent)
+    agent_executor = ADKAgentExecutor(runner, agent_card, run_config, show_agent, stream_agents=stream_agents)
     request_handler = DefaultRequestHandler(agent_executor=agent_executor, task_store=InMemoryTaskStore())
     a2a_app = A2AStarletteApplication(agent_card=agent_card, http_handler=request_handler)
     app = a2a_app.build()
@@ -43,7 +43,8 @@ def before_agent_callback(callback_context: CallbackContext):
     # 每个步骤的历史
     state["step_history"] = []
     state["log"] = []
-    state["current_step_index"] = 0
+    # 已完成的步骤 id，依赖都在其中的步骤可以并发执行
+    state["completed_steps"] = []
 
     return None
 
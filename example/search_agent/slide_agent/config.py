@@ -1,4 +1,5 @@
 # 项目的基本配置
+import os
 
 PLAN_AGENT_CONFIG = {
     "provider": "openai",
@@ -8,6 +9,8 @@ PLAN_AGENT_CONFIG = {
 EXECUTE_AGENT_CONFIG = {
     "provider": "openai",
     "model": "gpt-4.1",
+    # 同时执行的无依赖步骤数
+    "max_parallel_steps": int(os.getenv("MAX_PARALLEL_STEPS", 8)),
 }
 
 SUMMARY_AGENT_CONFIG = {
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 """
 ExecuteLoopAgent（ADK LoopAgent）
-- StepExecuteSubAgent（LlmAgent）：按当前 step 执行，输出 step_result，并在 after 回调标记 needs_fix 等状态
+- ParallelStepExecutor（BaseAgent）：按 plan 中 steps 的 depends_on 找出依赖都已完成的步骤，每个步骤一个分支并发执行
+  StepExecuteSubAgent（LlmAgent），全部结束后按 plan 中的顺序把 step_result 合并进 step_history，并在失败时标记 needs_fix
 - FixPlanAgent：当 needs_fix=True 时修复 plan；当 needs_fix=False 时由 before 回调跳过
-- ExecuteControllerAgent（BaseAgent）：根据上一步状态推进 current_step_index 或终止 Loop
+- ExecuteControllerAgent（BaseAgent）：所有步骤完成或者没有可执行的步骤时终止 Loop
 """
 
+import asyncio
 import json
 import re
 from typing import Optional, Dict, Any, List, AsyncGenerator
@@ -53,7 +55,51 @@ def _extract_json(text: str) -> Optional[dict]:
     return None
 
 
-# ========== 1) 真正执行的子 Agent ==========
+# ========== 1) 步骤依赖 ==========
+
+def _step_id(step: Dict[str, Any], i: int) -> str:
+    return str(step.get("id") or f"s{i + 1}")
+
+
+def _step_dependencies(steps: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """
+    每个步骤依赖的步骤 id；没有 depends_on 字段的步骤（旧格式的计划、FixPlanAgent 新增的步骤）依赖前一步，保持顺序执行
+    """
+    ids = {_step_id(step, i) for i, step in enumerate(steps)}
+    deps: Dict[str, List[str]] = {}
+    prev = None
+    for i, step in enumerate(steps):
+        sid = _step_id(step, i)
+        depends_on = step.get("depends_on")
+        if depends_on is None:
+            depends_on = [prev] if prev else []
+        elif isinstance(depends_on, str):
+            depends_on = [depends_on]
+        # 不存在的 id（例如被 FixPlanAgent 删除的步骤）忽略
+        deps[sid] = [d for d in depends_on if d in ids and d != sid]
+        prev = sid
+    return deps
+
+
+def ready_steps(plan: Dict[str, Any], completed: List[str]) -> List[Dict[str, Any]]:
+    """依赖都已完成、自身还没完成的步骤，按 plan 中的顺序返回，步骤中的 id 一定存在"""
+    steps: List[Dict[str, Any]] = (plan or {}).get("steps") or []
+    deps = _step_dependencies(steps)
+    done = set(completed or [])
+    ready = []
+    for i, step in enumerate(steps):
+        sid = _step_id(step, i)
+        if sid not in done and all(d in done for d in deps[sid]):
+            ready.append({**step, "id": sid})
+    return ready
+
+
+def _result_key(step_id: str) -> str:
+    # 每个步骤单独一个 key，并发的分支写 state 时不会互相覆盖
+    return f"step_result_{step_id}"
+
+
+# ========== 2) 真正执行的子 Agent ==========
 
 def _decide_replan(step_result: Dict[str, Any]) -> bool:
     status = (step_result or {}).get("status", "success")
@@ -65,41 +111,23 @@ def _decide_replan(step_result: Dict[str, Any]) -> bool:
 
 def _after_execute_callback(callback_context: CallbackContext):
     """
-    累计 step_history；并在失败/阻塞时设置 needs_fix=True, last_failure=sr
-    同时记录 last_step_status 供控制器使用
+    把本分支的 step_result 写到 step_result_<step_id>，由 ParallelStepExecutor 统一合并
     """
-    # 1) 取本次模型输出
-    evt = callback_context._invocation_context.session.events[-1]
-    parts = getattr(evt.content, "parts", []) or []
-    text = "\n".join([getattr(p, "text", "") for p in parts if getattr(p, "text", None)]).strip()
-    data = _extract_json(text) or {}
-
-    state = callback_context.state or {}
-
-    # 2) 累积 step_history
-    sr = data.get("step_result")
-    if not sr:
-        state["last_step_status"] = None
+    ctx = callback_context._invocation_context
+    step = (callback_context.state.get("running_steps") or {}).get(ctx.branch)
+    if not step:
         return None
-    history: List[dict] = state.get("step_history", [])
-    history.append(sr)
-    state["step_history"] = history
-    state["last_step_status"] = sr.get("status")
-    state["last_step_id"] = sr.get("step_id")
-
-    # 3) 失败/阻塞 → 打标，交给 FixPlanAgent
-    if _decide_replan(sr):
-        state["needs_fix"] = True
-        state["last_failure"] = sr
-        state["log"].append({
-            "event": "need_fix_plan",
-            "reason": sr.get("notes", "need update"),
-            "step_id": sr.get("step_id"),
-            "status": sr.get("status")
-        })
-    else:
-        state["needs_fix"] = False  # 本步成功则清理
-
+    # 1) 取本分支最后一次模型输出，其它分支的事件可能已经追加在后面
+    text = ""
+    for evt in reversed(ctx.session.events):
+        if evt.branch == ctx.branch and evt.author == ctx.agent.name and evt.content and evt.content.parts:
+            text = "\n".join([getattr(p, "text", "") for p in evt.content.parts if getattr(p, "text", None)]).strip()
+            if text:
+                break
+    data = _extract_json(text) or {}
+    sr = data.get("step_result") or {"step_id": step["id"], "status": "failed", "notes": "没有返回 step_result"}
+    sr["step_id"] = step["id"]
+    callback_context.state[_result_key(step["id"])] = sr
     return None
 
 
@@ -107,7 +135,7 @@ class StepExecuteSubAgent(LlmAgent):
     def __init__(self, **kwargs):
         super().__init__(
             name="StepExecuteSubAgent",
-            description="按当前 step 调用工具并返回 step_result（JSON）",
+            description="按分配的 step 调用工具并返回 step_result（JSON）",
             model=create_model(EXECUTE_AGENT_CONFIG["model"], EXECUTE_AGENT_CONFIG["provider"]),
             instruction=self._dyn_instruction,
             tools=[PaperSearch,WebSearch],
@@ -116,36 +144,117 @@ class StepExecuteSubAgent(LlmAgent):
             **kwargs
         )
 
-    async def _run_async_impl(self, ctx: InvocationContext):
-        # 并行跑子 agents（父类会执行并流式产出事件）
-        logger.info(f"StepExecuteSubAgent开始工作，现有消息总数: {len(ctx.session.events)}")
-        ctx.session.events = ctx.session.events[:-3] #取后3个消息就行了，要不太多了
-        async for e in super()._run_async_impl(ctx):
-            yield e
     def _dyn_instruction(self, ctx: InvocationContext) -> str:
+        # 每个分支执行一个步骤，按分支名找到分配的步骤
         st = ctx.state or {}
-        plan = st.get("plan") or {}
-        steps: List[Dict[str, Any]] = plan.get("steps") or []
-        idx = int(st.get("current_step_index", 0))
-        if idx < 0 or idx >= len(steps):
-            # 越界：给最小上下文，ExecuteAgent 会返回 blocked
+        step = (st.get("running_steps") or {}).get(ctx._invocation_context.branch)
+        if not step:
+            # 没有分配步骤：给最小上下文，ExecuteAgent 会返回 blocked
             return EXECUTE_AGENT_PROMPT + "\n[step]\n```json\n{}\n```"
-        step = steps[idx]
         return EXECUTE_AGENT_PROMPT + "\n[step]\n```json\n" + json.dumps(step, ensure_ascii=False) + "\n```"
 
 
-# ========== 2) 控制推进/终止的 Agent ==========
+async def _merge_runs(runs: List[AsyncGenerator[Event, None]]) -> AsyncGenerator[Event, None]:
+    """
+    合并多个分支的事件流；每个分支的事件被上游处理（写入 session）之后，才继续取这个分支的下一个事件
+    """
+    tasks = {asyncio.ensure_future(run.__anext__()): run for run in runs}
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                run = tasks.pop(task)
+                try:
+                    event = task.result()
+                except StopAsyncIteration:
+                    continue
+                yield event
+                tasks[asyncio.ensure_future(run.__anext__())] = run
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class ParallelStepExecutor(BaseAgent):
+    """
+    每轮执行所有依赖已满足的步骤（最多 max_parallel_steps 个），每个步骤在独立的分支中运行，
+    分支只看到自己的工具调用，结束后按 plan 中的顺序合并结果，合并结果和完成的先后无关
+    """
+    max_parallel_steps: int = 8
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            name="ParallelStepExecutor",
+            description="并发执行依赖已满足的步骤",
+            sub_agents=[StepExecuteSubAgent()],
+            max_parallel_steps=EXECUTE_AGENT_CONFIG.get("max_parallel_steps", 8),
+            **kwargs
+        )
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        st = ctx.session.state or {}
+        completed: List[str] = list(st.get("completed_steps") or [])
+        ready = ready_steps(st.get("plan") or {}, completed)[:self.max_parallel_steps]
+        if not ready:
+            return
+        # 分支名包含步骤 id，重试同一步骤时能看到上次的工具调用，不同步骤互相看不到；
+        # adk 按分支名前缀判断可见性，id 用 [] 括起来，避免 s1 的分支是 s10 的前缀
+        prefix = f"{ctx.branch}.{self.name}" if ctx.branch else self.name
+        running = {f"{prefix}.step[{step['id']}]": step for step in ready}
+        logger.info(f"ParallelStepExecutor 并发执行 {len(running)} 个步骤: {[step['id'] for step in ready]}")
+        yield Event(invocation_id=ctx.invocation_id, author=self.name, branch=ctx.branch,
+                    actions=EventActions(state_delta={"running_steps": running}))
+
+        step_agent = self.sub_agents[0]
+        runs = [step_agent.run_async(ctx.model_copy(update={"branch": branch})) for branch in running]
+        async for event in _merge_runs(runs):
+            yield event
+
+        # 按 plan 中的顺序合并，保证 step_history 的顺序确定
+        st = ctx.session.state
+        history: List[dict] = list(st.get("step_history") or [])
+        log_events: List[dict] = list(st.get("log") or [])
+        delta: Dict[str, Any] = {"running_steps": {}}
+        failure = None
+        for step in ready:
+            sr = st.get(_result_key(step["id"])) or {"step_id": step["id"], "status": "failed", "notes": "没有返回 step_result"}
+            delta[_result_key(step["id"])] = None
+            history.append(sr)
+            if sr.get("status") == "success":
+                completed.append(step["id"])
+            # 3) 失败/阻塞 → 打标，交给 FixPlanAgent（一次修复第一个失败的步骤）
+            if failure is None and _decide_replan(sr):
+                failure = sr
+                log_events.append({
+                    "event": "need_fix_plan",
+                    "reason": sr.get("notes", "need update"),
+                    "step_id": sr.get("step_id"),
+                    "status": sr.get("status")
+                })
+        delta.update({
+            "step_history": history,
+            "completed_steps": completed,
+            "log": log_events,
+            "needs_fix": failure is not None,
+            "last_failure": failure,
+            "last_step_status": history[-1].get("status") if history else None,
+        })
+        yield Event(invocation_id=ctx.invocation_id, author=self.name, branch=ctx.branch,
+                    actions=EventActions(state_delta=delta))
+
+
+# ========== 3) 控制推进/终止的 Agent ==========
 class ControllerAgent(BaseAgent):
     """
     决策：
-    - 若 last_step_status == success：推进 current_step_index
-    - 若 failed/blocked：不推进，下一轮让 FixPlanAgent 修补后重试本步
-    - 若 current_step_index >= len(steps)：终止 Loop（escalate），转 Summary
+    - 若所有步骤都已完成：终止 Loop（escalate），转 Summary
+    - 若有失败/阻塞：不推进，下一轮让 FixPlanAgent 修补后重试
+    - 若还有未完成的步骤但依赖无法满足：终止 Loop，避免空转
     """
     def __init__(self, **kwargs):
         super().__init__(
             name="ExecuteControllerAgent",
-            description="根据上一步状态推进或终止执行循环",
+            description="根据步骤完成情况继续或终止执行循环",
             **kwargs
         )
 
@@ -154,33 +263,29 @@ class ControllerAgent(BaseAgent):
         plan = st.get("plan") or {}
         steps: List[Dict[str, Any]] = plan.get("steps") or []
 
-        idx = int(st.get("current_step_index", 0))
-        last_status = st.get("last_step_status")
-
-        # 若越界或为空 → 直接终止
-        if not steps or idx >= len(steps):
-            # 没有可执行步骤，或已完成所有步骤
-            yield Event(author=self.name, actions=EventActions(escalate=True))
+        # 若为空 → 直接终止
+        if not steps:
+            yield Event(invocation_id=ctx.invocation_id, author=self.name, actions=EventActions(escalate=True))
             return
 
-        if last_status == "success":
-            # 推进到下一步
-            st["current_step_index"] = idx + 1
-            st["last_step_status"] = None  # 清理本轮标记
-
-        # 终止判断：推进后是否结束
-        new_idx = int(st.get("current_step_index", 0))
-        if new_idx >= len(steps):
+        completed = st.get("completed_steps") or []
+        if not ready_steps(plan, completed):
+            remaining = [_step_id(step, i) for i, step in enumerate(steps) if _step_id(step, i) not in set(completed)]
+            delta = {"phase": "SUMMARY"}
+            if remaining and not st.get("needs_fix"):
+                # 依赖成环或者依赖了失败后被删掉的步骤
+                logger.warning(f"ExecuteController 剩余步骤的依赖无法满足: {remaining}")
+                delta["log"] = list(st.get("log") or []) + [{"event": "unsatisfiable_dependencies", "steps": remaining}]
             # 所有步骤完成，允许进入总结
-            st["phase"] = "SUMMARY"
-            yield Event(author=self.name, actions=EventActions(escalate=True))
+            yield Event(invocation_id=ctx.invocation_id, author=self.name,
+                        actions=EventActions(state_delta=delta, escalate=True))
             return
 
-        # 其余情况（首次进入 / 失败待修复 / 修复后需重试）：不做额外动作，交给下一轮 Loop
+        # 其余情况（还有可执行的步骤 / 修复后需重试）：不做额外动作，交给下一轮 Loop
         return
 
 
-# ========== 3) Loop 入口 ==========
+# ========== 4) Loop 入口 ==========
 def _before_loop_callback(callback_context: CallbackContext):
     """
     Loop 启动前的一次性初始化
@@ -188,6 +293,8 @@ def _before_loop_callback(callback_context: CallbackContext):
     st = callback_context.state or {}
     st["needs_fix"] = False
     st["last_step_status"] = None
+    st["completed_steps"] = []
+    st["running_steps"] = {}
     return None
 
 
@@ -195,7 +302,7 @@ execute_loop_agent = LoopAgent(
     name="ExecuteLoopAgent",
     max_iterations=500,  # 给足量，依赖控制器来终止
     sub_agents=[
-        StepExecuteSubAgent(),   # 1) 执行当前步骤
+        ParallelStepExecutor(),  # 1) 并发执行依赖已满足的步骤
         fix_plan_agent,          # 2) 失败/阻塞时修复（无需修复则跳过）
         ControllerAgent() # 3) 推进/终止
     ],
@@ -38,6 +38,7 @@ FIX_PLAN_AGENT_PROMPT = r"""
 - patch 内的 step.id 必须全局唯一。
 - 修订必须直指阻塞原因（如：外部依赖缺失→显式添加“准备/拉取依赖”的步骤；信息不足→添加“澄清/收集”的步骤；工具错误→替换 assignee 或补充 inputs）。
 - 如需调整后续步骤顺序，请在 patch 中体现（通过 remove+append/insert 来重排）。
+- 新增或替换的步骤要写 `depends_on`（必须先完成的步骤 id，独立步骤为空列表）；不写时默认依赖计划中的前一步。
 
 仅输出 JSON。
 """
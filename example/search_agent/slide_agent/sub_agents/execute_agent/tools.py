@@ -10,6 +10,9 @@ import re
 import os
 import time
 import httpx
+import asyncio
+import weakref
+from collections import OrderedDict
 from datetime import datetime
 import random
 import dotenv
@@ -17,12 +20,81 @@ import hashlib
 from google.adk.tools import ToolContext
 import requests
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from ...reference_store import register_articles
 dotenv.load_dotenv()
 
-def search_api(keyword: str, limit: int = 4, search_engine="paper"):
+# 单次搜索请求的超时秒数（读取）和建立连接的超时秒数
+SEARCH_API_TIMEOUT = float(os.getenv("SEARCH_API_TIMEOUT", 30))
+SEARCH_API_CONNECT_TIMEOUT = float(os.getenv("SEARCH_API_CONNECT_TIMEOUT", 5))
+# 超时、连接错误或者5xx时的重试次数
+SEARCH_API_RETRIES = int(os.getenv("SEARCH_API_RETRIES", 2))
+# 连接池大小，所有会话的工具调用共用
+SEARCH_API_MAX_CONNECTIONS = int(os.getenv("SEARCH_API_MAX_CONNECTIONS", 20))
+# 相同关键词的搜索结果缓存秒数，0表示不缓存
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 600))
+# 最多缓存的关键词数量
+SEARCH_CACHE_ITEMS = int(os.getenv("SEARCH_CACHE_ITEMS", 512))
+
+# AsyncClient 绑定创建它的事件循环，每个事件循环一个客户端，循环内复用连接
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+# (keyword, limit, search_engine) -> (过期时间, 结果)
+_search_cache: "OrderedDict[Tuple[str, int, str], Tuple[float, dict]]" = OrderedDict()
+# 正在进行的搜索，相同的关键词同时被多个步骤搜索时只请求一次
+_inflight: Dict[Tuple[int, str, int, str], asyncio.Task] = {}
+
+
+def _get_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(SEARCH_API_TIMEOUT, connect=SEARCH_API_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=SEARCH_API_MAX_CONNECTIONS,
+                                max_keepalive_connections=SEARCH_API_MAX_CONNECTIONS),
+            headers={'content-type': 'application/json'},
+            trust_env=False,
+        )
+        _clients[loop] = client
+    return client
+
+
+async def _post_search(data: dict) -> dict:
+    SEARCH_TOOL_API = os.environ["SEARCH_TOOL_API"]
+    url = f"{SEARCH_TOOL_API}/api/search_keyword"
+    client = _get_client()
+    for attempt in range(SEARCH_API_RETRIES + 1):
+        start_time = time.time()
+        try:
+            resp = await client.post(url, json=data)
+            took = time.time() - start_time
+            print(f"[search] status={resp.status_code}, took={took:.2f}s")
+            if 400 <= resp.status_code < 500:
+                # 4xx 是请求本身的问题，重试也不会成功
+                print(f"[search] 关键词{data['keyword']}搜索失败: status={resp.status_code}")
+                return {"keyword": data["keyword"], "count": 0, "articles": [], "error": f"status={resp.status_code}"}
+            if resp.status_code < 400:
+                try:
+                    return resp.json()
+                except ValueError as e:
+                    print(f"[search] 关键词{data['keyword']}返回的不是合法的JSON: {e}")
+                    return {"keyword": data["keyword"], "count": 0, "articles": [], "error": f"invalid json: {e}"}
+            error = f"status={resp.status_code}"
+        except httpx.TransportError as e:
+            # 包括超时和连接错误
+            error = repr(e)
+        if attempt < SEARCH_API_RETRIES:
+            wait_seconds = 0.5 * 2 ** attempt + random.random() * 0.2
+            print(f"[search] 关键词{data['keyword']}第{attempt + 1}次搜索失败({error})，{wait_seconds:.1f}秒后重试")
+            await asyncio.sleep(wait_seconds)
+    print(f"[search] 关键词{data['keyword']}搜索失败: {error}")
+    return {"keyword": data["keyword"], "count": 0, "articles": [], "error": error}
+
+
+async def search_api(keyword: str, limit: int = 4, search_engine="paper"):
     """
-    调用搜索接口进行搜索
+    调用搜索接口进行搜索，使用连接池异步请求，不阻塞事件循环；相同的关键词在 SEARCH_CACHE_TTL 秒内直接返回缓存的结果，
+    返回的结果可能是缓存中的同一个对象，不要修改
     search_engine: paper: 代表搜索全文，abstract代表搜索摘要
     Returns:
         results: list[dict], 每个元素的内容包括下面的4个字段
@@ -31,19 +103,48 @@ def search_api(keyword: str, limit: int = 4, search_engine="paper"):
     'mode' = {str} 'search'
     'articles' = {list: 4} [{'file_id': '3f1fa5613fd19227', 'id': 'afd95dc1-7006-445d-827f-6bd891f1dc30', 'publish_time': '2022-12-27 17:41:17', 'score': 1.0, 'snippet': '文献\nID\n原名\n：\nMex3a marks drug-tolerant persister colorectal cancer cells that mediate relapse after chemotherapy\n译名：\nMex3...企业等。公司具备持续的创新能力，\n通过自主研发累计申请80余项核心专利与PCT专利，目前，已获得近50项授\n权。\n联系我们\n座机：400-990-8020\n企业邮箱：CXGJ@accibio.com\n网站：www.3dbudcare.com', 'title': '文献解读 I 肿瘤类器官模型助力挖掘新结直肠肿瘤细胞群化疗耐药新机制(下)', 'url': 'https://mp.weixin.qq.com/s?src=11&timestamp=1756956639&ver=6215&signature=RnUZANNR5sdS2TyxG*BzDg6Bp5M254GzGMbvA9vcdGsiLxMOf0F*77QeeHOwzuwocfCR80rhvA714gsXTH14pgdwW1wtGnv6eiyaVGef1yWtXb6-peV6kv2DkR1H5JOX&new=1'}, {'file_id': '180ce626b48991de', 'id': 'e3d12b48-872a-40af-aeff-0fa47cb73a30', 'publish_time': '2022-10-31 09:59:31', 'score': 1.0, 'snippet': '2022年8月天津医科大学肿瘤医院胸外科Zhentao Yu, Haiyang Zhang和Yi Ba（通讯作者）团队在Advanced Science期刊（影响因子17.521）上发表了一篇题为“Adipocyte-derived exosomal...养基试剂盒（Cat# K2O-M-CO）进行相关结直肠癌类器官模型的构建及扩增。我公司除了结直肠癌类器官培养基试剂盒...
     """
-    SEARCH_TOOL_API = os.environ["SEARCH_TOOL_API"]
-    url = f"{SEARCH_TOOL_API}/api/search_keyword"
-    data = {
-        "keyword": keyword,
-        "limit": limit,
-        "search_engine": search_engine,
-    }
-    headers = {'content-type': 'application/json'}
-    start_time = time.time()
-    resp = httpx.post(url, json=data, headers=headers, timeout=None, trust_env=False)
-    took = time.time() - start_time
-    print(f"[search] status={resp.status_code}, took={took:.2f}s")
-    return resp.json()
+    cache_key = (" ".join(keyword.split()), limit, search_engine)
+    cached = _search_cache.get(cache_key)
+    if cached is not None:
+        if cached[0] > time.time():
+            _search_cache.move_to_end(cache_key)
+            print(f"[search] 命中缓存: {keyword}")
+            return cached[1]
+        del _search_cache[cache_key]
+
+    loop = asyncio.get_running_loop()
+    inflight_key = (id(loop),) + cache_key
+    task = _inflight.get(inflight_key)
+    if task is None:
+        # 请求在单独的 task 中执行，某个调用方被取消时不会取消其它等待同一个结果的调用方
+        data = {
+            "keyword": keyword,
+            "limit": limit,
+            "search_engine": search_engine,
+        }
+        task = asyncio.ensure_future(_search_and_cache(cache_key, data))
+        _inflight[inflight_key] = task
+        task.add_done_callback(lambda done: _search_done(inflight_key, done))
+    return await asyncio.shield(task)
+
+
+async def _search_and_cache(cache_key: Tuple[str, int, str], data: dict) -> dict:
+    results = await _post_search(data)
+    # 出错和没有结果的不缓存，下次重新搜索
+    if SEARCH_CACHE_TTL > 0 and results.get("articles") and not results.get("error"):
+        _search_cache[cache_key] = (time.time() + SEARCH_CACHE_TTL, results)
+        while len(_search_cache) > SEARCH_CACHE_ITEMS:
+            _search_cache.popitem(last=False)
+    return results
+
+
+def _search_done(inflight_key: Tuple[int, str, int, str], task: asyncio.Task):
+    if _inflight.get(inflight_key) is task:
+        del _inflight[inflight_key]
+    # 没有其它调用方等待时，避免 "Task exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
 
 async def DocumentSearch(
     keyword: str,
@@ -58,14 +159,11 @@ async def DocumentSearch(
     print(f"Agent {agent_name} 正在调用工具：DocumentSearch: " + keyword)
     metadata = tool_context.state.get("metadata", {})
     print(f"调用工具：DocumentSearch时传入的metadata: {metadata}")
-    # 从工具上下文中获取或初始化 references 字典
-    # 现在 references 将存储更详细的文档信息
-    references = tool_context.state.get("references", {})
-    print(f"调用工具：DocumentSearch时传入的references: {references}")
+    print(f"调用工具：DocumentSearch时已有的references数量: {len(tool_context.state.get('references') or {})}")
     print("文档检索: " + keyword)
 
     start_time = time.time()
-    results = search_api(keyword, limit=10, search_engine="paper")
+    results = await search_api(keyword, limit=10, search_engine="paper")
     if not results or not results.get("articles"):
         return f"没有搜索到{keyword}相关的文章"
 
@@ -73,45 +171,27 @@ async def DocumentSearch(
     end_time = time.time()
     print(f"关键词{keyword}相关的文章已经获取完毕，获取到{len(articles)}篇, 耗时{end_time - start_time}秒")
 
-    # 遍历新搜索到的文章，并更新 references 字典
-    # 确保 references 字典中包含所有所需的信息
-    for article_dict in articles:
-        file_id = article_dict["file_id"]
-        # 如果该文档ID不在 references 中，则添加它
-        if file_id not in references:
-            # 使用当前 references 的长度作为新文档的索引值
-            idx_val = len(references) + 1
-            article_url = article_dict["url"]
-            article_title = article_dict["title"]
-            if not article_url:
-                article_url = "https://www.bing.com/search?q=" + article_title
-            references[file_id] = {
-                "idx_val": idx_val,
-                "file_id": file_id,
-                "title": article_dict["title"],
-                "publish_time": article_dict["publish_time"],
-                "snippet": article_dict["snippet"],
-                "url": article_url
-            }
+    # 搜索完成后再读取 references，中间没有 await，并发的工具调用登记的文档不会互相覆盖
+    references = tool_context.state.get("references")
+    if references is None:
+        references = {}
+    # 完整的 snippet 保存在 reference_store 中，references 只保留编号和预览
+    reference_entries = register_articles(references, articles, tool_context._invocation_context.session.id)
 
     # 准备返回给用户的新文章内容列表
     articles_content = []
-    for article_dict in articles:
-        file_id = article_dict["file_id"]
-        # 从更新后的 references 字典中获取完整的文档信息
-        reference_info = references.get(file_id, {})
-
-        # 提取所需的信息来格式化输出字符串
-        idx_val = reference_info.get("idx_val", "N/A")
-        title = reference_info.get("title", "N/A")
-        publish_time = reference_info.get("publish_time", "N/A")
-        snippet_content = reference_info.get("snippet", "N/A")
+    for article_dict, reference_info in zip(articles, reference_entries):
+        file_id = reference_info["file_id"]
+        idx_val = reference_info["idx_val"]
+        title = reference_info["title"] or "N/A"
+        publish_time = reference_info["publish_time"] or "N/A"
+        snippet_content = article_dict.get("snippet") or "N/A"
 
         articles_content.append(
             f"{idx_val}. {title}\n时间: {publish_time}\n内容: {snippet_content}"
         )
 
-    # 重新设置 tool_context 中的 references
+    # 写回 tool_context，记录到这次工具调用的 state_delta
     tool_context.state["references"] = references
 
     return articles_content
@@ -129,14 +209,11 @@ async def PaperSearch(
     print(f"Agent {agent_name} 正在调用工具：DocumentSearch: " + keyword)
     metadata = tool_context.state.get("metadata", {})
     print(f"调用工具：DocumentSearch时传入的metadata: {metadata}")
-    # 从工具上下文中获取或初始化 references 字典
-    # 现在 references 将存储更详细的文档信息
-    references = tool_context.state.get("references", {})
-    print(f"调用工具：DocumentSearch时传入的references: {references}")
+    print(f"调用工具：DocumentSearch时已有的references数量: {len(tool_context.state.get('references') or {})}")
     print("文档检索: " + keyword)
 
     start_time = time.time()
-    results = search_api(keyword, limit=10, search_engine="paper")
+    results = await search_api(keyword, limit=10, search_engine="paper")
     if not results or not results.get("articles"):
         return f"没有搜索到{keyword}相关的文章"
 
@@ -144,45 +221,27 @@ async def PaperSearch(
     end_time = time.time()
     print(f"关键词{keyword}相关的文章已经获取完毕，获取到{len(articles)}篇, 耗时{end_time - start_time}秒")
 
-    # 遍历新搜索到的文章，并更新 references 字典
-    # 确保 references 字典中包含所有所需的信息
-    for article_dict in articles:
-        file_id = article_dict["file_id"]
-        # 如果该文档ID不在 references 中，则添加它
-        if file_id not in references:
-            # 使用当前 references 的长度作为新文档的索引值
-            idx_val = len(references) + 1
-            article_url = article_dict["url"]
-            article_title = article_dict["title"]
-            if not article_url:
-                article_url = "https://www.bing.com/search?q=" + article_title
-            references[file_id] = {
-                "idx_val": idx_val,
-                "file_id": file_id,
-                "title": article_dict["title"],
-                "publish_time": article_dict["publish_time"],
-                "snippet": article_dict["snippet"],
-                "url": article_url
-            }
+    # 搜索完成后再读取 references，中间没有 await，并发的工具调用登记的文档不会互相覆盖
+    references = tool_context.state.get("references")
+    if references is None:
+        references = {}
+    # 完整的 snippet 保存在 reference_store 中，references 只保留编号和预览
+    reference_entries = register_articles(references, articles, tool_context._invocation_context.session.id)
 
     # 准备返回给用户的新文章内容列表
     articles_content = []
-    for article_dict in articles:
-        file_id = article_dict["file_id"]
-        # 从更新后的 references 字典中获取完整的文档信息
-        reference_info = references.get(file_id, {})
-
-        # 提取所需的信息来格式化输出字符串
-        idx_val = reference_info.get("idx_val", "N/A")
-        title = reference_info.get("title", "N/A")
-        publish_time = reference_info.get("publish_time", "N/A")
-        snippet_content = reference_info.get("snippet", "N/A")
+    for article_dict, reference_info in zip(articles, reference_entries):
+        file_id = reference_info["file_id"]
+        idx_val = reference_info["idx_val"]
+        title = reference_info["title"] or "N/A"
+        publish_time = reference_info["publish_time"] or "N/A"
+        snippet_content = article_dict.get("snippet") or "N/A"
 
         articles_content.append(
             f"{idx_val}. {title}\n时间: {publish_time}\n内容: {snippet_content}\n\n\n\n"
         )
 
-    # 重新设置 tool_context 中的 references
+    # 写回 tool_context，记录到这次工具调用的 state_delta
     tool_context.state["references"] = references
 
     return articles_content
@@ -201,14 +260,11 @@ async def AbstractSearch(
     print(f"Agent {agent_name} 正在调用工具：DocumentSearch: " + keyword)
     metadata = tool_context.state.get("metadata", {})
     print(f"调用工具：DocumentSearch时传入的metadata: {metadata}")
-    # 从工具上下文中获取或初始化 references 字典
-    # 现在 references 将存储更详细的文档信息
-    references = tool_context.state.get("references", {})
-    print(f"调用工具：DocumentSearch时传入的references: {references}")
+    print(f"调用工具：DocumentSearch时已有的references数量: {len(tool_context.state.get('references') or {})}")
     print("文档检索: " + keyword)
 
     start_time = time.time()
-    results = search_api(keyword, limit=10, search_engine="abstract")
+    results = await search_api(keyword, limit=10, search_engine="abstract")
     if not results or not results.get("articles"):
         return f"没有搜索到{keyword}相关的文章"
 
@@ -216,45 +272,27 @@ async def AbstractSearch(
     end_time = time.time()
     print(f"关键词{keyword}相关的文章已经获取完毕，获取到{len(articles)}篇, 耗时{end_time - start_time}秒")
 
-    # 遍历新搜索到的文章，并更新 references 字典
-    # 确保 references 字典中包含所有所需的信息
-    for article_dict in articles:
-        file_id = article_dict["file_id"]
-        # 如果该文档ID不在 references 中，则添加它
-        if file_id not in references:
-            # 使用当前 references 的长度作为新文档的索引值
-            idx_val = len(references) + 1
-            article_url = article_dict["url"]
-            article_title = article_dict["title"]
-            if not article_url:
-                article_url = "https://www.bing.com/search?q=" + article_title
-            references[file_id] = {
-                "idx_val": idx_val,
-                "file_id": file_id,
-                "title": article_dict["title"],
-                "publish_time": article_dict["publish_time"],
-                "snippet": article_dict["snippet"],
-                "url": article_url
-            }
+    # 搜索完成后再读取 references，中间没有 await，并发的工具调用登记的文档不会互相覆盖
+    references = tool_context.state.get("references")
+    if references is None:
+        references = {}
+    # 完整的 snippet 保存在 reference_store 中，references 只保留编号和预览
+    reference_entries = register_articles(references, articles, tool_context._invocation_context.session.id)
 
     # 准备返回给用户的新文章内容列表
     articles_content = []
-    for article_dict in articles:
-        file_id = article_dict["file_id"]
-        # 从更新后的 references 字典中获取完整的文档信息
-        reference_info = references.get(file_id, {})
-
-        # 提取所需的信息来格式化输出字符串
-        idx_val = reference_info.get("idx_val", "N/A")
-        title = reference_info.get("title", "N/A")
-        publish_time = reference_info.get("publish_time", "N/A")
-        snippet_content = reference_info.get("snippet", "N/A")
+    for article_dict, reference_info in zip(articles, reference_entries):
+        file_id = reference_info["file_id"]
+        idx_val = reference_info["idx_val"]
+        title = reference_info["title"] or "N/A"
+        publish_time = reference_info["publish_time"] or "N/A"
+        snippet_content = article_dict.get("snippet") or "N/A"
 
         articles_content.append(
             f"{idx_val}. {title}\n时间: {publish_time}\n内容: {snippet_content}"
         )
 
-    # 重新设置 tool_context 中的 references
+    # 写回 tool_context，记录到这次工具调用的 state_delta
     tool_context.state["references"] = references
 
     return articles_content
@@ -272,14 +310,11 @@ async def WebSearch(
     print(f"Agent {agent_name} 正在调用工具：DocumentSearch: " + keyword)
     metadata = tool_context.state.get("metadata", {})
     print(f"调用工具：DocumentSearch时传入的metadata: {metadata}")
-    # 从工具上下文中获取或初始化 references 字典
-    # 现在 references 将存储更详细的文档信息
-    references = tool_context.state.get("references", {})
-    print(f"调用工具：DocumentSearch时传入的references: {references}")
+    print(f"调用工具：DocumentSearch时已有的references数量: {len(tool_context.state.get('references') or {})}")
     print("文档检索: " + keyword)
 
     start_time = time.time()
-    results = search_api(keyword, limit=10, search_engine="zhipu")
+    results = await search_api(keyword, limit=10, search_engine="zhipu")
     if not results or not results.get("articles"):
         return f"没有搜索到{keyword}相关的文章"
 
@@ -287,45 +322,27 @@ async def WebSearch(
     end_time = time.time()
     print(f"关键词{keyword}相关的文章已经获取完毕，获取到{len(articles)}篇, 耗时{end_time - start_time}秒")
 
-    # 遍历新搜索到的文章，并更新 references 字典
-    # 确保 references 字典中包含所有所需的信息
-    for article_dict in articles:
-        file_id = article_dict["file_id"]
-        # 如果该文档ID不在 references 中，则添加它
-        if file_id not in references:
-            # 使用当前 references 的长度作为新文档的索引值
-            idx_val = len(references) + 1
-            article_url = article_dict["url"]
-            article_title = article_dict["title"]
-            if not article_url:
-                article_url = "https://www.bing.com/search?q=" + article_title
-            references[file_id] = {
-                "idx_val": idx_val,
-                "file_id": file_id,
-                "title": article_dict["title"],
-                "publish_time": article_dict["publish_time"],
-                "snippet": article_dict["snippet"],
-                "url": article_url
-            }
+    # 搜索完成后再读取 references，中间没有 await，并发的工具调用登记的文档不会互相覆盖
+    references = tool_context.state.get("references")
+    if references is None:
+        references = {}
+    # 完整的 snippet 保存在 reference_store 中，references 只保留编号和预览
+    reference_entries = register_articles(references, articles, tool_context._invocation_context.session.id)
 
     # 准备返回给用户的新文章内容列表
     articles_content = []
-    for article_dict in articles:
-        file_id = article_dict["file_id"]
-        # 从更新后的 references 字典中获取完整的文档信息
-        reference_info = references.get(file_id, {})
-
-        # 提取所需的信息来格式化输出字符串
-        idx_val = reference_info.get("idx_val", "N/A")
-        title = reference_info.get("title", "N/A")
-        publish_time = reference_info.get("publish_time", "N/A")
-        snippet_content = reference_info.get("snippet", "N/A")
+    for article_dict, reference_info in zip(articles, reference_entries):
+        file_id = reference_info["file_id"]
+        idx_val = reference_info["idx_val"]
+        title = reference_info["title"] or "N/A"
+        publish_time = reference_info["publish_time"] or "N/A"
+        snippet_content = article_dict.get("snippet") or "N/A"
 
         articles_content.append(
             f"{idx_val}. {title}\n时间: {publish_time}\n内容: {snippet_content}"
         )
 
-    # 重新设置 tool_context 中的 references
+    # 写回 tool_context，记录到这次工具调用的 state_delta
     tool_context.state["references"] = references
 
     return articles_content
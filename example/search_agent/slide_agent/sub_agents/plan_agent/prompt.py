@@ -17,6 +17,7 @@ PLAN_AGENT_PROMPT = r"""
       {
         "id": "s1",
         "title": "简明动作标题",
+        "depends_on": [],
         "inputs": {"key": "value"}
       }
     ]
@@ -24,7 +25,8 @@ PLAN_AGENT_PROMPT = r"""
 }
 
 ### 规则
-- 步骤需 **原子化**、**有顺序**、数量 2-5 步为宜。
+- 步骤需 **原子化**、数量 2-8 步为宜。
+- `depends_on` 填写必须先完成的步骤 id；互相独立的步骤（例如不同关键词的检索）`depends_on` 为空，会被并发执行。
 - `inputs` 尽量小而准，便于工具调用。
 - 若用户需求含外部依赖，请在 `assumptions` 中标注（如“可访问互联网”）。
 